@@ -0,0 +1,305 @@
+# Bulk transfer of ingestion parquets to an object store and batched BigQuery table loads
+# Uploads run on a bounded thread pool. Objects already present with the same MD5 are skipped, so an
+# interrupted run resumes where it stopped simply by running it again. Large files (state-level parquets)
+# go up as chunked resumable uploads, so a dropped connection retries one chunk instead of the whole file.
+#
+# County files are loaded into BigQuery with a few wildcard load jobs (e.g. one URI 'AK_*.parquet' per
+# state, several states per job) instead of one load job + one INSERT per file. Finished batches are
+# logged, so loads resume the same way.
+#
+# Two stores are provided:
+#   - GCSObjectStore: a Google Cloud Storage bucket (google-cloud-storage is imported on first use)
+#   - LocalObjectStore: a filesystem-backed stand-in with the same interface, to run and time the
+#     uploader without GCP credentials
+
+# Importing required libraries
+import os
+import base64
+import hashlib
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+if __package__:
+    from .instrumentation import span, traced
+else:
+    from instrumentation import span, traced
+
+# Files from this size up are uploaded in chunks
+LARGE_FILE_BYTES = 64 * 1024 ** 2
+# Chunk size of resumable uploads (GCS needs a multiple of 256 KiB)
+UPLOAD_CHUNK_BYTES = 32 * 1024 ** 2
+# Parallel uploads; uploads are network bound, so more threads than cores is fine
+DEFAULT_UPLOAD_WORKERS = 16
+
+# BigQuery accepts up to 10,000 source URIs per load job and one '*' per URI
+MAX_URIS_PER_LOAD_JOB = 10000
+
+
+def local_md5(path: str, block_size: int = 8 * 1024 ** 2) -> str:
+    '''Base64 MD5 of a local file, in the format GCS reports as md5_hash.'''
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return base64.b64encode(digest.digest()).decode('ascii')
+
+
+# --- Object stores ---
+class GCSObjectStore:
+    '''Google Cloud Storage bucket.'''
+    def __init__(self, bucket_name: str, client=None):
+        if client is None:
+            from google.cloud import storage
+            client = storage.Client()
+        self.client = client
+        self.bucket_name = bucket_name
+        self.bucket = client.bucket(bucket_name)
+
+    def uri(self, name: str) -> str:
+        return f"gs://{self.bucket_name}/{name}"
+
+    def list_hashes(self, prefix: str) -> dict:
+        '''{object name: base64 MD5} of every object under prefix, from a single listing.'''
+        return {blob.name: blob.md5_hash for blob in self.client.list_blobs(self.bucket_name, prefix=prefix)}
+
+    def list_sizes(self, prefix: str) -> dict:
+        return {blob.name: blob.size for blob in self.client.list_blobs(self.bucket_name, prefix=prefix)}
+
+    def upload(self, local_path: str, name: str, chunk_size: int = None):
+        '''
+        Uploads local_path as name, validated against its MD5.
+        With chunk_size the upload is a resumable session sent chunk by chunk; failed chunks are retried.
+        '''
+        from google.cloud.storage.retry import DEFAULT_RETRY
+        blob = self.bucket.blob(name, chunk_size=chunk_size)
+        blob.upload_from_filename(local_path, checksum='md5', retry=DEFAULT_RETRY)
+
+
+class LocalObjectStore:
+    '''
+    Filesystem stand-in for an object store: object names are paths under root.
+    Chunked uploads write a '.partial' file that a later attempt continues from, then rename it into place.
+    '''
+    PARTIAL_SUFFIX = '.partial'
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, *name.split('/'))
+
+    def uri(self, name: str) -> str:
+        return self._path(name)
+
+    def _objects(self, prefix: str):
+        for folder, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith(self.PARTIAL_SUFFIX):
+                    continue
+                path = os.path.join(folder, filename)
+                name = os.path.relpath(path, self.root).replace(os.sep, '/')
+                if name.startswith(prefix):
+                    yield name, path
+
+    def list_hashes(self, prefix: str) -> dict:
+        return {name: local_md5(path) for name, path in self._objects(prefix)}
+
+    def list_sizes(self, prefix: str) -> dict:
+        return {name: os.path.getsize(path) for name, path in self._objects(prefix)}
+
+    def upload(self, local_path: str, name: str, chunk_size: int = None):
+        target = self._path(name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if chunk_size is None:
+            shutil.copyfile(local_path, target + self.PARTIAL_SUFFIX)
+        else:
+            partial = target + self.PARTIAL_SUFFIX
+            offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+            if offset > os.path.getsize(local_path):
+                offset = 0
+            with open(local_path, 'rb') as src, open(partial, 'r+b' if offset else 'wb') as dst:
+                src.seek(offset)
+                dst.seek(offset)
+                dst.truncate()
+                for chunk in iter(lambda: src.read(chunk_size), b''):
+                    dst.write(chunk)
+        if local_md5(target + self.PARTIAL_SUFFIX) != local_md5(local_path):
+            os.remove(target + self.PARTIAL_SUFFIX)
+            raise IOError(f"Checksum mismatch uploading {local_path} to {name}")
+        os.replace(target + self.PARTIAL_SUFFIX, target)
+
+
+# --- Uploads ---
+@traced(name='bulk_upload')
+def upload_files(
+        store,
+        files: list,
+        destination_prefix: str = '',
+        max_workers: int = DEFAULT_UPLOAD_WORKERS,
+        large_file_bytes: int = LARGE_FILE_BYTES,
+        chunk_size: int = UPLOAD_CHUNK_BYTES,
+        remove_local_files: bool = False) -> dict:
+    '''
+    Uploads (local_path, object_name) pairs to store. Objects under destination_prefix whose MD5 already
+    matches the local file are skipped; files of large_file_bytes or more are uploaded in chunks.
+    Failures are collected instead of stopping the other uploads.
+
+    Returns:
+    dict with lists 'uploaded', 'skipped' and 'failed' (object name, error) pairs.
+    '''
+    remote_hashes = store.list_hashes(destination_prefix)
+    result = {'uploaded': [], 'skipped': [], 'failed': []}
+    lock = threading.Lock()
+
+    def upload_one(local_path, name):
+        size = os.path.getsize(local_path)
+        with span('upload', object_name=name, bytes=size):
+            if remote_hashes.get(name) == local_md5(local_path):
+                outcome = 'skipped'
+            else:
+                store.upload(local_path, name, chunk_size=chunk_size if size >= large_file_bytes else None)
+                outcome = 'uploaded'
+        if remove_local_files:
+            os.remove(local_path)
+        with lock:
+            result[outcome].append(name)
+            done = len(result['uploaded']) + len(result['skipped']) + len(result['failed'])
+        print(f"[{done}/{len(files)}] {outcome} {name}")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(upload_one, local_path, name): name for local_path, name in files}
+        for future in as_completed(futures):
+            error = future.exception()
+            if error is not None:
+                print(f"Failed to upload {futures[future]}: {error}")
+                result['failed'].append((futures[future], error))
+
+    print(f"Uploaded {len(result['uploaded'])}, skipped {len(result['skipped'])} unchanged, {len(result['failed'])} failed.")
+    return result
+
+
+def upload_folder(store, source_folder: str, destination_prefix: str, suffixes: tuple = ('.parquet',), **kwargs) -> dict:
+    '''Uploads the files of source_folder ending in one of suffixes to destination_prefix (see upload_files).'''
+    destination_prefix = destination_prefix.rstrip('/') + '/'
+    files = [
+        (os.path.join(source_folder, filename), destination_prefix + filename)
+        for filename in sorted(os.listdir(source_folder))
+        if filename.endswith(suffixes) and os.path.isfile(os.path.join(source_folder, filename))
+    ]
+    return upload_files(store, files, destination_prefix, **kwargs)
+
+
+# --- Batched BigQuery loads ---
+def state_of(name: str) -> str:
+    '''State abbreviation of a '{state}_{fips}_{layer}.parquet' object name.'''
+    return os.path.basename(name).split('_')[0]
+
+
+def wildcard_batches(store, prefix: str, suffix: str = '.parquet', group_of=state_of, groups_per_job: int = 10, max_bytes_per_job: int = None) -> list:
+    '''
+    Groups the objects under prefix into load batches of wildcard URIs, one per group
+    ('gs://bucket/prefix/AK_*.parquet' for state_of). A group is only emitted as a wildcard when the
+    wildcard matches exactly its objects; other objects in it are listed one by one.
+    Batches hold at most groups_per_job groups and, when max_bytes_per_job is given, about that many bytes.
+
+    Returns:
+    list of (batch key, [URIs]) in a stable order; the key identifies the batch in the progress log.
+    '''
+    sizes = {name: size for name, size in store.list_sizes(prefix).items() if name.endswith(suffix)}
+    groups = {}
+    for name in sorted(sizes):
+        groups.setdefault(group_of(name), []).append(name)
+
+    def group_uris(group, names):
+        folder = os.path.dirname(names[0])
+        pattern = f"{folder}/{group}_" if folder else f"{group}_"
+        matched = [name for name in sizes if name.startswith(pattern)]
+        if all(os.path.dirname(name) == folder for name in names) and sorted(matched) == names:
+            return [store.uri(f"{pattern}*{suffix}")]
+        return [store.uri(name) for name in names]
+
+    batches, current, current_bytes = [], [], 0
+    for group, names in groups.items():
+        group_bytes = sum(sizes[name] for name in names)
+        if current and (len(current) >= groups_per_job or (max_bytes_per_job and current_bytes + group_bytes > max_bytes_per_job)):
+            batches.append(current)
+            current, current_bytes = [], 0
+        current.append((group, names))
+        current_bytes += group_bytes
+    if current:
+        batches.append(current)
+
+    result = []
+    for batch in batches:
+        uris = [uri for group, names in batch for uri in group_uris(group, names)]
+        if len(uris) > MAX_URIS_PER_LOAD_JOB:
+            raise ValueError(f"Batch {batch[0][0]}-{batch[-1][0]} has {len(uris)} URIs; lower groups_per_job")
+        result.append((f"{batch[0][0]}-{batch[-1][0]}", uris))
+    return result
+
+
+def read_load_log(log_file: str) -> set:
+    '''Keys of the batches logged as loaded.'''
+    if not os.path.exists(log_file):
+        return set()
+    with open(log_file) as f:
+        return set(line.strip() for line in f if line.strip())
+
+
+@traced(name='bigquery_batch_load')
+def load_batches_to_bigquery(
+        bq_client,
+        batches: list,
+        dataset_id: str,
+        final_table_id: str,
+        select_sql: str = "SELECT * FROM `{temp_table}`",
+        log_file: str = 'loaded_batches.log',
+        max_concurrent_jobs: int = 4) -> dict:
+    '''
+    Loads each (key, URIs) batch from wildcard_batches with one parquet load job into its own temp table,
+    then appends it to final_table_id with select_sql (formatted with the temp table, e.g. to convert WKB
+    geometry to GEOGRAPHY). Batches already in log_file are skipped and finished ones are appended to it.
+    Up to max_concurrent_jobs batches run at once.
+
+    Returns:
+    dict with lists 'loaded', 'skipped' and 'failed' (batch key, error) pairs.
+    '''
+    from google.cloud import bigquery
+
+    done = read_load_log(log_file)
+    result = {'loaded': [], 'skipped': [key for key, _ in batches if key in done], 'failed': []}
+    pending = [(key, uris) for key, uris in batches if key not in done]
+    print(f"{len(batches)} load batches: {len(result['skipped'])} already loaded, {len(pending)} to load.")
+    lock = threading.Lock()
+    final_table = f"{bq_client.project}.{dataset_id}.{final_table_id}"
+
+    def load_one(key, uris):
+        temp_table = f"{bq_client.project}.{dataset_id}.temp_load_{''.join(c if c.isalnum() else '_' for c in key)}"
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.PARQUET,
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+        )
+        try:
+            with span('load_batch', key=key, uris=len(uris)) as load_span:
+                load_job = bq_client.load_table_from_uri(uris, temp_table, job_config=job_config)
+                load_job.result()
+                load_span.rows_out = load_job.output_rows
+                bq_client.query(f"INSERT INTO `{final_table}` {select_sql.format(temp_table=temp_table)}").result()
+            with lock:
+                with open(log_file, 'a') as f:
+                    f.write(f"{key}\n")
+                result['loaded'].append(key)
+            print(f"  SUCCESS: Loaded batch {key} ({load_job.output_rows:,} rows from {len(uris)} URIs).")
+        finally:
+            bq_client.delete_table(temp_table, not_found_ok=True)
+
+    with ThreadPoolExecutor(max_workers=max_concurrent_jobs) as pool:
+        futures = {pool.submit(load_one, key, uris): key for key, uris in pending}
+        for future in as_completed(futures):
+            error = future.exception()
+            if error is not None:
+                print(f"  ERROR: Failed to load batch {futures[future]}: {error}")
+                result['failed'].append((futures[future], error))
+    return result
@@ -0,0 +1,235 @@
+# GeoParquet 1.1 writers and bbox-pushdown readers for parcel and encumbrance layer files
+# Writers sort rows along a Hilbert curve, add a 'bbox' covering column (xmin, ymin, xmax, ymax) and
+# cap row groups at DEFAULT_ROW_GROUP_SIZE rows. Nearby features then share row groups, and the
+# row-group statistics of the bbox column let a reader skip every group outside its area of interest.
+# A county or tile can read its part of a national roadways or state wetlands file
+# (extent plus the max tier distance) without decoding the rest.
+#
+# Three kinds of writers are covered:
+#   - GeoDataFrames: write_geoparquet
+#   - pyarrow record batches with a WKB 'geometry' column: add_bbox_column + with_geo_metadata
+#   - DuckDB queries: duckdb_geoparquet_copy_sql (or duckdb_bbox_sql, duckdb_hilbert_sql and duckdb_copy_options)
+
+# Importing required libraries
+import json
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+import geopandas as gpd
+from pyproj import CRS
+
+GEOMETRY_COLUMN = 'geometry'
+BBOX_COLUMN = 'bbox'
+
+# Rows per row group. Small enough that a county read from a state file skips most groups,
+# large enough that per-group overhead (statistics, page headers) stays negligible
+DEFAULT_ROW_GROUP_SIZE = 50000
+
+# Bits per axis of the Hilbert index (2**16 cells across the layer extent on each axis)
+HILBERT_ORDER = 16
+
+# Degrees of latitude per metre, used to grow geographic bounding boxes by tier distances
+_DEGREES_PER_METRE = 1 / 111320.0
+
+
+# --- Spatial ordering ---
+def hilbert_index(x, y, extent, order: int = HILBERT_ORDER) -> np.ndarray:
+    '''
+    Position of each (x, y) point along a Hilbert curve covering extent (minx, miny, maxx, maxy).
+    Points close along the curve are close in space, so sorting by it keeps neighbours together.
+    '''
+    n = 1 << order
+    minx, miny, maxx, maxy = extent
+    width, height = (maxx - minx) or 1.0, (maxy - miny) or 1.0
+    xi = np.clip(((np.asarray(x, dtype='float64') - minx) / width * (n - 1)).astype('int64'), 0, n - 1)
+    yi = np.clip(((np.asarray(y, dtype='float64') - miny) / height * (n - 1)).astype('int64'), 0, n - 1)
+
+    index = np.zeros(len(xi), dtype='int64')
+    s = n >> 1
+    while s > 0:
+        rx = (xi & s) > 0
+        ry = (yi & s) > 0
+        index += s * s * ((3 * rx.astype('int64')) ^ ry.astype('int64'))
+        # Rotate the quadrant so the curve stays continuous
+        flip = ~ry & rx
+        xi[flip] = n - 1 - xi[flip]
+        yi[flip] = n - 1 - yi[flip]
+        swap = ~ry
+        xi[swap], yi[swap] = yi[swap], xi[swap]
+        s >>= 1
+    return index
+
+
+def spatial_sort(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    '''Returns gdf with rows in Hilbert order of their bounding box centres (stable for ties).'''
+    if len(gdf) == 0:
+        return gdf
+    bounds = gdf.geometry.bounds.to_numpy()
+    centres_x = (bounds[:, 0] + bounds[:, 2]) / 2
+    centres_y = (bounds[:, 1] + bounds[:, 3]) / 2
+    # Empty / missing geometries have NaN bounds and go last
+    valid = ~np.isnan(centres_x)
+    extent = (centres_x[valid].min(), centres_y[valid].min(), centres_x[valid].max(), centres_y[valid].max()) if valid.any() else (0, 0, 1, 1)
+    index = np.full(len(gdf), np.iinfo('int64').max)
+    index[valid] = hilbert_index(centres_x[valid], centres_y[valid], extent)
+    return gdf.iloc[np.argsort(index, kind='stable')]
+
+
+# --- Writers ---
+def write_geoparquet(
+        gdf: gpd.GeoDataFrame,
+        path: str,
+        row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+        sort: bool = True,
+        **kwargs):
+    '''
+    Writes gdf as GeoParquet 1.1 with a bbox covering column, Hilbert-sorted rows (sort=True)
+    and row groups of row_group_size rows. Extra kwargs go to GeoDataFrame.to_parquet.
+    '''
+    if sort:
+        gdf = spatial_sort(gdf)
+    gdf.to_parquet(
+        path,
+        schema_version='1.1.0',
+        write_covering_bbox=True,
+        row_group_size=row_group_size,
+        **kwargs
+    )
+
+
+def geo_metadata(crs: str = 'EPSG:4326', geometry_column: str = GEOMETRY_COLUMN, covering: bool = True) -> dict:
+    '''GeoParquet 1.1 file metadata for a WKB geometry column, with the bbox covering column when covering is True.'''
+    column = {
+        'encoding': 'WKB',
+        'geometry_types': [],
+        'crs': CRS.from_user_input(crs).to_json_dict(),
+    }
+    if covering:
+        column['covering'] = {
+            'bbox': {corner: [BBOX_COLUMN, corner] for corner in ['xmin', 'ymin', 'xmax', 'ymax']}
+        }
+    return {'version': '1.1.0', 'primary_column': geometry_column, 'columns': {geometry_column: column}}
+
+
+def with_geo_metadata(schema: pa.Schema, crs: str = 'EPSG:4326', geometry_column: str = GEOMETRY_COLUMN) -> pa.Schema:
+    '''Adds GeoParquet metadata to a schema written with pq.ParquetWriter.'''
+    covering = BBOX_COLUMN in schema.names
+    metadata = dict(schema.metadata or {})
+    metadata[b'geo'] = json.dumps(geo_metadata(crs, geometry_column, covering)).encode('utf-8')
+    return schema.with_metadata(metadata)
+
+
+def add_bbox_column(batch, geometry_column: str = GEOMETRY_COLUMN):
+    '''
+    Adds (or refreshes) the bbox covering column of a record batch or table with a WKB geometry column.
+    Missing geometries get a null bbox.
+    '''
+    geometries = shapely.from_wkb(batch.column(geometry_column).to_numpy(zero_copy_only=False))
+    bounds = shapely.bounds(geometries)
+    missing = pa.array(np.isnan(bounds[:, 0]))
+    bbox = pa.StructArray.from_arrays(
+        [pa.array(bounds[:, i], mask=missing.to_numpy(zero_copy_only=False)) for i in range(4)],
+        names=['xmin', 'ymin', 'xmax', 'ymax'],
+        mask=missing
+    )
+    if BBOX_COLUMN in batch.schema.names:
+        return batch.set_column(batch.schema.get_field_index(BBOX_COLUMN), BBOX_COLUMN, bbox)
+    return batch.append_column(BBOX_COLUMN, bbox)
+
+
+def duckdb_bbox_sql(geometry_expr: str = GEOMETRY_COLUMN) -> str:
+    '''DuckDB spatial expression building the bbox covering struct of a GEOMETRY expression.'''
+    return (
+        f"STRUCT_PACK(xmin := ST_XMin({geometry_expr}), ymin := ST_YMin({geometry_expr}), "
+        f"xmax := ST_XMax({geometry_expr}), ymax := ST_YMax({geometry_expr}))"
+    )
+
+
+def duckdb_hilbert_sql(geometry_expr: str = GEOMETRY_COLUMN, partition_by: str = None) -> str:
+    '''
+    DuckDB spatial sort key placing each row along a Hilbert curve over the extent of all rows,
+    or of the rows sharing its partition_by value (e.g. 'fips' to sort each county on its own extent).
+    '''
+    window = f"PARTITION BY {partition_by}" if partition_by else ""
+    return f"ST_Hilbert({geometry_expr}, ST_Extent(ST_Extent_Agg({geometry_expr}) OVER ({window})))"
+
+
+def duckdb_copy_options(crs: str = 'EPSG:4326', row_group_size: int = DEFAULT_ROW_GROUP_SIZE, geometry_column: str = GEOMETRY_COLUMN) -> str:
+    '''
+    Options of a DuckDB COPY ... TO '<file>.parquet' writing GeoParquet 1.1, for a query that selects
+    the geometry as WKB (ST_AsWKB) plus a bbox column built with duckdb_bbox_sql.
+    '''
+    geo = json.dumps(geo_metadata(crs, geometry_column)).replace("'", "''")
+    return f"FORMAT PARQUET, ROW_GROUP_SIZE {int(row_group_size)}, KV_METADATA {{geo: '{geo}'}}"
+
+
+def duckdb_geoparquet_copy_sql(select_sql: str, output_path: str, crs: str = 'EPSG:4326', row_group_size: int = DEFAULT_ROW_GROUP_SIZE) -> str:
+    '''
+    DuckDB COPY statement writing the rows of select_sql as GeoParquet 1.1. select_sql must have a GEOMETRY
+    'geometry' column, which is written as WKB (last column) with a fresh bbox column; a stale bbox column
+    in select_sql is dropped. Rows are written in Hilbert order.
+    '''
+    return f"""
+        COPY (
+            SELECT * EXCLUDE (hilbert_key)
+            FROM (
+                SELECT
+                    COLUMNS(c -> c NOT IN ('{GEOMETRY_COLUMN}', '{BBOX_COLUMN}')),
+                    ST_AsWKB({GEOMETRY_COLUMN}) AS {GEOMETRY_COLUMN},
+                    {duckdb_bbox_sql(GEOMETRY_COLUMN)} AS {BBOX_COLUMN},
+                    {duckdb_hilbert_sql(GEOMETRY_COLUMN)} AS hilbert_key
+                FROM ({select_sql})
+            )
+            ORDER BY hilbert_key
+        ) TO '{output_path}' ({duckdb_copy_options(crs, row_group_size)})
+    """
+
+
+# --- Readers ---
+def has_bbox_covering(path: str) -> bool:
+    '''True when the file declares a GeoParquet bbox covering column readers can filter on.'''
+    metadata = pq.read_schema(path).metadata or {}
+    if b'geo' not in metadata:
+        return False
+    geo = json.loads(metadata[b'geo'])
+    primary = geo.get('primary_column', GEOMETRY_COLUMN)
+    return 'bbox' in geo.get('columns', {}).get(primary, {}).get('covering', {})
+
+
+def read_geoparquet(path: str, bbox: tuple = None, columns: list = None, dictionary_columns: list = None) -> gpd.GeoDataFrame:
+    '''
+    Reads a GeoParquet file, or only the features whose bounding box intersects bbox
+    (minx, miny, maxx, maxy in the file's CRS).
+    Files with a bbox covering column are filtered on it, so row groups outside bbox are never decoded.
+    Older files without one are read whole and filtered afterwards.
+    String columns in dictionary_columns are decoded from their parquet dictionary pages straight into
+    pandas categoricals, without building a Python string per row.
+    The covering column itself is not returned.
+    '''
+    kwargs = {}
+    if dictionary_columns:
+        names = pq.read_schema(path).names
+        kwargs['read_dictionary'] = [col for col in dictionary_columns if col in names]
+    if bbox is not None and has_bbox_covering(path):
+        gdf = gpd.read_parquet(path, bbox=tuple(bbox), columns=columns, **kwargs)
+    else:
+        gdf = gpd.read_parquet(path, columns=columns, **kwargs)
+        if bbox is not None:
+            minx, miny, maxx, maxy = bbox
+            gdf = gdf.cx[minx:maxx, miny:maxy]
+    return gdf.drop(columns=[BBOX_COLUMN], errors='ignore')
+
+
+def expand_bbox(bbox, distance: float) -> tuple:
+    '''
+    Grows a geographic (EPSG:4326) bbox by distance metres on every side, e.g. a county extent by the
+    largest tier distance so features just outside the county still reach its border parcels.
+    '''
+    minx, miny, maxx, maxy = bbox
+    dy = distance * _DEGREES_PER_METRE
+    # Longitude degrees shrink towards the poles; use the latitude furthest from the equator
+    latitude = min(max(abs(miny), abs(maxy)) + dy, 89.9)
+    dx = dy / np.cos(np.radians(latitude))
+    return (minx - dx, max(miny - dy, -90.0), maxx + dx, min(maxy + dy, 90.0))
@@ -11,13 +11,21 @@ import pandas as pd
 import numpy as np
 import geopandas as gpd
 from shapely.geometry import Polygon
-from shapely import wkt
+import shapely
+import pyarrow as pa
+import pyarrow.parquet as pq
 import matplotlib.pyplot as plt
 import seaborn as sns
 
 from google.cloud import bigquery
 from pandas_gbq import to_gbq
 
+# Imported as 'utils' from the notebooks and as 'nation_wide.utils' from the POC scripts
+if __package__:
+    from . import geoparquet_io
+else:
+    import geoparquet_io
+
 
 # BIGQ Importing modules
 # CONSTANTS
@@ -27,6 +35,13 @@ TABLE =  'spatialrecord_polygon'
 CREDENTIALS_PATH =  r"C:\Users\eprashar\AppData\Roaming\gcloud\application_default_credentials.json"
 # A smaller number creates more, smaller polygons. 0.1 is a good starting point.
 GRID_CELL_SIZE = 0.1
+# Geometries with this many vertices or more get subdivided.
+# Mirrors the ST_NUMPOINTS(geometry) < 50000 buffering cutoff in create_materialized_views.sql
+SUBDIVIDE_VERTEX_THRESHOLD = 50000
+# Rows per record batch when streaming query results from BigQuery
+BIGQUERY_BATCH_SIZE = 100000
+
+logger = logging.getLogger(__name__)
 
 
 # Functions to check authentication key
@@ -77,88 +92,246 @@ def check_and_authenticate(json_path):
         print(f"Error: {e}")
 
 # Read parcel data from BigQuery
-def read_bigquery_to_gdf(project, dataset, table, query=None, output= 'df', geometry_col=None):
+def _bigquery_client(project):
+    '''Creates a BigQuery client, logging why it could not be created before re-raising.'''
     try:
-        client = bigquery.Client(project=project)
+        return bigquery.Client(project=project)
     except Exception as e:
-        print
-    if query:
-        query_job = client.query(query)
-        df = query_job.to_dataframe()
+        logger.error(f"Could not create a BigQuery client for project {project}: {e}")
+        raise
+
+
+def bigquery_select_sql(project, dataset, table, query=None, columns=None, row_filter=None, geometry_col=None, keep_geometry_col=False):
+    '''
+    SQL selecting columns (all when None) of the table, or of the result of query, where row_filter
+    (a SQL boolean expression, e.g. "fips = '01001'") holds. The GEOGRAPHY column geometry_col is
+    selected as WKB and named 'geometry', so it can be decoded in bulk instead of parsing WKT row by row.
+    With keep_geometry_col the original column is selected as well (BigQuery returns it as WKT text).
+    '''
+    source = f"({query})" if query else f"`{project}.{dataset}.{table}`"
+    keep = keep_geometry_col and geometry_col != 'geometry'
+    if columns:
+        select = [f"`{col}`" for col in columns if col != geometry_col or keep]
     else:
-        table_ref = client.dataset(dataset).table(table)
-        table = client.get_table(table_ref)
-        df = client.list_rows(table).to_dataframe()
-    
-    # Convert geometry to shapely objects
-    if output == 'gpd' or output =='gdf' :
-        df['geometry'] = df[geometry_col].apply(wkt.loads)
-        # Create geopandas dataframe
-        gdf = gpd.GeoDataFrame(df, geometry='geometry')
-        gdf.crs = 'EPSG:4326'
-        return gdf
+        select = [f"* EXCEPT (`{geometry_col}`)" if geometry_col and not keep else "*"]
+    if geometry_col:
+        select.append(f"ST_ASBINARY(`{geometry_col}`) AS geometry")
+    where_sql = f" WHERE {row_filter}" if row_filter else ""
+    return f"SELECT {', '.join(select)} FROM {source}{where_sql}"
+
+
+def iter_bigquery_batches(
+        project,
+        dataset,
+        table,
+        query=None,
+        columns=None,
+        row_filter=None,
+        geometry_col=None,
+        keep_geometry_col=False,
+        batch_size=BIGQUERY_BATCH_SIZE,
+        client=None,
+        bqstorage_client=None):
+    '''
+    Streams the rows selected by bigquery_select_sql as pyarrow record batches, so only a few batches
+    are held in memory at a time. With a bqstorage_client the result is read over the Storage Read API.
+    client defaults to a new bigquery.Client; any object with the same query(...).result(...) interface works.
+    '''
+    client = client or _bigquery_client(project)
+    sql = bigquery_select_sql(project, dataset, table, query, columns, row_filter, geometry_col, keep_geometry_col)
+    rows = client.query(sql).result(page_size=batch_size)
+    yield from rows.to_arrow_iterable(bqstorage_client=bqstorage_client)
+
+
+def batch_to_gdf(batch, geometry_col='geometry', crs='EPSG:4326') -> gpd.GeoDataFrame:
+    '''
+    Converts a record batch or table to a GeoDataFrame, decoding the whole geometry column at once
+    (WKB, or WKT for string columns).
+    '''
+    values = batch.column(batch.schema.get_field_index(geometry_col)).to_numpy(zero_copy_only=False)
+    if pa.types.is_string(batch.schema.field(geometry_col).type) or pa.types.is_large_string(batch.schema.field(geometry_col).type):
+        geometries = shapely.from_wkt(values)
     else:
-        return df 
+        geometries = shapely.from_wkb(values)
+    df = batch.drop_columns([geometry_col]).to_pandas()
+    return gpd.GeoDataFrame(df, geometry=gpd.GeoSeries(geometries, index=df.index, crs=crs))
+
+
+def iter_bigquery_gdf(project, dataset, table, geometry_col, **kwargs):
+    '''Streams the rows of iter_bigquery_batches as GeoDataFrame chunks (EPSG:4326).'''
+    for batch in iter_bigquery_batches(project, dataset, table, geometry_col=geometry_col, **kwargs):
+        yield batch_to_gdf(batch)
+
+
+def bigquery_to_geoparquet(
+        project,
+        dataset,
+        table,
+        output_path,
+        geometry_col,
+        row_group_size=geoparquet_io.DEFAULT_ROW_GROUP_SIZE,
+        **kwargs):
+    '''
+    Streams the rows of iter_bigquery_batches straight into a GeoParquet 1.1 file with a bbox covering
+    column, one batch at a time, e.g. a state's parcels for local scoring. Rows keep the query order;
+    add an ORDER BY to query (or rewrite with geoparquet_io.write_geoparquet) for Hilbert-ordered row groups.
+    The schema only arrives with the first batch, so when the query selects no rows no file is written.
+
+    Returns:
+    Number of rows written (0, and no file at output_path, for an empty result).
+    '''
+    writer = None
+    total_rows = 0
+    try:
+        for batch in iter_bigquery_batches(project, dataset, table, geometry_col=geometry_col, **kwargs):
+            batch = geoparquet_io.add_bbox_column(batch)
+            if writer is None:
+                writer = pq.ParquetWriter(output_path, geoparquet_io.with_geo_metadata(batch.schema))
+            writer.write_batch(batch, row_group_size=row_group_size)
+            total_rows += batch.num_rows
+    except Exception:
+        if writer:
+            writer.close()
+            writer = None
+            os.remove(output_path)
+        raise
+    finally:
+        if writer:
+            writer.close()
+    if writer is None:
+        logger.warning(f"BigQuery returned no rows for {output_path}; no file was written")
+        return 0
+    logger.info(f"Wrote {total_rows:,} rows from BigQuery to {output_path}")
+    return total_rows
+
+
+def read_bigquery_to_gdf(project, dataset, table, query=None, output= 'df', geometry_col=None, columns=None, row_filter=None, client=None, keep_geometry_col=True):
+    '''
+    Reads a table (or the result of query) into a DataFrame, or a GeoDataFrame when output is 'gdf'/'gpd'.
+    columns and row_filter are applied in BigQuery (see bigquery_select_sql). For GeoDataFrames the
+    GEOGRAPHY column geometry_col is fetched as WKB with the Arrow batches and decoded in bulk into the
+    'geometry' column; geometry_col itself is kept as WKT text, as before, unless keep_geometry_col is False.
+    Use iter_bigquery_gdf or bigquery_to_geoparquet when the result does not fit in memory.
+    '''
+    client = client or _bigquery_client(project)
+
+    if output == 'gpd' or output =='gdf' :
+        batches = list(iter_bigquery_batches(
+            project, dataset, table, query=query, columns=columns, row_filter=row_filter,
+            geometry_col=geometry_col, keep_geometry_col=keep_geometry_col, client=client
+        ))
+        if not batches:
+            return gpd.GeoDataFrame(columns=list(columns or []), geometry=[], crs='EPSG:4326')
+        return batch_to_gdf(pa.Table.from_batches(batches))
+
+    if query or columns or row_filter:
+        sql = bigquery_select_sql(project, dataset, table, query, columns, row_filter)
+        return client.query(sql).to_dataframe()
+    table_ref = client.dataset(dataset).table(table)
+    table = client.get_table(table_ref)
+    return client.list_rows(table).to_dataframe()
 
 
 #  SUBDIVISION FUNCTION
 
-def subdivide_large_geometries(file_path):
+def _grid_cells_for_geometry(geom, cell_size):
+    """
+    Returns the grid cells (aligned to multiples of cell_size) that actually touch a geometry.
+    Candidate cells come from the geometry's bounding box and are filtered with a spatial index,
+    so cells over empty parts of the extent are never kept.
+    """
+    minx, miny, maxx, maxy = geom.bounds
+    xs = np.arange(np.floor(minx / cell_size), np.ceil(maxx / cell_size)) * cell_size
+    ys = np.arange(np.floor(miny / cell_size), np.ceil(maxy / cell_size)) * cell_size
+    # Degenerate extents (vertical/horizontal lines) still need one row/column of cells
+    if len(xs) == 0:
+        xs = np.array([np.floor(minx / cell_size) * cell_size])
+    if len(ys) == 0:
+        ys = np.array([np.floor(miny / cell_size) * cell_size])
+
+    grid_x, grid_y = np.meshgrid(xs, ys)
+    grid_x, grid_y = grid_x.ravel(), grid_y.ravel()
+    candidates = shapely.box(grid_x, grid_y, grid_x + cell_size, grid_y + cell_size)
+
+    tree = shapely.STRtree(candidates)
+    return candidates[tree.query(geom, predicate='intersects')]
+
+
+def subdivide_large_geometries(
+        file_path,
+        output_folder=None,
+        vertex_threshold=SUBDIVIDE_VERTEX_THRESHOLD,
+        cell_size=GRID_CELL_SIZE,
+        batch_size=10000):
     """
-    Reads a GeoParquet file, subdivides its geometries using a grid,
-    and saves the result to a new file.
+    Streams a GeoParquet file (WKB 'geometry' column) one batch at a time,
+    subdivides geometries with at least vertex_threshold vertices using a grid,
+    and writes the result incrementally to a new file.
+    Smaller geometries are copied through unchanged.
     """
     print(f"--- Starting Subdivision for: {os.path.basename(file_path)} ---")
-    
-    # --- 1. Load the County-Level Parquet File ---
-    try:
-        print("Step 1: Loading data into GeoDataFrame...")
-        # Read the Parquet file into a pandas DataFrame first
-        df = pd.read_parquet(file_path)
-        
-        # Convert the WKB 'geometry' column into actual shapely objects
-        # This is the step that will require the most memory.
-        gdf = gpd.GeoDataFrame(
-            df, 
-            geometry=gpd.GeoSeries.from_wkb(df['geometry']), 
-            crs="EPSG:4326"
-        )
-        print(f"-> Successfully loaded {len(gdf):,} features.")
-    except Exception as e:
-        print(f"-> ERROR: Failed to load file. It might be too large for memory. Error: {e}")
-        return
-
-    # --- 2. Create a Subdivision Grid ---
-    print(f"Step 2: Creating a subdivision grid with cell size {GRID_CELL_SIZE} degrees...")
-    
-    # Get the total geographic extent of all features in the file
-    minx, miny, maxx, maxy = gdf.total_bounds
-    
-    # Create a grid of square polygons that covers the entire extent
-    grid_cells = []
-    for x in np.arange(minx, maxx, GRID_CELL_SIZE):
-        for y in np.arange(miny, maxy, GRID_CELL_SIZE):
-            grid_cells.append(box(x, y, x + GRID_CELL_SIZE, y + GRID_CELL_SIZE))
-    
-    grid_gdf = gpd.GeoDataFrame(geometry=grid_cells, crs="EPSG:4326")
-    print(f"-> Created a grid with {len(grid_gdf)} cells.")
-
-    # --- 3. Perform the Intersection (Clipping) ---
-    print("Step 3: Clipping original geometries against the grid...")
-    # The 'overlay' function with 'intersection' is the core of this process.
-    # It finds the overlapping area between the wetlands and the grid cells.
-    subdivided_gdf = gdf.overlay(grid_gdf, how='intersection')
-    print(f"-> Original {len(gdf):,} features were subdivided into {len(subdivided_gdf):,} smaller features.")
-
-    # --- 4. Save the Subdivided Data ---
-    # Convert the geometry back to WKB for efficient storage
-    subdivided_gdf['geometry'] = subdivided_gdf['geometry'].apply(lambda geom: geom.wkb)
-    
+
     # Define the output path
+    output_folder = output_folder or os.path.dirname(file_path)
     output_filename = os.path.basename(file_path).replace(".parquet", "_subdivided.parquet")
-    output_path = os.path.join(WETLAND_COUNTY_FILES, output_filename)
-    
-    print(f"Step 4: Saving subdivided data to: {output_path}")
-    # Save the final result as a standard pandas DataFrame
-    pd.DataFrame(subdivided_gdf).to_parquet(output_path, index=False)
-    print("-> Save complete.")
\ No newline at end of file
+    output_path = os.path.join(output_folder, output_filename)
+    os.makedirs(output_folder, exist_ok=True)
+
+    parquet_file = pq.ParquetFile(file_path)
+    print(f"Step 1: Streaming {parquet_file.metadata.num_rows:,} features in batches of {batch_size:,} rows...")
+    print(f"-> Geometries with {vertex_threshold:,}+ vertices are split into {cell_size} degree cells")
+
+    writer = None
+    total_in, total_out, total_split = 0, 0, 0
+    try:
+        for batch in parquet_file.iter_batches(batch_size=batch_size):
+            geometry_index = batch.schema.get_field_index('geometry')
+            geoms = shapely.from_wkb(batch.column(geometry_index).to_numpy(zero_copy_only=False))
+            n_vertices = shapely.get_num_coordinates(geoms)
+
+            # --- 2. Split only the geometries above the vertex threshold ---
+            row_indices, out_geoms = [], []
+            for i, geom in enumerate(geoms):
+                if geom is None or n_vertices[i] < vertex_threshold:
+                    row_indices.append(i)
+                    out_geoms.append(geom)
+                    continue
+
+                cells = _grid_cells_for_geometry(geom, cell_size)
+                pieces = shapely.intersection(geom, cells)
+                # Drop empty pieces and slivers where the geometry only touches a cell edge
+                keep = ~shapely.is_empty(pieces) & (shapely.get_dimensions(pieces) == shapely.get_dimensions(geom))
+                pieces = pieces[keep]
+                row_indices.extend([i] * len(pieces))
+                out_geoms.extend(pieces)
+                total_split += 1
+
+            # --- 3. Write the subdivided batch ---
+            # Attribute values are repeated for every piece of a split geometry
+            out_batch = batch.take(pa.array(row_indices, type=pa.int64()))
+            out_batch = out_batch.set_column(
+                geometry_index,
+                'geometry',
+                pa.array(shapely.to_wkb(np.array(out_geoms, dtype=object)), type=pa.binary())
+            )
+            if writer is None:
+                writer = pq.ParquetWriter(output_path, out_batch.schema)
+            writer.write_batch(out_batch)
+
+            total_in += batch.num_rows
+            total_out += out_batch.num_rows
+
+        print(f"-> Original {total_in:,} features ({total_split:,} above threshold) were subdivided into {total_out:,} features.")
+    except Exception as e:
+        print(f"-> ERROR: Subdivision failed. Error: {e}")
+        if writer:
+            writer.close()
+            writer = None
+            os.remove(output_path)
+        raise
+    finally:
+        if writer:
+            writer.close()
+
+    print(f"Step 4: Saved subdivided data to: {output_path}")
+    return output_path
@@ -0,0 +1,762 @@
+# Local DuckDB-spatial engine for the proximity parcels BigQuery procedures
+# Runs the same five-step workflow as run_procedures.txt against local GeoParquet files:
+#   1. create_materialized_view
+#   2. calculate_proximity_score_lines_batch
+#   3. calculate_proximity_score_polygons_batch
+#   4. calculate_intersection_score_polygons_batch
+#   5. consolidate_all_scores
+# and produces tables with the same schemas as proximity_intersection_<layer> and all_encumbrance_scores.
+# With a persistent database file, run_procedures_incremental.txt rescores only the parcels affected by
+# changed parcels or encumbrance features and merges them into the existing tables.
+#
+# BigQuery GEOGRAPHY functions work in metres on the spheroid while DuckDB GEOMETRY is planar,
+# so all geometries are transformed once into an equal-area metric CRS when the "materialized views"
+# are built. Buffers, areas and distances then stay in metres, and output geometry is transformed back
+# to EPSG:4326. DuckDB parallelizes every step across threads and spills to temp_directory when a step
+# does not fit in memory_limit, so full states can be run on one box.
+
+# Importing required libraries
+import os
+import re
+import json
+import argparse
+
+import duckdb
+
+GEO_CRS = "EPSG:4326"
+# NAD83 / Conus Albers (equal area, metres). Use EPSG:3338 for AK and a local CRS for HI.
+DEFAULT_METRIC_CRS = "EPSG:5070"
+
+# Buffer tiers, mirroring the procedures
+LINE_BUFFER_TIERS = [(5, 'intersects'), (150, 'very high'), (300, 'high'), (750, 'medium'), (1000, 'low')]
+POLYGON_BUFFER_TIERS = [(0, 'intersects'), (10, 'very high'), (25, 'high'), (75, 'medium'), (150, 'low')]
+
+# Materialized view recipes: source view names and buffers, mirroring create_materialized_views.sql
+LINE_VIEWS = ['roadways', 'railways', 'transmission_lines']
+POLYGON_VIEWS = ['wetlands', 'protected_lands_national']
+# Polygons with this many points or more are not pre-buffered; the procedures buffer the part near
+# each parcel instead (same cutoff as BigQuery)
+MAX_BUFFER_POINTS = 50000
+# Polygons with this many points or more get a simplified hull and core (geometry levels), simplified
+# at LEVEL_TOLERANCE metres and offset by twice that, so the hull contains the polygon and the core lies inside it
+LEVEL_MIN_POINTS = 1000
+LEVEL_TOLERANCE = 10
+
+# Intersection score weights and thresholds, mirroring intersection_score_polygons.sql
+INTERSECTION_SCORE_PARAMS = {
+    'area_ratio_weight': 0.5,
+    'dist_weight': 0.3,
+    'n_intersections_weight': 0.2,
+    'area_ratio_low': 0.4,
+    'area_ratio_high': 0.9,
+    'dist_low': 100,
+    'dist_med': 50,
+    'dist_high': 10,
+    'dist_overwrite': 0,
+    'nint_med': 2,
+    'nint_high': 3,
+    'score_low_threshold': 0.35,
+    'score_high_threshold': 0.7,
+}
+
+# Layers and their lookup columns used by consolidate_all_scores
+# (prefix, proximity table, materialized view, id column, attribute column, attribute alias)
+CONSOLIDATED_LAYERS = [
+    ('rail', 'railways', 'railways', 'FRAARCID', 'KM', 'rail_length'),
+    ('road', 'roadways', 'roadways', 'ID', 'ROADNAME', 'road_name'),
+    ('tline', 'transmission_lines', 'transmission_lines', 'ID', 'VOLT_CLASS', 'tline_volt_class'),
+    ('prot_area', 'protected_lands_national', 'protected_lands_national', 'ID', 'MngTp_Desc', 'prot_land_mng_type'),
+    ('wetland', 'wetlands', 'wetlands', 'NWI_ID', 'WETLAND_TYPE', 'wetland_type'),
+]
+
+
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+class LocalProcedureEngine:
+    """
+    Runs the BigQuery stored procedures locally with DuckDB spatial.
+
+    inputs maps source table names ('parcels', 'roadways', 'railways', 'transmission_lines',
+    'protected_lands_national', 'wetlands') to GeoParquet paths (or globs). Parcels are expected
+    to have the same columns as property_parcelpolygon (parcelPTID, clip, sourcedFips, ...).
+    """
+    def __init__(
+            self,
+            inputs: dict,
+            database: str = ':memory:',
+            threads: int = None,
+            memory_limit: str = None,
+            temp_directory: str = None,
+            metric_crs: str = DEFAULT_METRIC_CRS):
+        self.inputs = inputs
+        self.metric_crs = metric_crs
+        self.con = duckdb.connect(database=database, read_only=False)
+        self.con.execute("INSTALL spatial; LOAD spatial;")
+
+        # Parallelism and out-of-core settings
+        if threads:
+            self.con.execute(f"SET threads = {int(threads)};")
+        if memory_limit:
+            self.con.execute(f"SET memory_limit = '{memory_limit}';")
+        if temp_directory:
+            os.makedirs(temp_directory, exist_ok=True)
+            self.con.execute(f"SET temp_directory = '{temp_directory}';")
+        self.con.execute("SET preserve_insertion_order = false;")
+
+    def close(self):
+        if self.con:
+            self.con.close()
+            self.con = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # --- Helpers ---
+    def _source_sql(self, name: str) -> str:
+        """Returns a SELECT over a GeoParquet input with a GEOMETRY column named 'geometry'."""
+        if name not in self.inputs:
+            raise ValueError(f"No input path configured for '{name}'")
+        path = self.inputs[name]
+        schema = self.con.execute(f"DESCRIBE SELECT * FROM read_parquet('{path}')").fetchdf()
+        geometry_type = schema.loc[schema['column_name'] == 'geometry', 'column_type']
+        if geometry_type.empty:
+            raise ValueError(f"Input '{name}' has no 'geometry' column: {path}")
+        # Plain WKB parquet needs decoding; GeoParquet is read as GEOMETRY already
+        if geometry_type.iloc[0] == 'BLOB':
+            return f"SELECT * REPLACE (ST_GeomFromWKB(geometry) AS geometry) FROM read_parquet('{path}')"
+        return f"SELECT * FROM read_parquet('{path}')"
+
+    def _to_metric(self, expr: str) -> str:
+        return f"ST_Transform({expr}, '{GEO_CRS}', '{self.metric_crs}', always_xy := TRUE)"
+
+    def _to_geographic(self, expr: str) -> str:
+        return f"ST_Transform({expr}, '{self.metric_crs}', '{GEO_CRS}', always_xy := TRUE)"
+
+    @staticmethod
+    def _label_case(tiers: list, intersects_value, value_kind: str) -> str:
+        """Builds the tier CASE used by the proximity procedures (labels or buffer metres)."""
+        lines = [f"WHEN r.is_intersecting THEN {intersects_value}"]
+        for buffer_meters, label in tiers[1:]:
+            value = f"'{label}'" if value_kind == 'label' else str(buffer_meters)
+            lines.append(f"WHEN r.shortest_distance <= {buffer_meters} THEN {value}")
+        default = "'no encumbrance'" if value_kind == 'label' else 'NULL'
+        return "CASE\n      " + "\n      ".join(lines) + f"\n      ELSE {default}\n    END"
+
+    # --- Step 1: create_materialized_views.sql ---
+    def _materialized_view_query(self, view_name: str, source: str) -> str:
+        """Returns the SELECT building the materialized view rows of view_name from source."""
+        simplified = f"ST_Simplify({self._to_metric('geometry')}, 1)"
+
+        if view_name == 'parcels':
+            return f"""
+                SELECT * EXCLUDE (geometry), {simplified} AS geom
+                FROM ({source})
+                WHERE ST_GeometryType(geometry) NOT IN ('POINT', 'MULTIPOINT')
+            """
+        elif view_name in POLYGON_VIEWS:
+            return f"""
+                WITH simplified AS (
+                    SELECT * EXCLUDE (geometry), ST_NPoints(geometry) AS n_points, {simplified} AS geom
+                    FROM ({source})
+                )
+                SELECT
+                    * EXCLUDE (n_points),
+                    -- Geometry levels and conditional buffering based on vertex count, as in BigQuery
+                    CASE WHEN n_points >= {LEVEL_MIN_POINTS}
+                        THEN ST_Buffer(ST_Simplify(geom, {LEVEL_TOLERANCE}), {2 * LEVEL_TOLERANCE}) END AS geom_hull,
+                    CASE WHEN n_points >= {LEVEL_MIN_POINTS}
+                        THEN ST_Buffer(ST_Simplify(geom, {LEVEL_TOLERANCE}), {-2 * LEVEL_TOLERANCE}) END AS geom_core,
+                    CASE WHEN n_points < {MAX_BUFFER_POINTS} THEN ST_Buffer(geom, 5) END AS buf_intersects,
+                    CASE WHEN n_points < {MAX_BUFFER_POINTS} THEN ST_Buffer(geom, 10) END AS buf_very_high
+                FROM simplified
+            """
+        elif view_name in LINE_VIEWS:
+            return f"""
+                WITH simplified AS (
+                    SELECT * EXCLUDE (geometry), {simplified} AS geom
+                    FROM ({source})
+                )
+                SELECT
+                    *,
+                    ST_Buffer(geom, 5) AS buf_intersects,
+                    ST_Buffer(geom, 150) AS buf_very_high,
+                    ST_Buffer(geom, 1000) AS buf_max
+                FROM simplified
+            """
+        raise ValueError(f"Unknown or unsupported view name: '{view_name}'")
+
+    def create_materialized_view(self, view_name: str):
+        print(f"Creating materialized view for '{view_name}'...")
+        query = self._materialized_view_query(view_name, self._source_sql(view_name))
+        self.con.execute(f"CREATE OR REPLACE TABLE {view_name}_mv AS {query}")
+        count = self.con.execute(f"SELECT COUNT(*) FROM {view_name}_mv").fetchone()[0]
+        print(f"-> {view_name}_mv created with {count:,} rows.")
+
+    def _create_parcels_in_scope(self, parcel_scope_table: str = None):
+        scope_filter = ""
+        if parcel_scope_table:
+            scope_filter = f"WHERE CAST(parcelPTID AS VARCHAR) IN (SELECT parcel_id FROM {parcel_scope_table})"
+        self.con.execute(f"""
+            CREATE OR REPLACE TEMP TABLE parcels_in_scope AS
+            SELECT parcelPTID, clip, sourcedFips, geom, ST_Area(geom) AS parcel_area, ST_Centroid(geom) AS centroid
+            FROM parcels_mv
+            {scope_filter}
+        """)
+
+    # --- Step 2: proximity_score_lines.sql ---
+    def calculate_proximity_score_lines_batch(self, encumbrance_table: str, encumbrance_id_col: str, parcel_scope_table: str = None):
+        print(f"Calculating line proximity scores for '{encumbrance_table}'...")
+        id_col = _quote(encumbrance_id_col)
+        tiers = LINE_BUFFER_TIERS
+
+        self._create_parcels_in_scope(parcel_scope_table)
+        final_table_name = f"proximity_intersection_{encumbrance_table}" + ('_delta' if parcel_scope_table else '')
+
+        # Step 3: candidate pairs, joined once with per-pair predicates, distances and areas
+        self.con.execute(f"""
+            CREATE OR REPLACE TEMP TABLE candidate_pairs AS
+            WITH joined AS (
+                SELECT
+                    p.parcelPTID,
+                    CAST(r.{id_col} AS VARCHAR) AS encumbrance_id,
+                    p.geom AS parcel_geom,
+                    p.centroid AS parcel_centroid,
+                    p.parcel_area,
+                    r.geom AS encumbrance_geom,
+                    r.buf_very_high,
+                    -- The 5 m buffer only decides whether the pair intersects
+                    ST_Intersects(p.geom, r.buf_intersects) AS is_intersecting,
+                    ST_Intersects(p.geom, r.buf_very_high) AS is_very_high
+                FROM parcels_in_scope AS p
+                JOIN {encumbrance_table}_mv AS r ON ST_Intersects(p.geom, r.buf_max)
+            )
+            SELECT
+                parcelPTID,
+                encumbrance_id,
+                parcel_area,
+                is_intersecting,
+                is_very_high,
+                ROUND(ST_Distance(parcel_geom, encumbrance_geom), 2) AS shortest_distance,
+                ROUND(ST_Distance(parcel_centroid, encumbrance_geom), 2) AS centroid_distance,
+                -- Length of the raw line clipped to the parcel (a line-polygon clip, not a polygon overlay)
+                CASE WHEN is_intersecting
+                    THEN ROUND(ST_Length(ST_Intersection(parcel_geom, encumbrance_geom)), 2)
+                    ELSE 0
+                END AS len_inside,
+                CASE WHEN is_very_high THEN ST_Area(ST_Intersection(parcel_geom, buf_very_high)) ELSE 0 END AS very_high_area
+            FROM joined
+        """)
+
+        # Step 4: aggregate impact metrics and nearest / intersecting match, both from the pairs
+        self.con.execute("""
+            CREATE OR REPLACE TEMP TABLE parcel_aggregate_metrics AS
+            SELECT
+                parcelPTID,
+                COUNT(DISTINCT CASE WHEN is_intersecting THEN encumbrance_id END) AS intersect_impact_count,
+                COUNT(DISTINCT CASE WHEN is_very_high THEN encumbrance_id END) AS very_high_impact_count,
+                LEAST(
+                    COALESCE(ROUND(SUM(very_high_area) / NULLIF(ANY_VALUE(parcel_area), 0) * 100, 4), 0.0),
+                    100.0
+                ) AS very_high_area_perc
+            FROM candidate_pairs
+            GROUP BY parcelPTID
+        """)
+        self.con.execute("""
+            CREATE OR REPLACE TEMP TABLE resolved_matches AS
+            SELECT parcelPTID, encumbrance_id, is_intersecting, shortest_distance, centroid_distance, len_inside
+            FROM candidate_pairs
+            QUALIFY ROW_NUMBER() OVER (
+                PARTITION BY parcelPTID
+                ORDER BY is_intersecting DESC, shortest_distance ASC
+            ) = 1
+        """)
+
+        # Step 5 and 6: final result table
+        self.con.execute(f"""
+            CREATE OR REPLACE TABLE {final_table_name} AS
+            SELECT
+                p.parcelPTID,
+                p.clip,
+                p.sourcedFips,
+                {self._label_case(tiers, "'intersects'", 'label')} AS proximity_label,
+                {self._label_case(tiers, tiers[0][0], 'meters')} AS buffer_meters,
+                CASE WHEN r.is_intersecting THEN 1 ELSE 0 END AS intersect_status,
+                r.shortest_distance,
+                r.centroid_distance,
+                agg.intersect_impact_count,
+                r.len_inside,
+                agg.very_high_area_perc,
+                agg.very_high_impact_count,
+                r.encumbrance_id,
+                {self._to_geographic('p.geom')} AS geometry
+            FROM parcels_in_scope AS p
+            LEFT JOIN resolved_matches AS r ON p.parcelPTID = r.parcelPTID
+            LEFT JOIN parcel_aggregate_metrics AS agg ON p.parcelPTID = agg.parcelPTID
+        """)
+        print(f"-> {final_table_name} created.")
+
+    # --- Step 3: proximity_score_polygons.sql ---
+    def calculate_proximity_score_polygons_batch(self, encumbrance_table: str, encumbrance_id_col: str, parcel_scope_table: str = None):
+        print(f"Calculating polygon proximity scores for '{encumbrance_table}'...")
+        id_col = _quote(encumbrance_id_col)
+        tiers = POLYGON_BUFFER_TIERS
+        max_buffer_meters = max(buffer_meters for buffer_meters, _ in tiers)
+        very_high_meters = tiers[1][0]
+
+        self._create_parcels_in_scope(parcel_scope_table)
+        final_table_name = f"proximity_intersection_{encumbrance_table}" + ('_delta' if parcel_scope_table else '')
+
+        # Step 3: candidate pairs within the max distance, joined once
+        # Large polygons cascade through their core (definite hit) and hull (definite miss) before the
+        # exact geometry, and those without a pre-computed buffer buffer only the part near the parcel
+        self.con.execute(f"""
+            CREATE OR REPLACE TEMP TABLE candidate_pairs AS
+            WITH joined AS (
+                SELECT
+                    p.parcelPTID,
+                    CAST(r.{id_col} AS VARCHAR) AS encumbrance_id,
+                    p.geom AS parcel_geom,
+                    p.centroid AS parcel_centroid,
+                    p.parcel_area,
+                    r.geom AS encumbrance_geom,
+                    r.buf_very_high,
+                    COALESCE(ST_Intersects(p.geom, r.geom_core), FALSE) AS touches_core,
+                    COALESCE(ST_Covers(r.geom_core, p.geom), FALSE) AS inside_core,
+                    CASE
+                        WHEN ST_Intersects(p.geom, r.geom_core) THEN TRUE
+                        WHEN NOT ST_Intersects(p.geom, r.geom_hull) THEN FALSE
+                        ELSE ST_Intersects(p.geom, r.geom)
+                    END AS is_intersecting,
+                    CASE
+                        WHEN ST_Intersects(p.geom, r.geom_core) THEN TRUE
+                        WHEN NOT ST_DWithin(p.geom, r.geom_hull, {very_high_meters}) THEN FALSE
+                        ELSE ST_DWithin(p.geom, r.geom, {very_high_meters})
+                    END AS is_very_high
+                FROM parcels_in_scope AS p
+                JOIN {encumbrance_table}_mv AS r ON ST_DWithin(p.geom, r.geom, {max_buffer_meters})
+            )
+            SELECT
+                parcelPTID,
+                encumbrance_id,
+                parcel_area,
+                is_intersecting,
+                is_very_high,
+                CASE
+                    WHEN NOT is_intersecting THEN 0
+                    WHEN inside_core THEN parcel_area
+                    ELSE ST_Area(ST_Intersection(parcel_geom, encumbrance_geom))
+                END AS intersection_area,
+                CASE
+                    WHEN NOT is_very_high THEN 0
+                    WHEN inside_core THEN parcel_area
+                    WHEN buf_very_high IS NOT NULL THEN ST_Area(ST_Intersection(parcel_geom, buf_very_high))
+                    ELSE ST_Area(ST_Intersection(
+                        parcel_geom,
+                        ST_Buffer(ST_Intersection(encumbrance_geom, ST_Buffer(parcel_geom, {very_high_meters})), {very_high_meters})
+                    ))
+                END AS very_high_area,
+                CASE WHEN touches_core THEN 0 ELSE ROUND(ST_Distance(parcel_geom, encumbrance_geom), 2) END AS shortest_distance,
+                ROUND(ST_Distance(parcel_centroid, encumbrance_geom), 2) AS centroid_distance
+            FROM joined
+        """)
+
+        # Step 4: aggregate metrics and best match (intersections first, then largest area, then closest)
+        self.con.execute("""
+            CREATE OR REPLACE TEMP TABLE intersection_aggregate_metrics AS
+            SELECT
+                parcelPTID,
+                COUNT(DISTINCT CASE WHEN is_intersecting THEN encumbrance_id END) AS intersect_impact_count,
+                COUNT(DISTINCT CASE WHEN is_very_high THEN encumbrance_id END) AS very_high_impact_count,
+                LEAST(
+                    COALESCE(ROUND(SUM(intersection_area) / NULLIF(ANY_VALUE(parcel_area), 0) * 100, 4), 0.0),
+                    100.0
+                ) AS intersect_area_perc,
+                LEAST(
+                    COALESCE(ROUND(SUM(very_high_area) / NULLIF(ANY_VALUE(parcel_area), 0) * 100, 4), 0.0),
+                    100.0
+                ) AS very_high_area_perc
+            FROM candidate_pairs
+            GROUP BY parcelPTID
+        """)
+        self.con.execute("""
+            CREATE OR REPLACE TEMP TABLE resolved_matches AS
+            SELECT parcelPTID, encumbrance_id, is_intersecting, shortest_distance, centroid_distance
+            FROM candidate_pairs
+            QUALIFY ROW_NUMBER() OVER (
+                PARTITION BY parcelPTID
+                ORDER BY is_intersecting DESC, ROUND(intersection_area, 2) DESC, shortest_distance ASC
+            ) = 1
+        """)
+
+        # Step 5 and 6: final result table
+        self.con.execute(f"""
+            CREATE OR REPLACE TABLE {final_table_name} AS
+            SELECT
+                p.parcelPTID,
+                p.clip,
+                p.sourcedFips,
+                {self._label_case(tiers, "'intersects'", 'label')} AS proximity_label,
+                {self._label_case(tiers, 0, 'meters')} AS buffer_meters,
+                CASE WHEN r.is_intersecting THEN 1 ELSE 0 END AS intersect_status,
+                r.shortest_distance,
+                r.centroid_distance,
+                COALESCE(agg.intersect_impact_count, 0) AS intersect_impact_count,
+                COALESCE(agg.intersect_area_perc, 0) AS intersect_area_perc,
+                COALESCE(agg.very_high_impact_count, 0) AS very_high_impact_count,
+                COALESCE(agg.very_high_area_perc, 0) AS very_high_area_perc,
+                r.encumbrance_id,
+                {self._to_geographic('p.geom')} AS geometry
+            FROM parcels_in_scope AS p
+            LEFT JOIN resolved_matches AS r ON p.parcelPTID = r.parcelPTID
+            LEFT JOIN intersection_aggregate_metrics AS agg ON p.parcelPTID = agg.parcelPTID
+        """)
+        print(f"-> {final_table_name} created.")
+
+    # --- Step 4: intersection_score_polygons.sql ---
+    def calculate_intersection_score_polygons_batch(self, encumbrance: str):
+        print(f"Calculating intersection scores for '{encumbrance}'...")
+        table_name = f"proximity_intersection_{encumbrance}"
+        k = INTERSECTION_SCORE_PARAMS
+
+        self.con.execute(f"""
+            CREATE OR REPLACE TEMP TABLE scored_parcels AS
+            WITH scores_calculated AS (
+                SELECT
+                    *,
+                    (
+                        (CASE
+                            WHEN intersect_area_perc >= {k['area_ratio_high']} THEN 1
+                            WHEN intersect_area_perc >= {k['area_ratio_low']} THEN 0.5
+                            WHEN intersect_area_perc > 0 THEN 0.25
+                            ELSE 0
+                        END) * {k['area_ratio_weight']} +
+                        (CASE
+                            WHEN centroid_distance <= {k['dist_high']} THEN 1
+                            WHEN centroid_distance <= {k['dist_med']} THEN 0.5
+                            WHEN centroid_distance <= {k['dist_low']} THEN 0.25
+                            WHEN centroid_distance > 0 THEN 0.15
+                            ELSE 0
+                        END) * {k['dist_weight']} +
+                        (CASE
+                            WHEN intersect_impact_count >= {k['nint_high']} THEN 1
+                            WHEN intersect_impact_count = {k['nint_med']} THEN 0.5
+                            WHEN intersect_impact_count > 0 THEN 0.25
+                            ELSE 0
+                        END) * {k['n_intersections_weight']}
+                    ) AS intersection_score_temp
+                FROM {table_name}
+                WHERE proximity_label = 'intersects'
+            )
+            SELECT
+                parcelPTID,
+                ROUND(intersection_score_temp, 2) AS intersection_score,
+                CASE
+                    WHEN intersection_score_temp = 0 THEN NULL
+                    WHEN intersect_area_perc >= {k['area_ratio_high']} OR centroid_distance = {k['dist_overwrite']} THEN 'high'
+                    WHEN intersection_score_temp <= {k['score_low_threshold']} THEN 'low'
+                    WHEN intersection_score_temp < {k['score_high_threshold']} THEN 'medium'
+                    ELSE 'high'
+                END AS intersection_label
+            FROM scores_calculated
+        """)
+
+        # Rebuild the table with the scores joined, then swap it in
+        self.con.execute(f"""
+            CREATE OR REPLACE TABLE {table_name}_scored AS
+            SELECT t.*, s.intersection_score, s.intersection_label
+            FROM {table_name} AS t
+            LEFT JOIN scored_parcels AS s ON t.parcelPTID = s.parcelPTID
+        """)
+        self.con.execute(f"DROP TABLE {table_name};")
+        self.con.execute(f"ALTER TABLE {table_name}_scored RENAME TO {table_name};")
+        print(f"-> Intersection scores added to {table_name}.")
+
+    # --- Step 5: all_encumbrance_scores.sql ---
+    def consolidate_all_scores(self, parcel_scope_table: str = None):
+        print("Consolidating all encumbrance scores...")
+        final_table_name = 'all_encumbrance_scores' + ('_delta' if parcel_scope_table else '')
+        scope_filter = ""
+        if parcel_scope_table:
+            scope_filter = f"AND CAST(p.parcelPTID AS VARCHAR) IN (SELECT parcel_id FROM {parcel_scope_table})"
+        select_columns = [
+            "p.parcelPTID AS spatial_parcel_point_id",
+            "p.clip",
+            "p.state",
+            "p.stateCode AS state_code",
+            "p.countyCode AS cnty_code",
+            "CONCAT(p.stateCode, p.countyCode) AS fips_code",
+            "p.sourcedFips",
+            "p.clipOwner1Name AS parcel_poly_owner1",
+            f"{self._to_geographic('p.geom')} AS geometry",
+        ]
+        joins = []
+        for i, (prefix, table, view, id_col, attribute_col, attribute_alias) in enumerate(CONSOLIDATED_LAYERS, start=1):
+            s, l = f"p{i}", f"l{i}"
+            is_polygon = view in POLYGON_VIEWS
+            area_alias = {'prot_area': 'prot_area_area_intersect', 'wetland': 'wetland_area_intersect'}.get(prefix)
+            adj_alias = {
+                'rail': 'rail_perc_area_with_adj_lines',
+                'road': 'road_perc_area_with_adj_roads',
+                'tline': 'tline_perc_area_with_adj_lines',
+                'prot_area': 'prot_area_perc_area_with_adj_areas',
+                'wetland': 'wetland_perc_area_with_adj_lands',
+            }[prefix]
+
+            select_columns += [
+                f"CASE WHEN {s}.proximity_label IN ('no encumbrance') THEN 'beyond threshold' ELSE {s}.proximity_label END AS {prefix}_proximity_lbl",
+                f"{s}.intersect_status AS {prefix}_intersect_status",
+                f"{s}.shortest_distance AS {prefix}_shortest_dist",
+            ]
+            if is_polygon:
+                select_columns.append(f"ROUND({s}.intersect_area_perc, 2) AS {area_alias}")
+            select_columns += [
+                f"{s}.centroid_distance AS {prefix}_dist_centroid",
+                f"{s}.intersect_impact_count AS {prefix}_num_direct_intersections",
+            ]
+            if not is_polygon:
+                select_columns.append(f"{s}.len_inside AS {prefix}_line_length")
+            select_columns += [
+                f"ROUND({s}.very_high_area_perc, 2) AS {adj_alias}",
+                f"{s}.very_high_impact_count AS {prefix}_num_adj_intersections",
+                f"{s}.encumbrance_id AS {prefix}_nearest_id",
+            ]
+            if is_polygon:
+                select_columns += [
+                    f"{s}.intersection_score AS {prefix}_intersection_score",
+                    f"{s}.intersection_label AS {prefix}_intersection_label",
+                ]
+            select_columns.append(f"{l}.{_quote(attribute_col)} AS {attribute_alias}")
+
+            joins.append(f"LEFT JOIN proximity_intersection_{table} {s} ON p.parcelPTID = {s}.parcelPTID")
+            joins.append(f"LEFT JOIN {view}_mv {l} ON {s}.encumbrance_id = CAST({l}.{_quote(id_col)} AS VARCHAR)")
+
+        newline = "\n            "
+        self.con.execute(f"""
+            CREATE OR REPLACE TABLE {final_table_name} AS
+            SELECT
+                {(',' + newline + '    ').join(select_columns)}
+            FROM parcels_mv AS p
+            {newline.join(joins)}
+            WHERE ST_GeometryType(p.geom) NOT IN ('POINT', 'MULTIPOINT')
+            {scope_filter}
+        """)
+        count = self.con.execute(f"SELECT COUNT(*) FROM {final_table_name}").fetchone()[0]
+        print(f"-> {final_table_name} created with {count:,} rows.")
+
+    # --- Incremental refresh: incremental_refresh.sql ---
+    def _table_exists(self, table_name: str) -> bool:
+        return self.con.execute(
+            "SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = ?", [table_name]
+        ).fetchone()[0] > 0
+
+    def detect_feature_changes(self, view_name: str, id_col: str):
+        """
+        Hashes the source rows of view_name, compares them with the hashes of the last committed run
+        and writes the added, modified and removed rows to <view>_changes with their old and new geometry.
+        Unlike BigQuery, the local materialized view does not refresh itself, so its changed rows are
+        rebuilt here as well.
+        """
+        print(f"Detecting changes in '{view_name}'...")
+        id_sql = _quote(id_col)
+        source = self._source_sql(view_name)
+
+        # First run: no previous hashes, so every row counts as added
+        self.con.execute(f"CREATE TABLE IF NOT EXISTS {view_name}_hashes (feature_id VARCHAR, row_hash VARCHAR)")
+        self.con.execute(f"""
+            CREATE OR REPLACE TABLE {view_name}_hashes_staged AS
+            SELECT CAST(h.{id_sql} AS VARCHAR) AS feature_id, md5(CAST(h AS VARCHAR)) AS row_hash
+            FROM (SELECT * REPLACE (ST_AsHEXWKB(geometry) AS geometry) FROM ({source})) AS h
+        """)
+
+        # Old geometries come from the view before it is patched
+        mv_exists = self._table_exists(f"{view_name}_mv")
+        if not mv_exists:
+            self.create_materialized_view(view_name)
+        old_geom_join = f"LEFT JOIN {view_name}_mv AS mv ON o.feature_id = CAST(mv.{id_sql} AS VARCHAR)" if mv_exists else ""
+        self.con.execute(f"""
+            CREATE OR REPLACE TABLE {view_name}_changes AS
+            SELECT
+                COALESCE(n.feature_id, o.feature_id) AS feature_id,
+                CASE
+                    WHEN o.feature_id IS NULL THEN 'added'
+                    WHEN n.feature_id IS NULL THEN 'removed'
+                    ELSE 'modified'
+                END AS change_type,
+                {'mv.geom' if mv_exists else 'CAST(NULL AS GEOMETRY)'} AS geom_old,
+                CAST(NULL AS GEOMETRY) AS geom_new
+            FROM {view_name}_hashes_staged AS n
+            FULL OUTER JOIN {view_name}_hashes AS o ON n.feature_id = o.feature_id
+            {old_geom_join}
+            WHERE o.feature_id IS NULL OR n.feature_id IS NULL OR n.row_hash != o.row_hash
+        """)
+
+        self.con.begin()
+        if mv_exists:
+            # Patch only the changed rows of the view
+            self.con.execute(f"""
+                DELETE FROM {view_name}_mv
+                WHERE CAST({id_sql} AS VARCHAR) IN (SELECT feature_id FROM {view_name}_changes)
+            """)
+            changed_source = f"""
+                SELECT * FROM ({source})
+                WHERE CAST({id_sql} AS VARCHAR) IN (
+                    SELECT feature_id FROM {view_name}_changes WHERE change_type != 'removed'
+                )
+            """
+            self.con.execute(f"INSERT INTO {view_name}_mv BY NAME {self._materialized_view_query(view_name, changed_source)}")
+        self.con.execute(f"""
+            UPDATE {view_name}_changes AS c
+            SET geom_new = mv.geom
+            FROM {view_name}_mv AS mv
+            WHERE c.feature_id = CAST(mv.{id_sql} AS VARCHAR)
+        """)
+        self.con.commit()
+
+        counts = dict(self.con.execute(
+            f"SELECT change_type, COUNT(*) FROM {view_name}_changes GROUP BY change_type"
+        ).fetchall())
+        print(f"-> {view_name}: {counts.get('added', 0):,} added, {counts.get('modified', 0):,} modified, "
+              f"{counts.get('removed', 0):,} removed.")
+
+    def find_affected_parcels(self, encumbrance_table: str):
+        """
+        Writes affected_parcels_<layer>: changed parcels plus every parcel within the layer's
+        max tier distance of the old or new geometry of a changed feature.
+        """
+        tiers = LINE_BUFFER_TIERS if encumbrance_table in LINE_VIEWS else POLYGON_BUFFER_TIERS
+        max_buffer_meters = max(buffer_meters for buffer_meters, _ in tiers)
+
+        self.con.execute(f"""
+            CREATE OR REPLACE TABLE affected_parcels_{encumbrance_table} AS
+            WITH changed_geoms AS (
+                SELECT geom_old AS geom FROM {encumbrance_table}_changes WHERE geom_old IS NOT NULL
+                UNION ALL
+                SELECT geom_new AS geom FROM {encumbrance_table}_changes WHERE geom_new IS NOT NULL
+            )
+            -- Removed parcels are kept so merge_delta deletes their rows
+            SELECT feature_id AS parcel_id
+            FROM parcels_changes
+            UNION
+            SELECT CAST(p.parcelPTID AS VARCHAR) AS parcel_id
+            FROM parcels_mv AS p
+            JOIN changed_geoms AS c ON ST_DWithin(p.geom, c.geom, {max_buffer_meters})
+        """)
+        count = self.con.execute(f"SELECT COUNT(*) FROM affected_parcels_{encumbrance_table}").fetchone()[0]
+        print(f"-> {count:,} parcels affected by changes in '{encumbrance_table}'.")
+
+    def collect_affected_parcels(self):
+        """Writes affected_parcels_all, the parcels affected by any layer."""
+        self.con.execute(
+            "CREATE OR REPLACE TABLE affected_parcels_all AS\n"
+            + "\nUNION\n".join(f"SELECT parcel_id FROM affected_parcels_{table}" for _, table, *_ in CONSOLIDATED_LAYERS)
+        )
+
+    def merge_delta(self, target_table: str, key_col: str, parcel_scope_table: str):
+        """
+        Replaces the rows of the parcels in scope in target_table with the rows of <target_table>_delta.
+        Parcels in scope without a delta row (removed parcels) end up deleted, as with the BigQuery MERGE.
+        """
+        key = _quote(key_col)
+        # First run: the delta is the whole table
+        self.con.execute(f"CREATE TABLE IF NOT EXISTS {target_table} AS SELECT * FROM {target_table}_delta LIMIT 0")
+
+        self.con.begin()
+        self.con.execute(f"""
+            DELETE FROM {target_table}
+            WHERE CAST({key} AS VARCHAR) IN (SELECT parcel_id FROM {parcel_scope_table})
+        """)
+        self.con.execute(f"INSERT INTO {target_table} BY NAME SELECT * FROM {target_table}_delta")
+        self.con.commit()
+
+        count = self.con.execute(f"SELECT COUNT(*) FROM {target_table}_delta").fetchone()[0]
+        print(f"-> Merged {count:,} rows into {target_table}.")
+
+    def commit_feature_hashes(self, view_name: str):
+        """Makes the hashes of this run the baseline for the next one. Call after every merge."""
+        self.con.execute(f"CREATE OR REPLACE TABLE {view_name}_hashes AS SELECT * FROM {view_name}_hashes_staged")
+        self.con.execute(f"DROP TABLE IF EXISTS {view_name}_hashes_staged")
+
+    # --- Workflow ---
+    def call(self, statement: str):
+        """Executes one 'CALL proximity_parcels.<procedure>(args)' line from run_procedures.txt."""
+        match = re.match(r"\s*CALL\s+(?:[\w-]+\.)?(\w+)\s*\((.*)\)\s*;?\s*$", statement, flags=re.IGNORECASE)
+        if not match:
+            raise ValueError(f"Not a procedure call: {statement}")
+        procedure, raw_args = match.groups()
+        args = [arg.strip().strip("'\"") for arg in raw_args.split(',') if arg.strip()]
+        args = [None if arg.upper() == 'NULL' else arg for arg in args]
+
+        procedures = {
+            'create_materialized_view': self.create_materialized_view,
+            'calculate_proximity_score_lines_batch': self.calculate_proximity_score_lines_batch,
+            'calculate_proximity_score_polygons_batch': self.calculate_proximity_score_polygons_batch,
+            'calculate_intersection_score_polygons_batch': self.calculate_intersection_score_polygons_batch,
+            'consolidate_all_scores': self.consolidate_all_scores,
+            'detect_feature_changes': self.detect_feature_changes,
+            'find_affected_parcels': self.find_affected_parcels,
+            'collect_affected_parcels': self.collect_affected_parcels,
+            'merge_delta': self.merge_delta,
+            'commit_feature_hashes': self.commit_feature_hashes,
+        }
+        if procedure not in procedures:
+            raise ValueError(f"Unsupported procedure: {procedure}")
+        procedures[procedure](*args)
+
+    def run_calls_file(self, calls_file_path: str):
+        """Runs every CALL statement of a run_procedures.txt style file in order."""
+        with open(calls_file_path, 'r') as f:
+            calls_to_make = [
+                line.strip() for line in f
+                if line.strip() and not line.strip().startswith('--')
+            ]
+        print(f"Found {len(calls_to_make)} procedure calls to execute.")
+        for i, call_statement in enumerate(calls_to_make):
+            print(f"  -> Executing call {i+1}/{len(calls_to_make)}: {call_statement}")
+            self.call(call_statement)
+
+    def export_table(self, table_name: str, output_path: str):
+        """Writes a result table to parquet with WKB geometry."""
+        self.con.execute(f"""
+            COPY (
+                SELECT * REPLACE (ST_AsWKB(geometry) AS geometry)
+                FROM {table_name}
+            ) TO '{output_path}' (FORMAT PARQUET);
+        """)
+        print(f"-> Exported {table_name} to {output_path}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the proximity parcels procedures locally with DuckDB spatial.')
+    parser.add_argument('inputs', help='JSON file mapping source names (parcels, roadways, ...) to GeoParquet paths')
+    parser.add_argument('--calls', default=os.path.join(os.path.dirname(__file__), 'run_procedures.txt'),
+                        help='File with CALL statements to execute')
+    parser.add_argument('--database', default='proximity_parcels_local.duckdb', help='DuckDB database file')
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--memory-limit', default=None, help="e.g. '48GB'")
+    parser.add_argument('--temp-directory', default=None, help='Spill directory for out-of-core steps')
+    parser.add_argument('--metric-crs', default=DEFAULT_METRIC_CRS)
+    parser.add_argument('--export-folder', default=None, help='Export result tables to parquet in this folder')
+    args = parser.parse_args()
+
+    with open(args.inputs, 'r') as f:
+        inputs = json.load(f)
+
+    with LocalProcedureEngine(
+            inputs,
+            database=args.database,
+            threads=args.threads,
+            memory_limit=args.memory_limit,
+            temp_directory=args.temp_directory,
+            metric_crs=args.metric_crs) as engine:
+        engine.run_calls_file(args.calls)
+
+        if args.export_folder:
+            os.makedirs(args.export_folder, exist_ok=True)
+            tables = [f"proximity_intersection_{table}" for _, table, *_ in CONSOLIDATED_LAYERS] + ['all_encumbrance_scores']
+            for table in tables:
+                engine.export_table(table, os.path.join(args.export_folder, f"{table}.parquet"))
@@ -1,14 +1,23 @@
 -- Procedure to consolidate all encumbrance scores into a single table
 -- This version processes all data in a single batch without FIPS filtering
+-- When parcel_scope_table is set, only the parcels listed in it are consolidated into all_encumbrance_scores_delta
 -- Last updated on Sep 16, 2025 with alias names that match the final schema shared with Ricardo's team
 
-CREATE OR REPLACE PROCEDURE `clgx-gis-app-prd-364d.proximity_parcels.consolidate_all_scores`()
+CREATE OR REPLACE PROCEDURE `clgx-gis-app-prd-364d.proximity_parcels.consolidate_all_scores`(parcel_scope_table STRING)
 OPTIONS(strict_mode=false) -- To suppress errors while uploading procedure through console
 BEGIN
+  DECLARE final_table_name STRING DEFAULT "proximity_parcels.all_encumbrance_scores";
 
-  CREATE OR REPLACE TABLE `clgx-gis-app-prd-364d.proximity_parcels.all_encumbrance_scores`
-  -- Best Practice: Cluster by both fips and geometry for optimal performance in downstream queries.
-  CLUSTER BY sourcedFips, geometry AS
+  -- Restrict to the parcels in scope for incremental runs
+  CREATE OR REPLACE TEMP TABLE parcel_scope (parcel_id STRING);
+  IF parcel_scope_table IS NOT NULL THEN
+    EXECUTE IMMEDIATE FORMAT("""
+      INSERT INTO parcel_scope SELECT parcel_id FROM `proximity_parcels.%s`
+    """, parcel_scope_table);
+    SET final_table_name = CONCAT(final_table_name, '_delta');
+  END IF;
+
+  CREATE OR REPLACE TEMP TABLE consolidated_scores AS
 
   -- The query starts from the main parcels table (p) to ensure every parcel is included.
   -- All other score tables are then LEFT JOINed to it.
@@ -130,9 +139,17 @@ BEGIN
   LEFT JOIN `clgx-gis-app-prd-364d.proximity_parcels.wetlands_mv` l5
     ON p5.encumbrance_id = CAST(l5.NWI_ID AS STRING)
   
-  WHERE ST_GEOMETRYTYPE(p.geom) NOT IN ('ST_Point', 'ST_MultiPoint');
+  WHERE ST_GEOMETRYTYPE(p.geom) NOT IN ('ST_Point', 'ST_MultiPoint')
+    AND (parcel_scope_table IS NULL OR CAST(p.parcelPTID AS STRING) IN (SELECT parcel_id FROM parcel_scope));
+
+  -- Best Practice: Cluster by both fips and geometry for optimal performance in downstream queries.
+  EXECUTE IMMEDIATE FORMAT("""
+    CREATE OR REPLACE TABLE `%s`
+    CLUSTER BY sourcedFips, geometry AS
+    SELECT * FROM consolidated_scores;
+  """, final_table_name);
 
 END;
 
 -- Procedure call
---CALL proximity_parcels.consolidate_all_scores()
\ No newline at end of file
+--CALL proximity_parcels.consolidate_all_scores(NULL)
\ No newline at end of file
@@ -14,40 +14,36 @@ BEGIN
     FROM `clgx-idap-bigquery-prd-a990.edr_ent_property_parcel_polygons.property_parcelpolygon`
     WHERE ST_GEOMETRYTYPE(geometry) NOT IN ('ST_Point', 'ST_MultiPoint');
 
-  -- Create the materialized view for wetlands with conditional buffering
+  -- Create the materialized view for wetlands with conditional buffering and geometry levels
   ELSEIF view_name = 'wetlands' THEN
     CREATE OR REPLACE MATERIALIZED VIEW `clgx-gis-app-prd-364d.proximity_parcels.wetlands_mv`
     CLUSTER BY fips, geom AS
     SELECT
       * EXCEPT(geometry),
       ST_SIMPLIFY(geometry, 1) AS geom,
-      -- Conditional buffering based on vertex count to avoid resource exhaustion.
-      CASE
-        WHEN ST_NUMPOINTS(geometry) < 50000 THEN ST_BUFFER(ST_SIMPLIFY(geometry, 1), 5)
-        ELSE ST_SIMPLIFY(geometry, 1)
-      END AS buf_intersects,
-      CASE
-        WHEN ST_NUMPOINTS(geometry) < 50000 THEN ST_BUFFER(ST_SIMPLIFY(geometry, 1), 10)
-        ELSE ST_SIMPLIFY(geometry, 1)
-      END AS buf_very_high
+      -- Multi-resolution levels of large polygons (1000+ points), simplified at 10 m and offset by 20 m:
+      -- geom_hull contains geom and geom_core lies inside it. The proximity procedure accepts parcels
+      -- touching the core and rejects parcels away from the hull without testing the exact shape.
+      IF(ST_NUMPOINTS(geometry) >= 1000, ST_BUFFER(ST_SIMPLIFY(geometry, 10), 20), NULL) AS geom_hull,
+      IF(ST_NUMPOINTS(geometry) >= 1000, ST_BUFFER(ST_SIMPLIFY(geometry, 10), -20), NULL) AS geom_core,
+      -- Buffering polygons with 50000+ points exhausts resources, so their buffers are left NULL
+      -- and the procedures buffer only the part of the polygon near each parcel instead.
+      IF(ST_NUMPOINTS(geometry) < 50000, ST_BUFFER(ST_SIMPLIFY(geometry, 1), 5), NULL) AS buf_intersects,
+      IF(ST_NUMPOINTS(geometry) < 50000, ST_BUFFER(ST_SIMPLIFY(geometry, 1), 10), NULL) AS buf_very_high
     FROM `clgx-gis-app-prd-364d.proximity_parcels.wetlands`;
 
-  -- Create the materialized view for protected lands with conditional buffering
+  -- Create the materialized view for protected lands with conditional buffering and geometry levels
   ELSEIF view_name = 'protected_lands_national' THEN
     CREATE OR REPLACE MATERIALIZED VIEW `clgx-gis-app-prd-364d.proximity_parcels.protected_lands_national_mv`
     CLUSTER BY fips, geom AS
     SELECT
       * EXCEPT(geometry),
       ST_SIMPLIFY(geometry, 1) AS geom,
-      -- Conditional buffering based on vertex count.
-      CASE
-        WHEN ST_NUMPOINTS(geometry) < 50000 THEN ST_BUFFER(ST_SIMPLIFY(geometry, 1), 5)
-        ELSE ST_SIMPLIFY(geometry, 1)
-      END AS buf_intersects,
-      CASE
-        WHEN ST_NUMPOINTS(geometry) < 50000 THEN ST_BUFFER(ST_SIMPLIFY(geometry, 1), 10)
-        ELSE ST_SIMPLIFY(geometry, 1)
-      END AS buf_very_high
+      -- Geometry levels and buffers, as for wetlands.
+      IF(ST_NUMPOINTS(geometry) >= 1000, ST_BUFFER(ST_SIMPLIFY(geometry, 10), 20), NULL) AS geom_hull,
+      IF(ST_NUMPOINTS(geometry) >= 1000, ST_BUFFER(ST_SIMPLIFY(geometry, 10), -20), NULL) AS geom_core,
+      IF(ST_NUMPOINTS(geometry) < 50000, ST_BUFFER(ST_SIMPLIFY(geometry, 1), 5), NULL) AS buf_intersects,
+      IF(ST_NUMPOINTS(geometry) < 50000, ST_BUFFER(ST_SIMPLIFY(geometry, 1), 10), NULL) AS buf_very_high
     FROM `clgx-gis-app-prd-364d.proximity_parcels.protected_lands_national`;
 
   -- Create the materialized view for railways
@@ -0,0 +1,169 @@
+-- Procedures for incremental refreshes of the proximity tables
+-- Instead of rescoring the whole country, only parcels that changed, or that are within the max tier
+-- distance of an encumbrance feature that changed, are rescored. The rescored rows are then merged
+-- into the existing proximity_intersection_<layer> and all_encumbrance_scores tables.
+-- See run_procedures_incremental.txt for the order of calls.
+
+
+-- Procedure to detect added, modified and removed rows of a materialized view since the last committed run
+-- Every row is hashed (attributes + geometry). Hashes are compared against <view>_hashes from the last run
+-- and the differences are written to <view>_changes with the old and new geometry of each changed row.
+CREATE OR REPLACE PROCEDURE `clgx-gis-app-prd-364d.proximity_parcels.detect_feature_changes`(view_name STRING, id_col STRING)
+BEGIN
+  DECLARE hashed_columns STRING;
+
+  -- Buffers and geometry levels are derived from the geometry, so they are left out of the hash
+  SET hashed_columns = CASE
+    WHEN view_name = 'parcels' THEN '*'
+    WHEN view_name IN ('wetlands', 'protected_lands_national') THEN '* EXCEPT(geom_hull, geom_core, buf_intersects, buf_very_high)'
+    WHEN view_name IN ('roadways', 'railways', 'transmission_lines') THEN '* EXCEPT(buf_intersects, buf_very_high, buf_max)'
+  END;
+  IF hashed_columns IS NULL THEN
+    RAISE USING MESSAGE = FORMAT("Unknown or unsupported view name: '%s'", view_name);
+  END IF;
+
+  -- First run: no previous hashes, so every row counts as added
+  EXECUTE IMMEDIATE FORMAT("""
+    CREATE TABLE IF NOT EXISTS `proximity_parcels.%s_hashes` (feature_id STRING, row_hash INT64, geom GEOGRAPHY)
+  """, view_name);
+
+  -- Step 1: Hash the current rows. Committed as the new baseline by commit_feature_hashes.
+  EXECUTE IMMEDIATE FORMAT("""
+    CREATE OR REPLACE TABLE `proximity_parcels.%s_hashes_staged` AS
+    WITH hashed AS (
+      SELECT %s
+      FROM `proximity_parcels.%s_mv`
+    )
+    SELECT
+      CAST(h.%s AS STRING) AS feature_id,
+      FARM_FINGERPRINT(TO_JSON_STRING(h)) AS row_hash,
+      h.geom
+    FROM hashed AS h
+  """, view_name, hashed_columns, view_name, id_col);
+
+  -- Step 2: Compare against the last committed hashes
+  EXECUTE IMMEDIATE FORMAT("""
+    CREATE OR REPLACE TABLE `proximity_parcels.%s_changes` AS
+    SELECT
+      COALESCE(n.feature_id, o.feature_id) AS feature_id,
+      CASE
+        WHEN o.feature_id IS NULL THEN 'added'
+        WHEN n.feature_id IS NULL THEN 'removed'
+        ELSE 'modified'
+      END AS change_type,
+      o.geom AS geom_old,
+      n.geom AS geom_new
+    FROM `proximity_parcels.%s_hashes_staged` AS n
+    FULL OUTER JOIN `proximity_parcels.%s_hashes` AS o ON n.feature_id = o.feature_id
+    WHERE o.feature_id IS NULL OR n.feature_id IS NULL OR n.row_hash != o.row_hash
+  """, view_name, view_name, view_name);
+
+END;
+
+
+-- Procedure to find the parcels whose scores for one layer may have changed
+-- These are the changed parcels themselves plus every parcel within the layer's max tier distance
+-- of the old or new geometry of a changed feature. Writes affected_parcels_<layer> (parcel_id STRING).
+CREATE OR REPLACE PROCEDURE `clgx-gis-app-prd-364d.proximity_parcels.find_affected_parcels`(encumbrance_table STRING)
+BEGIN
+  DECLARE max_buffer_meters INT64;
+
+  -- Same max tiers as the proximity procedures
+  SET max_buffer_meters = IF(encumbrance_table IN ('roadways', 'railways', 'transmission_lines'), 1000, 150);
+
+  EXECUTE IMMEDIATE FORMAT("""
+    CREATE OR REPLACE TABLE `proximity_parcels.affected_parcels_%s` AS
+    WITH changed_geoms AS (
+      SELECT g AS geom
+      FROM `proximity_parcels.%s_changes`, UNNEST([geom_old, geom_new]) AS g
+      WHERE g IS NOT NULL
+    )
+    -- Removed parcels are kept so merge_delta deletes their rows
+    SELECT feature_id AS parcel_id
+    FROM `proximity_parcels.parcels_changes`
+    UNION DISTINCT
+    SELECT CAST(p.parcelPTID AS STRING) AS parcel_id
+    FROM `proximity_parcels.parcels_mv` AS p
+    JOIN changed_geoms AS c ON ST_DWITHIN(p.geom, c.geom, %d)
+  """, encumbrance_table, encumbrance_table, max_buffer_meters);
+
+END;
+
+
+-- Procedure to collect the parcels affected by any layer, used to refresh all_encumbrance_scores
+CREATE OR REPLACE PROCEDURE `clgx-gis-app-prd-364d.proximity_parcels.collect_affected_parcels`()
+BEGIN
+
+  CREATE OR REPLACE TABLE `clgx-gis-app-prd-364d.proximity_parcels.affected_parcels_all` AS
+  SELECT parcel_id FROM `clgx-gis-app-prd-364d.proximity_parcels.affected_parcels_railways`
+  UNION DISTINCT
+  SELECT parcel_id FROM `clgx-gis-app-prd-364d.proximity_parcels.affected_parcels_roadways`
+  UNION DISTINCT
+  SELECT parcel_id FROM `clgx-gis-app-prd-364d.proximity_parcels.affected_parcels_transmission_lines`
+  UNION DISTINCT
+  SELECT parcel_id FROM `clgx-gis-app-prd-364d.proximity_parcels.affected_parcels_protected_lands_national`
+  UNION DISTINCT
+  SELECT parcel_id FROM `clgx-gis-app-prd-364d.proximity_parcels.affected_parcels_wetlands`;
+
+END;
+
+
+-- Procedure to merge a <table>_delta table into <table>
+-- Rows of parcels in scope are updated or inserted from the delta. Parcels in scope without a delta row
+-- (removed parcels) are deleted. Everything outside the scope is left untouched.
+CREATE OR REPLACE PROCEDURE `clgx-gis-app-prd-364d.proximity_parcels.merge_delta`(target_table STRING, key_col STRING, parcel_scope_table STRING)
+BEGIN
+  DECLARE update_columns STRING;
+
+  -- First run: the delta is the whole table
+  EXECUTE IMMEDIATE FORMAT("""
+    CREATE TABLE IF NOT EXISTS `proximity_parcels.%s`
+    LIKE `proximity_parcels.%s_delta`
+  """, target_table, target_table);
+
+  SET update_columns = (
+    SELECT STRING_AGG(FORMAT("%s = S.%s", column_name, column_name), ", " ORDER BY ordinal_position)
+    FROM `clgx-gis-app-prd-364d.proximity_parcels.INFORMATION_SCHEMA.COLUMNS`
+    WHERE table_name = CONCAT(target_table, '_delta') AND column_name != key_col
+  );
+
+  BEGIN TRANSACTION;
+
+  EXECUTE IMMEDIATE FORMAT("""
+    DELETE FROM `proximity_parcels.%s` AS T
+    WHERE CAST(T.%s AS STRING) IN (SELECT parcel_id FROM `proximity_parcels.%s`)
+      AND T.%s NOT IN (SELECT %s FROM `proximity_parcels.%s_delta`)
+  """, target_table, key_col, parcel_scope_table, key_col, key_col, target_table);
+
+  EXECUTE IMMEDIATE FORMAT("""
+    MERGE `proximity_parcels.%s` AS T
+    USING `proximity_parcels.%s_delta` AS S
+    ON T.%s = S.%s
+    WHEN MATCHED THEN
+      UPDATE SET %s
+    WHEN NOT MATCHED BY TARGET THEN
+      INSERT ROW
+  """, target_table, target_table, key_col, key_col, update_columns);
+
+  COMMIT TRANSACTION;
+
+END;
+
+
+-- Procedure to make the hashes of this run the baseline for the next one
+-- Call only after every delta has been merged, so a failed run is picked up again next time.
+CREATE OR REPLACE PROCEDURE `clgx-gis-app-prd-364d.proximity_parcels.commit_feature_hashes`(view_name STRING)
+BEGIN
+
+  EXECUTE IMMEDIATE FORMAT("""
+    CREATE OR REPLACE TABLE `proximity_parcels.%s_hashes` AS
+    SELECT * FROM `proximity_parcels.%s_hashes_staged`
+  """, view_name, view_name);
+
+  EXECUTE IMMEDIATE FORMAT("""
+    DROP TABLE IF EXISTS `proximity_parcels.%s_hashes_staged`
+  """, view_name);
+
+END;
+
+-- Procedure calls: see run_procedures_incremental.txt
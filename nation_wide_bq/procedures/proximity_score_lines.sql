@@ -1,6 +1,8 @@
 -- Procedure to calculate proximity scores for parcels relative to linear encumbrances (roads, railways, transmission lines)
 -- This version processes all data in a single batch without FIPS filtering
-CREATE OR REPLACE PROCEDURE `clgx-gis-app-prd-364d.proximity_parcels.calculate_proximity_score_lines_batch`(encumbrance_table STRING, encumbrance_id_col STRING)
+-- When parcel_scope_table is set, only the parcels listed in it (parcel_id column) are scored
+-- and the results go to proximity_intersection_<layer>_delta, to be merged with merge_delta
+CREATE OR REPLACE PROCEDURE `clgx-gis-app-prd-364d.proximity_parcels.calculate_proximity_score_lines_batch`(encumbrance_table STRING, encumbrance_id_col STRING, parcel_scope_table STRING)
 BEGIN
   -- Constants
   DECLARE final_table_name STRING;
@@ -8,6 +10,15 @@ BEGIN
 
   SET final_table_name = FORMAT("proximity_parcels.proximity_intersection_%s", encumbrance_table);
 
+  -- Restrict to the parcels in scope for incremental runs
+  CREATE OR REPLACE TEMP TABLE parcel_scope (parcel_id STRING);
+  IF parcel_scope_table IS NOT NULL THEN
+    EXECUTE IMMEDIATE FORMAT("""
+      INSERT INTO parcel_scope SELECT parcel_id FROM `proximity_parcels.%s`
+    """, parcel_scope_table);
+    SET final_table_name = CONCAT(final_table_name, '_delta');
+  END IF;
+
   -- Define buffer tiers based on the encumbrance type
   --IF encumbrance_table = 'roadways' THEN
   --  SET buffer_tiers = [
@@ -43,69 +54,81 @@ BEGIN
     clip, 
     sourcedFips, 
     geom, 
+    ST_AREA(geom) AS parcel_area,
     ST_CENTROID(geom) AS centroid
-  FROM `clgx-gis-app-prd-364d.proximity_parcels.parcels_mv`;
+  FROM `clgx-gis-app-prd-364d.proximity_parcels.parcels_mv`
+  WHERE parcel_scope_table IS NULL OR CAST(parcelPTID AS STRING) IN (SELECT parcel_id FROM parcel_scope);
   
-  -- Step 3: Pre-calculate aggregate impact metrics for each parcel.
-  -- This logic scales perfectly to a full-table batch.
+  -- Step 3: Build every candidate parcel-encumbrance pair once.
+  -- The spatial join and the per-pair predicates, distances and areas are computed a single time
+  -- and shared by the aggregate metrics and the nearest match below.
   EXECUTE IMMEDIATE FORMAT("""
-    CREATE OR REPLACE TEMP TABLE parcel_aggregate_metrics AS
-    SELECT
-        p.parcelPTID,
-        COUNT(DISTINCT IF(ST_INTERSECTS(p.geom, r.buf_intersects), r.%s, NULL)) AS intersect_impact_count,
-        COUNT(DISTINCT IF(ST_INTERSECTS(p.geom, r.buf_very_high), r.%s, NULL)) AS very_high_impact_count,
-        LEAST(
-          IFNULL(
-            ROUND(
-              SAFE_DIVIDE(
-                SUM(ST_AREA(ST_INTERSECTION(p.geom, r.buf_very_high))),
-                ANY_VALUE(ST_AREA(p.geom))
-              ) * 100, 4),
-            0.0),
-          100.0
-        ) AS very_high_area_perc
-    FROM parcels_in_scope AS p
-    JOIN encumbrance_buffered AS r ON ST_INTERSECTS(p.geom, r.buf_max)
-    GROUP BY p.parcelPTID;
-  """, encumbrance_id_col, encumbrance_id_col);
-
-  -- Step 4: Resolve all matches in a single, set-based query.
-  -- This logic also scales perfectly.
-  EXECUTE IMMEDIATE FORMAT("""
-  CREATE OR REPLACE TEMP TABLE resolved_matches AS
-    WITH all_possible_matches AS (
+    CREATE OR REPLACE TEMP TABLE candidate_pairs AS
+    WITH joined AS (
       SELECT
         p.parcelPTID,
         CAST(r.%s AS STRING) AS encumbrance_id,
         p.geom AS parcel_geom,
         p.centroid AS parcel_centroid,
+        p.parcel_area,
         r.geom AS encumbrance_geom,
-        r.buf_intersects
+        r.buf_very_high,
+        -- The 5 m buffer only decides whether the pair intersects
+        ST_INTERSECTS(p.geom, r.buf_intersects) AS is_intersecting,
+        ST_INTERSECTS(p.geom, r.buf_very_high) AS is_very_high
       FROM parcels_in_scope AS p
       JOIN encumbrance_buffered AS r ON ST_INTERSECTS(p.geom, r.buf_max)
-    ),
-    ranked_matches AS (
-      SELECT
-        parcelPTID,
-        encumbrance_id,
-        ST_INTERSECTS(parcel_geom, buf_intersects) AS is_intersecting,
-        ROUND(ST_DISTANCE(parcel_geom, encumbrance_geom), 2) AS shortest_distance,
-        ROUND(ST_DISTANCE(parcel_centroid, encumbrance_geom), 2) AS centroid_distance,
-        IF(ST_INTERSECTS(parcel_geom, buf_intersects),
-           ROUND(ST_PERIMETER(ST_INTERSECTION(parcel_geom, buf_intersects)) / 2, 2),
-           0
-        ) AS len_inside
-      FROM all_possible_matches
     )
-    SELECT *
-    FROM ranked_matches
-    QUALIFY ROW_NUMBER() OVER(
-      PARTITION BY parcelPTID
-      ORDER BY is_intersecting DESC, shortest_distance ASC
-    ) = 1
-  """,
-  encumbrance_id_col
-  );
+    SELECT
+      parcelPTID,
+      encumbrance_id,
+      parcel_area,
+      is_intersecting,
+      is_very_high,
+      ROUND(ST_DISTANCE(parcel_geom, encumbrance_geom), 2) AS shortest_distance,
+      ROUND(ST_DISTANCE(parcel_centroid, encumbrance_geom), 2) AS centroid_distance,
+      -- Length of the raw line clipped to the parcel (a line-polygon clip, not a polygon overlay)
+      IF(is_intersecting,
+         ROUND(ST_LENGTH(ST_INTERSECTION(parcel_geom, encumbrance_geom)), 2),
+         0
+      ) AS len_inside,
+      IF(is_very_high, ST_AREA(ST_INTERSECTION(parcel_geom, buf_very_high)), 0) AS very_high_area
+    FROM joined
+  """, encumbrance_id_col);
+
+  -- Step 4a: Aggregate impact metrics for each parcel from the candidate pairs.
+  CREATE OR REPLACE TEMP TABLE parcel_aggregate_metrics AS
+  SELECT
+      parcelPTID,
+      COUNT(DISTINCT IF(is_intersecting, encumbrance_id, NULL)) AS intersect_impact_count,
+      COUNT(DISTINCT IF(is_very_high, encumbrance_id, NULL)) AS very_high_impact_count,
+      LEAST(
+        IFNULL(
+          ROUND(
+            SAFE_DIVIDE(
+              SUM(very_high_area),
+              ANY_VALUE(parcel_area)
+            ) * 100, 4),
+          0.0),
+        100.0
+      ) AS very_high_area_perc
+  FROM candidate_pairs
+  GROUP BY parcelPTID;
+
+  -- Step 4b: Resolve the best match per parcel from the same candidate pairs.
+  CREATE OR REPLACE TEMP TABLE resolved_matches AS
+  SELECT
+    parcelPTID,
+    encumbrance_id,
+    is_intersecting,
+    shortest_distance,
+    centroid_distance,
+    len_inside
+  FROM candidate_pairs
+  QUALIFY ROW_NUMBER() OVER(
+    PARTITION BY parcelPTID
+    ORDER BY is_intersecting DESC, shortest_distance ASC
+  ) = 1;
 
   -- Step 5: Create the final result set with simplified CASE statement labeling.
   CREATE OR REPLACE TEMP TABLE final_results AS
@@ -156,6 +179,6 @@ BEGIN
 END;
 
 -- Example procedure call
---CALL proximity_parcels.calculate_proximity_score_lines_batch('roadways','ID');
---CALL proximity_parcels.calculate_proximity_score_lines_batch('railways', 'FRAARCID');
---CALL proximity_parcels.calculate_proximity_score_lines_batch('transmission_lines','ID');
\ No newline at end of file
+--CALL proximity_parcels.calculate_proximity_score_lines_batch('roadways','ID', NULL);
+--CALL proximity_parcels.calculate_proximity_score_lines_batch('railways', 'FRAARCID', NULL);
+--CALL proximity_parcels.calculate_proximity_score_lines_batch('transmission_lines','ID', NULL);
\ No newline at end of file
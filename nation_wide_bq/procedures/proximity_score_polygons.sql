@@ -1,15 +1,27 @@
 -- Procedure to calculate proximity scores for parcels relative to polygon encumbrances (protected areas, wetlands)
 -- This version processes all data in a single batch without FIPS filtering
+-- When parcel_scope_table is set, only the parcels listed in it (parcel_id column) are scored
+-- and the results go to proximity_intersection_<layer>_delta, to be merged with merge_delta
 
-CREATE OR REPLACE PROCEDURE `clgx-gis-app-prd-364d.proximity_parcels.calculate_proximity_score_polygons_batch`(encumbrance_table STRING, encumbrance_id_col STRING)
+CREATE OR REPLACE PROCEDURE `clgx-gis-app-prd-364d.proximity_parcels.calculate_proximity_score_polygons_batch`(encumbrance_table STRING, encumbrance_id_col STRING, parcel_scope_table STRING)
 BEGIN 
   -- Define constants
   DECLARE final_table_name STRING;
   DECLARE buffer_tiers ARRAY<STRUCT<buffer_meters INT64, label STRING>>;
   DECLARE max_buffer_meters INT64;
+  DECLARE very_high_buffer_meters INT64;
 
   SET final_table_name = FORMAT("proximity_parcels.proximity_intersection_%s", encumbrance_table);
 
+  -- Restrict to the parcels in scope for incremental runs
+  CREATE OR REPLACE TEMP TABLE parcel_scope (parcel_id STRING);
+  IF parcel_scope_table IS NOT NULL THEN
+    EXECUTE IMMEDIATE FORMAT("""
+      INSERT INTO parcel_scope SELECT parcel_id FROM `proximity_parcels.%s`
+    """, parcel_scope_table);
+    SET final_table_name = CONCAT(final_table_name, '_delta');
+  END IF;
+
   -- Define the buffer tiers for polygons.
   SET buffer_tiers = [
     STRUCT(0 AS buffer_meters, 'intersects' AS label),
@@ -20,6 +32,7 @@ BEGIN
   ];
 
   SET max_buffer_meters = (SELECT MAX(buffer_meters) FROM UNNEST(buffer_tiers));
+  SET very_high_buffer_meters = (SELECT buffer_meters FROM UNNEST(buffer_tiers) WHERE label = 'very high');
 
   -- Step 1: Get all encumbrance geometries from the pre-computed materialized view.
     EXECUTE IMMEDIATE FORMAT("""
@@ -38,83 +51,120 @@ BEGIN
     geom, -- Use the alias 'geom' for consistency
     ST_AREA(geom) AS parcel_area,
     ST_CENTROID(geom) AS centroid
-  FROM `proximity_parcels.parcels_mv`;
-
-  -- Step 3: Pre-calculate aggregate metrics for intersecting parcels.
-  EXECUTE IMMEDIATE FORMAT("""
-    CREATE OR REPLACE TEMP TABLE intersection_aggregate_metrics AS
-    SELECT
-        p.parcelPTID,
-        -- Count unique encumbrances that directly intersect the parcel
-        COUNT(DISTINCT IF(ST_INTERSECTS(p.geom, r.geom), r.%s, NULL)) AS intersect_impact_count,
-        -- Count unique encumbrances within the 'very high' buffer
-        COUNT(DISTINCT IF(ST_INTERSECTS(p.geom, r.buf_very_high), r.%s, NULL)) AS very_high_impact_count,
-        -- Sum the total area of direct intersection for each parcel
-        LEAST(
-          IFNULL(
-            ROUND(
-              SAFE_DIVIDE(
-                SUM(IF(ST_INTERSECTS(p.geom, r.geom), ST_AREA(ST_INTERSECTION(p.geom, r.geom)), 0)),
-                ANY_VALUE(p.parcel_area)
-              ) * 100, 4),
-            0.0),
-          100.0
-        ) AS intersect_area_perc,
-        -- Sum the total area of intersection with the 'very high' buffer for each parcel
-        LEAST(
-          IFNULL(
-            ROUND(
-              SAFE_DIVIDE(
-                SUM(ST_AREA(ST_INTERSECTION(p.geom, r.buf_very_high))),
-                ANY_VALUE(p.parcel_area)
-              ) * 100, 4),
-            0.0),
-          100.0
-        ) AS very_high_area_perc
-    FROM parcels_in_scope AS p
-    -- This join now uses the dynamically created buf_max column.
-    JOIN encumbrance_in_scope AS r ON ST_DWithin(p.geom, r.geom, %d)
-    GROUP BY p.parcelPTID;
-  """, 
-  encumbrance_id_col,
-  encumbrance_id_col,
-  max_buffer_meters);
+  FROM `proximity_parcels.parcels_mv`
+  WHERE parcel_scope_table IS NULL OR CAST(parcelPTID AS STRING) IN (SELECT parcel_id FROM parcel_scope);
 
-  -- Step 4: Resolve all matches in a single, set-based query.
+  -- Step 3: Build every candidate parcel-encumbrance pair within the max distance once.
+  -- The spatial join and the per-pair predicates, distances and areas are computed a single time
+  -- and shared by the aggregate metrics and the best match below.
+  -- Pairs with large polygons cascade through the geometry levels of the materialized view: parcels
+  -- touching geom_core are definite hits, parcels away from geom_hull definite misses, and only
+  -- parcels on the boundary are tested against the exact geometry (levels are NULL for small polygons).
+  -- Polygons too large to pre-buffer (buf_very_high NULL) buffer only the part near the parcel.
   EXECUTE IMMEDIATE FORMAT("""
-  CREATE OR REPLACE TEMP TABLE resolved_matches AS
-    WITH all_possible_matches AS (
-      -- This CTE finds all potential parcel-encumbrance pairs within the max distance.
+    CREATE OR REPLACE TEMP TABLE candidate_pairs AS
+    WITH joined AS (
       SELECT
         p.parcelPTID,
         CAST(r.%s AS STRING) AS encumbrance_id,
         p.geom AS parcel_geom,
         p.centroid AS parcel_centroid,
-        r.geom AS encumbrance_geom
+        p.parcel_area,
+        r.geom AS encumbrance_geom,
+        r.buf_very_high,
+        IFNULL(ST_INTERSECTS(p.geom, r.geom_core), FALSE) AS touches_core,
+        IFNULL(ST_COVERS(r.geom_core, p.geom), FALSE) AS inside_core,
+        CASE
+          WHEN ST_INTERSECTS(p.geom, r.geom_core) THEN TRUE
+          WHEN NOT ST_INTERSECTS(p.geom, r.geom_hull) THEN FALSE
+          ELSE ST_INTERSECTS(p.geom, r.geom)
+        END AS is_intersecting,
+        CASE
+          WHEN ST_INTERSECTS(p.geom, r.geom_core) THEN TRUE
+          WHEN NOT ST_DWITHIN(p.geom, r.geom_hull, %d) THEN FALSE
+          ELSE ST_DWITHIN(p.geom, r.geom, %d)
+        END AS is_very_high
       FROM parcels_in_scope AS p
       JOIN encumbrance_in_scope AS r ON ST_DWithin(p.geom, r.geom, %d)
-    ),
-    ranked_matches AS (
-      -- This CTE calculates the raw intersection status, area, and distances for ranking.
-      SELECT
-        parcelPTID,
-        encumbrance_id,
-        ST_INTERSECTS(parcel_geom, encumbrance_geom) AS is_intersecting,
-        -- USER CHANGE: Calculate intersection area to use for ranking.
-        ROUND(IF(ST_INTERSECTS(parcel_geom, encumbrance_geom), ST_AREA(ST_INTERSECTION(parcel_geom, encumbrance_geom)), 0), 2) AS intersection_area,
-        ROUND(ST_DISTANCE(parcel_geom, encumbrance_geom), 2) AS shortest_distance,
-        ROUND(ST_DISTANCE(parcel_centroid, encumbrance_geom), 2) AS centroid_distance
-      FROM all_possible_matches
     )
-    -- This QUALIFY clause cleanly selects the single best encumbrance for each parcel.
-    SELECT * EXCEPT (intersection_area) -- Exclude area after ranking
-    FROM ranked_matches
-    QUALIFY ROW_NUMBER() OVER(
-      PARTITION BY parcelPTID
-      -- USER CHANGE: The ranking logic now prioritizes intersections, then largest area, then closest distance.
-      ORDER BY is_intersecting DESC, intersection_area DESC, shortest_distance ASC
-    ) = 1
-  """, encumbrance_id_col, max_buffer_meters);
+    SELECT
+      parcelPTID,
+      encumbrance_id,
+      parcel_area,
+      is_intersecting,
+      is_very_high,
+      CASE
+        WHEN NOT is_intersecting THEN 0
+        WHEN inside_core THEN parcel_area
+        ELSE ST_AREA(ST_INTERSECTION(parcel_geom, encumbrance_geom))
+      END AS intersection_area,
+      CASE
+        WHEN NOT is_very_high THEN 0
+        WHEN inside_core THEN parcel_area
+        WHEN buf_very_high IS NOT NULL THEN ST_AREA(ST_INTERSECTION(parcel_geom, buf_very_high))
+        ELSE ST_AREA(ST_INTERSECTION(
+          parcel_geom,
+          ST_BUFFER(ST_INTERSECTION(encumbrance_geom, ST_BUFFER(parcel_geom, %d)), %d)
+        ))
+      END AS very_high_area,
+      IF(touches_core, 0, ROUND(ST_DISTANCE(parcel_geom, encumbrance_geom), 2)) AS shortest_distance,
+      ROUND(ST_DISTANCE(parcel_centroid, encumbrance_geom), 2) AS centroid_distance
+    FROM joined
+  """, 
+  encumbrance_id_col,
+  very_high_buffer_meters,
+  very_high_buffer_meters,
+  max_buffer_meters,
+  very_high_buffer_meters,
+  very_high_buffer_meters);
+
+  -- Step 4a: Aggregate metrics for each parcel from the candidate pairs.
+  CREATE OR REPLACE TEMP TABLE intersection_aggregate_metrics AS
+  SELECT
+      parcelPTID,
+      -- Count unique encumbrances that directly intersect the parcel
+      COUNT(DISTINCT IF(is_intersecting, encumbrance_id, NULL)) AS intersect_impact_count,
+      -- Count unique encumbrances within the 'very high' buffer
+      COUNT(DISTINCT IF(is_very_high, encumbrance_id, NULL)) AS very_high_impact_count,
+      -- Sum the total area of direct intersection for each parcel
+      LEAST(
+        IFNULL(
+          ROUND(
+            SAFE_DIVIDE(
+              SUM(intersection_area),
+              ANY_VALUE(parcel_area)
+            ) * 100, 4),
+          0.0),
+        100.0
+      ) AS intersect_area_perc,
+      -- Sum the total area of intersection with the 'very high' buffer for each parcel
+      LEAST(
+        IFNULL(
+          ROUND(
+            SAFE_DIVIDE(
+              SUM(very_high_area),
+              ANY_VALUE(parcel_area)
+            ) * 100, 4),
+          0.0),
+        100.0
+      ) AS very_high_area_perc
+  FROM candidate_pairs
+  GROUP BY parcelPTID;
+
+  -- Step 4b: Resolve the best match per parcel from the same candidate pairs.
+  CREATE OR REPLACE TEMP TABLE resolved_matches AS
+  SELECT
+    parcelPTID,
+    encumbrance_id,
+    is_intersecting,
+    shortest_distance,
+    centroid_distance
+  FROM candidate_pairs
+  QUALIFY ROW_NUMBER() OVER(
+    PARTITION BY parcelPTID
+    -- Intersections first, then largest area, then closest distance.
+    ORDER BY is_intersecting DESC, ROUND(intersection_area, 2) DESC, shortest_distance ASC
+  ) = 1;
 
   -- Step 5: Create the final result set by joining all pieces together.
   CREATE OR REPLACE TEMP TABLE final_results AS
@@ -166,5 +216,5 @@ BEGIN
 END;
 
 -- Procedure call
---CALL proximity_parcels.calculate_proximity_score_polygons_batch('protected_lands_national','ID'); -- 1 hour 
---CALL proximity_parcels.calculate_proximity_score_polygons_batch('wetlands','NWI_ID'); -- 7 hours 
\ No newline at end of file
+--CALL proximity_parcels.calculate_proximity_score_polygons_batch('protected_lands_national','ID', NULL); -- 1 hour 
+--CALL proximity_parcels.calculate_proximity_score_polygons_batch('wetlands','NWI_ID', NULL); -- 7 hours 
\ No newline at end of file
@@ -0,0 +1,532 @@
+# Benchmark suite for the county encumbrance pipeline on synthetic fixtures
+# Deterministic generators build county-like fixtures for the urban / suburban / rural profiles of
+# POC_FINALIZED_COUNTIES (parcel grids, road / rail / transmission polylines, wetland / protected polygons
+# with realistic vertex counts). The production functions are timed as they are called by the county
+# pipeline (load_encumbrance_data, get_proximity_score_and_intersection_metrics, calculate_intersection_score,
+# assemble_encumbrance_results), and the stages inside get_proximity_score_and_intersection_metrics are
+# split out from its own spans (nation_wide.instrumentation):
+#   load, buffer, sjoin, calculate_intersection_metrics, calculate_intersection_score, merge
+# Results are summarized into a digest and compared against the committed baseline, so both slowdowns
+# and changed outputs are reported.
+
+# Importing required libraries
+import os
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import platform
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import Polygon, LineString
+
+try:
+    import psutil
+except ImportError:  # Peak memory is then taken from the process high-water mark
+    psutil = None
+    import resource
+
+import poc_tested_modules
+from poc_tested_modules import (
+    load_encumbrance_data,
+    load_parcel_data,
+    get_proximity_score_and_intersection_metrics,
+    calculate_intersection_score,
+    geo_crs,
+    projected_crs,
+)
+from nation_wide.instrumentation import configure_tracing, get_tracer, read_spans
+from poc_county_encumbrances import (
+    ENCUMBRANCES,
+    PARCEL_ID_COLUMN,
+    encumbrance_result_batch,
+    assemble_encumbrance_results,
+)
+
+# Recorded with the default arguments (all profiles and layers, scale 1.0, seed 0)
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+STAGES = [
+    'load', 'get_proximity_score_and_intersection_metrics', 'buffer', 'sjoin',
+    'calculate_intersection_metrics', 'calculate_intersection_score', 'merge'
+]
+
+# Spans recorded inside get_proximity_score_and_intersection_metrics, summed into the stage of the same name
+SPAN_STAGES = ['buffer', 'sjoin', 'calculate_intersection_metrics']
+
+# A stage only counts as a regression when it is this much slower than the baseline...
+DEFAULT_TOLERANCE = 0.25
+# ...and slower by at least this many seconds (short stages are noisy)
+MIN_REGRESSION_SECONDS = 0.05
+
+# County profiles, sized after the urban / suburban / rural groups of POC_FINALIZED_COUNTIES
+# Lengths are metres in projected_crs
+PROFILES = {
+    'urban': {
+        'fips_code': '90001',
+        'origin': (-87.70, 41.85),
+        'n_parcels': 40000,
+        'parcel_size': 25,
+        'street_every': 10,     # a street gap after every n parcels
+        'street_width': 15,
+        'n_features': {'roadways': 40, 'railways': 4, 'transmission_lines': 2, 'wetlands': 15, 'protected_lands': 6},
+        'polygon_vertices': {'wetlands': (64, 400), 'protected_lands': (100, 800)},
+        'polygon_radius': {'wetlands': (20, 120), 'protected_lands': (60, 300)},
+    },
+    'suburban': {
+        'fips_code': '90002',
+        'origin': (-97.68, 30.65),
+        'n_parcels': 20000,
+        'parcel_size': 45,
+        'street_every': 8,
+        'street_width': 12,
+        'n_features': {'roadways': 15, 'railways': 2, 'transmission_lines': 3, 'wetlands': 40, 'protected_lands': 5},
+        'polygon_vertices': {'wetlands': (100, 1500), 'protected_lands': (200, 1500)},
+        'polygon_radius': {'wetlands': (30, 250), 'protected_lands': (100, 600)},
+    },
+    'rural': {
+        'fips_code': '90003',
+        'origin': (-91.14, 45.47),
+        'n_parcels': 5000,
+        'parcel_size': 250,
+        'street_every': 6,
+        'street_width': 10,
+        'n_features': {'roadways': 6, 'railways': 1, 'transmission_lines': 4, 'wetlands': 120, 'protected_lands': 8},
+        'polygon_vertices': {'wetlands': (200, 5000), 'protected_lands': (500, 5000)},
+        'polygon_radius': {'wetlands': (50, 600), 'protected_lands': (300, 2000)},
+    },
+}
+
+LINE_ENCUMBRANCES = ['roadways', 'railways', 'transmission_lines']
+
+# Vertex spacing (metres) of generated polylines
+LINE_VERTEX_SPACING = {'roadways': 40, 'railways': 80, 'transmission_lines': 150}
+
+
+# --- Synthetic fixtures ---
+def _origin_projected(profile: dict) -> tuple:
+    origin = gpd.GeoSeries.from_xy([profile['origin'][0]], [profile['origin'][1]], crs=geo_crs).to_crs(projected_crs)
+    return origin.x.iloc[0], origin.y.iloc[0]
+
+
+def _extent(profile: dict, scale: float) -> tuple:
+    '''Returns (minx, miny, size) of the square covered by the parcel grid in projected_crs.'''
+    n_side = int(np.ceil(np.sqrt(profile['n_parcels'] * scale)))
+    block = profile['street_every'] * profile['parcel_size'] + profile['street_width']
+    size = (n_side // profile['street_every'] + 1) * block
+    minx, miny = _origin_projected(profile)
+    return minx, miny, size
+
+
+def generate_parcels(profile: dict, scale: float = 1.0, seed: int = 0) -> gpd.GeoDataFrame:
+    '''
+    Grid of rectangular parcels split into blocks by street gaps. Corners are jittered so
+    parcels are not perfectly aligned. Columns mirror the county parcel files.
+    '''
+    rng = np.random.default_rng(seed)
+    n_parcels = int(profile['n_parcels'] * scale)
+    n_side = int(np.ceil(np.sqrt(n_parcels)))
+    size, every, street = profile['parcel_size'], profile['street_every'], profile['street_width']
+    minx, miny, _ = _extent(profile, scale)
+
+    idx = np.arange(n_parcels)
+    col, row = idx % n_side, idx // n_side
+    x0 = minx + col * size + (col // every) * street
+    y0 = miny + row * size + (row // every) * street
+    jitter = rng.uniform(-0.1, 0.1, size=(n_parcels, 4)) * size
+    inset = 0.05 * size
+
+    geometries = [
+        Polygon([
+            (x + inset + j[0], y + inset),
+            (x + size - inset + j[1], y + inset),
+            (x + size - inset + j[2], y + size - inset),
+            (x + inset + j[3], y + size - inset),
+        ])
+        for x, y, j in zip(x0, y0, jitter)
+    ]
+    parcels = gpd.GeoDataFrame(
+        {
+            PARCEL_ID_COLUMN: [f"{profile['fips_code']}-{i:08d}" for i in idx],
+            'clip': [f"{i:010d}" for i in idx],
+            'fips_code': profile['fips_code'],
+            'land_use': rng.choice(['RES', 'COM', 'AGR', 'IND'], size=n_parcels),
+        },
+        geometry=geometries,
+        crs=projected_crs,
+    ).to_crs(geo_crs)
+
+    # The county files carry the parcel centroid as WKT in geographic CRS
+    parcels['centroid'] = parcels.geometry.to_crs(projected_crs).centroid.to_crs(geo_crs).to_wkt()
+    return parcels
+
+
+def generate_lines(encumbrance: str, profile: dict, scale: float = 1.0, seed: int = 0) -> gpd.GeoDataFrame:
+    '''
+    Polylines crossing the county as smooth random walks, with a vertex every
+    LINE_VERTEX_SPACING metres. Attribute columns mirror the source layers.
+    '''
+    rng = np.random.default_rng(seed)
+    minx, miny, size = _extent(profile, scale)
+    n_features = profile['n_features'][encumbrance]
+    spacing = LINE_VERTEX_SPACING[encumbrance]
+    # Roads wander more than rail or transmission lines
+    turn = {'roadways': 0.15, 'railways': 0.03, 'transmission_lines': 0.01}[encumbrance]
+
+    geometries = []
+    for _ in range(n_features):
+        # Start on the left or bottom edge and head into the county
+        if rng.random() < 0.5:
+            start, heading = (minx, miny + rng.uniform(0, size)), rng.uniform(-0.5, 0.5)
+        else:
+            start, heading = (minx + rng.uniform(0, size), miny), np.pi / 2 + rng.uniform(-0.5, 0.5)
+        n_vertices = int(1.5 * size / spacing) + 2
+        headings = heading + np.cumsum(rng.normal(0, turn, n_vertices))
+        xs = start[0] + np.concatenate([[0], np.cumsum(np.cos(headings[:-1]) * spacing)])
+        ys = start[1] + np.concatenate([[0], np.cumsum(np.sin(headings[:-1]) * spacing)])
+        geometries.append(LineString(np.column_stack([xs, ys])))
+
+    ids = np.arange(1, n_features + 1)
+    if encumbrance == 'roadways':
+        attributes = {'ID': ids, 'ROADNAME': [f"Road {i}" for i in ids], 'CLASS': rng.integers(1, 6, n_features)}
+    elif encumbrance == 'railways':
+        attributes = {'FRAARCID': ids, 'KM': np.round([g.length / 1000 for g in geometries], 3)}
+    else:
+        attributes = {'ID': ids, 'VOLT_CLASS': rng.choice(['100-161', '220-287', '345'], size=n_features)}
+    return gpd.GeoDataFrame(attributes, geometry=geometries, crs=projected_crs).to_crs(geo_crs)
+
+
+def generate_polygons(encumbrance: str, profile: dict, scale: float = 1.0, seed: int = 0) -> gpd.GeoDataFrame:
+    '''
+    Irregular blobs (radius modulated by a few random harmonics plus a little vertex noise)
+    scattered over the county, with vertex counts drawn from the profile range for the layer.
+    Harmonic amplitudes are kept small so the rings stay simple.
+    '''
+    rng = np.random.default_rng(seed)
+    minx, miny, size = _extent(profile, scale)
+    n_features = max(1, int(profile['n_features'][encumbrance] * max(scale, 0.1)))
+    min_vertices, max_vertices = profile['polygon_vertices'][encumbrance]
+    min_radius, max_radius = profile['polygon_radius'][encumbrance]
+
+    geometries = []
+    for _ in range(n_features):
+        cx, cy = minx + rng.uniform(0, size), miny + rng.uniform(0, size)
+        radius = rng.uniform(min_radius, max_radius)
+        n_vertices = int(rng.integers(min_vertices, max_vertices + 1))
+        angles = np.linspace(0, 2 * np.pi, n_vertices, endpoint=False)
+        harmonics = sum(
+            rng.uniform(0.02, 0.08) * np.sin(k * angles + rng.uniform(0, 2 * np.pi))
+            for k in range(2, 6)
+        )
+        # Vertex noise stays below the vertex spacing so the ring does not fold over itself
+        noise = rng.normal(0, 0.25 * 2 * np.pi / n_vertices, n_vertices)
+        radii = radius * (1 + harmonics + noise)
+        geometries.append(Polygon(np.column_stack([cx + radii * np.cos(angles), cy + radii * np.sin(angles)])).buffer(0))
+
+    ids = [f"{encumbrance[:3].upper()}{i:06d}" for i in range(n_features)]
+    if encumbrance == 'wetlands':
+        attributes = {
+            'NWI_ID': ids,
+            'WETLAND_TYPE': rng.choice(['Freshwater Emergent Wetland', 'Riverine', 'Lake', 'Freshwater Pond'], size=n_features),
+            'ATTRIBUTE': rng.choice(['PEM1C', 'R2UBH', 'L1UBH', 'PUBH'], size=n_features),
+        }
+    else:
+        attributes = {'ID': ids, 'MngTp_Desc': rng.choice(['Federal', 'State', 'Local', 'Private'], size=n_features)}
+    return gpd.GeoDataFrame(attributes, geometry=geometries, crs=projected_crs).to_crs(geo_crs)
+
+
+def write_fixtures(profile_name: str, folder: str, encumbrances: list, scale: float = 1.0, seed: int = 0) -> str:
+    '''
+    Writes {fips}_parcels.parquet and {fips}_{encumbrance}.parquet for one profile,
+    named like the county files so the real loaders can read them. Returns the fips code.
+    '''
+    profile = PROFILES[profile_name]
+    fips_code = profile['fips_code']
+    os.makedirs(folder, exist_ok=True)
+
+    generate_parcels(profile, scale, seed).to_parquet(os.path.join(folder, f"{fips_code}_parcels.parquet"))
+    for i, encumbrance in enumerate(encumbrances, start=1):
+        if encumbrance in LINE_ENCUMBRANCES:
+            layer = generate_lines(encumbrance, profile, scale, seed + i)
+        else:
+            layer = generate_polygons(encumbrance, profile, scale, seed + i)
+        layer.to_parquet(os.path.join(folder, f"{fips_code}_{encumbrance}.parquet"))
+    return fips_code
+
+
+# --- Measurement ---
+class _PeakMemorySampler:
+    '''Samples process RSS in a background thread so stage peaks include GEOS / Arrow allocations.'''
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def rss() -> int:
+        if psutil is not None:
+            return psutil.Process().memory_info().rss
+        # ru_maxrss is in KiB on Linux (high-water mark only)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.rss()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.rss())
+
+
+@contextmanager
+def _stage(timings: dict, layer: str, stage: str):
+    start_rss = _PeakMemorySampler.rss()
+    start = time.perf_counter()
+    with _PeakMemorySampler() as sampler:
+        yield
+    timings.setdefault(layer, {})[stage] = {
+        'seconds': round(time.perf_counter() - start, 4),
+        'peak_mb': round(max(sampler.peak - start_rss, 0) / 1024**2, 1),
+    }
+
+
+def _layer_digest(encumbrance: str, scored: pd.DataFrame) -> dict:
+    '''
+    Summary of a layer's outputs that changes whenever the results change.
+    Labels without parcels are left out (categorical label columns count every label of their code table).
+    '''
+    digest = {
+        'labels': {
+            str(label): int(count)
+            for label, count in scored[f'proximity_score_{encumbrance}'].value_counts().sort_index().items()
+            if count
+        }
+    }
+    metric_columns = [
+        col for col in scored.columns
+        if col.endswith(f'_{encumbrance}') and pd.api.types.is_numeric_dtype(scored[col])
+    ]
+    for col in sorted(metric_columns):
+        digest[col] = round(float(scored[col].fillna(0).sum()), 2)
+    if f'intersection_label_{encumbrance}' in scored.columns:
+        digest['intersection_labels'] = {
+            str(label): int(count)
+            for label, count in scored[f'intersection_label_{encumbrance}'].value_counts().sort_index().items()
+            if count
+        }
+    return digest
+
+
+# --- Stages ---
+def _span_stages(trace_dir: str) -> dict:
+    '''
+    Sums the wall time of the SPAN_STAGES spans in a trace folder. Memory is the largest RSS growth
+    of a single span, since the spans are not sampled like the outer stages.
+    '''
+    stages = {}
+    for record in read_spans(trace_dir):
+        if record['name'] not in SPAN_STAGES:
+            continue
+        stage = stages.setdefault(record['name'], {'seconds': 0.0, 'peak_mb': 0.0})
+        stage['seconds'] += record['wall_s']
+        stage['peak_mb'] = max(stage['peak_mb'], record['rss_delta_mb'] or 0.0)
+    return {
+        name: {'seconds': round(stage['seconds'], 4), 'peak_mb': round(stage['peak_mb'], 1)}
+        for name, stage in stages.items()
+    }
+
+
+def benchmark_layer(fips_code: str, encumbrance: str, gdf_parcel: gpd.GeoDataFrame, timings: dict, trace_dir: str):
+    '''
+    Runs the buffer-method pipeline for one layer through the production functions, as
+    process_encumbrance does, with the geometry cache bypassed so every buffer is built.
+    Stages inside get_proximity_score_and_intersection_metrics come from its spans, traced into trace_dir.
+
+    Returns:
+    The scored parcels of the layer.
+    '''
+    with _stage(timings, encumbrance, 'load'):
+        gdf_encumbrance = load_encumbrance_data(fips_code, encumbrance, use_cache=False)
+
+    # Without fips_code the buffered layers are not cached, so reruns measure the same work
+    previous_trace_dir = get_tracer().trace_dir
+    configure_tracing(trace_dir)
+    try:
+        with _stage(timings, encumbrance, 'get_proximity_score_and_intersection_metrics'):
+            scored = get_proximity_score_and_intersection_metrics(
+                encumbrance=encumbrance,
+                gdf_parcel=gdf_parcel,
+                gdf_encumbrance=gdf_encumbrance,
+                method='buffer'
+            )
+    finally:
+        configure_tracing(previous_trace_dir)
+    timings[encumbrance].update(_span_stages(trace_dir))
+
+    if encumbrance in ['wetlands', 'protected_lands'] and f'area_ratio_{encumbrance}' in scored.columns:
+        with _stage(timings, encumbrance, 'calculate_intersection_score'):
+            scored = calculate_intersection_score(encumbrance, gdf_parcel=scored)
+    return scored
+
+
+def run_profile(profile_name: str, encumbrances: list = ENCUMBRANCES, scale: float = 1.0, seed: int = 0) -> dict:
+    '''
+    Generates the fixtures of a profile in a temp folder and benchmarks every layer plus the merge.
+    The loaders are pointed at the temp folder for the duration of the run.
+    '''
+    folder = tempfile.mkdtemp(prefix=f"proximity_benchmark_{profile_name}_")
+    original_folder = poc_tested_modules.PARQUET_FOLDER
+    timings, digests = {}, {}
+    try:
+        fips_code = write_fixtures(profile_name, folder, encumbrances, scale, seed)
+        poc_tested_modules.PARQUET_FOLDER = folder
+
+        with _stage(timings, 'parcels', 'load'):
+            gdf_parcel = load_parcel_data(fips_code)
+
+        batches = []
+        for encumbrance in encumbrances:
+            scored = benchmark_layer(
+                fips_code, encumbrance, gdf_parcel, timings, os.path.join(folder, f"trace_{encumbrance}")
+            )
+            digests[encumbrance] = _layer_digest(encumbrance, scored)
+            batches.append(encumbrance_result_batch(scored))
+
+        with _stage(timings, 'all', 'merge'):
+            merged = assemble_encumbrance_results(gdf_parcel, batches)
+        digests['merged_shape'] = list(merged.shape)
+    finally:
+        poc_tested_modules.PARQUET_FOLDER = original_folder
+        shutil.rmtree(folder, ignore_errors=True)
+
+    return {
+        'profile': profile_name,
+        'scale': scale,
+        'seed': seed,
+        'n_parcels': len(gdf_parcel),
+        'timings': timings,
+        'digest': digests,
+    }
+
+
+# --- Baseline comparison ---
+def machine_info() -> dict:
+    return {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()}
+
+
+def compare_to_baseline(
+        results: dict,
+        baseline: dict,
+        tolerance: float = DEFAULT_TOLERANCE,
+        compare_timings: bool = True) -> list:
+    '''
+    Returns a list of human readable problems: stages slower than the baseline by more than
+    tolerance (and MIN_REGRESSION_SECONDS), and profiles whose output digest changed.
+    Profiles run with a different scale or seed than the baseline are skipped.
+    With compare_timings False (e.g. the baseline was recorded on another machine) only digests are compared.
+    '''
+    problems = []
+    for profile_name, result in results.items():
+        reference = baseline.get('profiles', {}).get(profile_name)
+        if reference is None:
+            problems.append(f"{profile_name}: no baseline")
+            continue
+        if (reference['scale'], reference['seed']) != (result['scale'], result['seed']):
+            problems.append(f"{profile_name}: baseline was recorded with scale={reference['scale']} seed={reference['seed']}, skipped")
+            continue
+
+        if reference['digest'] != result['digest']:
+            for layer in sorted(set(reference['digest']) | set(result['digest'])):
+                if reference['digest'].get(layer) != result['digest'].get(layer):
+                    problems.append(f"{profile_name}/{layer}: results differ from baseline")
+
+        if not compare_timings:
+            continue
+        for layer, stages in result['timings'].items():
+            for stage, measured in stages.items():
+                expected = reference['timings'].get(layer, {}).get(stage)
+                if expected is None:
+                    continue
+                slower = measured['seconds'] - expected['seconds']
+                if measured['seconds'] > expected['seconds'] * (1 + tolerance) and slower > MIN_REGRESSION_SECONDS:
+                    problems.append(
+                        f"{profile_name}/{layer}/{stage}: {measured['seconds']:.3f}s vs baseline {expected['seconds']:.3f}s"
+                    )
+    return problems
+
+
+def print_report(results: dict):
+    rows = []
+    for profile_name, result in results.items():
+        for layer, stages in result['timings'].items():
+            for stage, measured in stages.items():
+                rows.append({'profile': profile_name, 'layer': layer, 'stage': stage, **measured})
+    report = pd.DataFrame(rows)
+    print(report.to_string(index=False))
+    print("\nTotal seconds per stage:")
+    print(report.pivot_table(index='stage', columns='profile', values='seconds', aggfunc='sum').reindex(STAGES).round(3))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the encumbrance pipeline on synthetic county fixtures.')
+    parser.add_argument("--profiles", nargs="+", choices=list(PROFILES), default=list(PROFILES))
+    parser.add_argument("--encumbrances", nargs="+", choices=ENCUMBRANCES, default=ENCUMBRANCES)
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiplier on the number of parcels and polygons per profile")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline JSON to compare against")
+    parser.add_argument("--update-baseline", action="store_true", help="Write this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Allowed slowdown ratio per stage")
+    parser.add_argument("--output", default=None, help="Also write this run's results to a JSON file")
+    args = parser.parse_args()
+
+    results = {
+        profile_name: run_profile(profile_name, args.encumbrances, args.scale, args.seed)
+        for profile_name in args.profiles
+    }
+    print_report(results)
+
+    run_record = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'machine': machine_info(),
+        'profiles': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(run_record, f, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(run_record, f, indent=2)
+        print(f"\nBaseline written to {args.baseline}")
+    elif os.path.isfile(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        # Timings are only comparable on the machine that recorded the baseline; digests are comparable anywhere
+        same_machine = baseline.get('machine') == run_record['machine']
+        if not same_machine:
+            print(f"\nBaseline was recorded on {baseline.get('machine')}; comparing results only, not timings. "
+                  f"Run with --update-baseline to record timings for this machine.")
+        problems = compare_to_baseline(results, baseline, args.tolerance, compare_timings=same_machine)
+        if problems:
+            print("\nRegressions against baseline:")
+            for problem in problems:
+                print(f"  - {problem}")
+            raise SystemExit(1)
+        print("\nNo regressions against baseline.")
+    else:
+        print(f"\nNo baseline at {args.baseline}. Run with --update-baseline to record one.")
@@ -1,5 +1,7 @@
 import concurrent.futures
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 import time
 from functools import partial
 import argparse
@@ -9,8 +11,14 @@ from poc_tested_modules import (
     load_encumbrance_data,
     load_parcel_data,
     get_proximity_score_and_intersection_metrics,
-    calculate_intersection_score
+    calculate_intersection_score,
+    local_metric_crs,
+    layer_bbox,
+    geometry_cache,
+    geo_crs
 )
+from poc_shared_parcels import share_parcels, attach_parcels, release_parcels
+from nation_wide.instrumentation import span, traced, configure_tracing, export_chrome_trace, summarize_spans
 
 # List of encumbrances and the FIPS codes
 ENCUMBRANCES = ['railways', 'roadways', 'transmission_lines','wetlands', 'protected_lands']
@@ -40,25 +48,61 @@ BASE_PARCEL_COLUMNS = [
     'convex_hull'
 ]
 
+# Parcel key used to merge results across encumbrances
+PARCEL_ID_COLUMN = 'spatial_parcel_point_id_pp'
+
+# Parcel columns each worker actually needs; everything else stays with the parent
+WORKER_PARCEL_COLUMNS = [PARCEL_ID_COLUMN, 'centroid', 'geometry']
+
+# Pass as metric_crs to pick the county's own UTM zone from its parcels
+LOCAL_METRIC_CRS = 'local'
+
 # Function to process end to end workflow for one encumbrance type per county
-def process_encumbrance(fips_code: str, encumbrance: str):
-    """Full pipeline for a single encumbrance and FIPS"""
+@traced(attrs=('fips_code', 'encumbrance', 'method', 'metric_crs'))
+def process_encumbrance(
+        fips_code: str,
+        encumbrance: str,
+        method: str = 'buffer',
+        parcels_handle=None,
+        narrow: bool = False,
+        metric_crs: str = None):
+    """
+    Full pipeline for a single encumbrance and FIPS.
+    When parcels_handle is given, parcels are attached from shared memory instead of being reloaded.
+    When narrow is True, only the parcel key and this layer's metric columns are returned,
+    as an Arrow record batch, instead of the full parcel GeoDataFrame.
+    When metric_crs is given (a CRS string, or LOCAL_METRIC_CRS for the county's UTM zone), parcels and
+    the layer are projected into it once and all buffers, distances and areas are measured there.
+    """
     print(f"Processing {encumbrance} for {fips_code}...")
 
-    # Step 1: Load encumbrance data
+    # Step 1: Load parcel data (or attach the copy the parent already loaded)
+    if parcels_handle is not None:
+        raw_parcels = attach_parcels(parcels_handle, columns=WORKER_PARCEL_COLUMNS)
+    else:
+        raw_parcels = load_parcel_data(fips_code)
+
+    if metric_crs == LOCAL_METRIC_CRS:
+        metric_crs = local_metric_crs(raw_parcels)
+    if metric_crs is not None:
+        raw_parcels = raw_parcels.to_crs(metric_crs)
+
+    # Step 2: Load encumbrance data, straight into the metric CRS for project-once runs
+    # Counties without a layer file of their own read the part of the shared file around their parcels
     encumbrance_data = load_encumbrance_data(
         fips_code,
-        encumbrance=encumbrance
+        encumbrance=encumbrance,
+        crs=metric_crs or geo_crs,
+        bbox=layer_bbox(raw_parcels, encumbrance)
         )
 
-    # Step 2: Load parcel data
-    raw_parcels = load_parcel_data(fips_code)
-
     # Step 3: Compute proximity score and intersection metrics
     parcels_with_proximity = get_proximity_score_and_intersection_metrics(
         encumbrance=encumbrance,
         gdf_parcel = raw_parcels,
-        gdf_encumbrance = encumbrance_data
+        gdf_encumbrance = encumbrance_data,
+        method = method,
+        fips_code = fips_code
         )
     
     # Step 4: Calculate intersection score only for specific encumbrances
@@ -70,37 +114,89 @@ def process_encumbrance(fips_code: str, encumbrance: str):
     else:
         final_parcels = parcels_with_proximity
 
+    geometry_cache.log_stats()
     print(f"Finished {encumbrance} for {fips_code} with {len(final_parcels)} parcels.")
-    return final_parcels
+    if narrow:
+        return encumbrance_result_batch(final_parcels)
+    # Full frames are always handed back in geographic CRS
+    return final_parcels.to_crs(geo_crs)
+
+# Function to strip a worker result down to the parcel key and the layer's own columns
+def encumbrance_result_batch(final_parcels) -> pa.RecordBatch:
+    """
+    Converts a scored parcel frame to a compact Arrow record batch with the parcel key
+    and every column the encumbrance pipeline added (base parcel fields are dropped).
+    """
+    metric_columns = [
+        col for col in final_parcels.columns
+        if col not in BASE_PARCEL_COLUMNS and col != PARCEL_ID_COLUMN
+    ]
+    result = pd.DataFrame(final_parcels[[PARCEL_ID_COLUMN] + metric_columns])
+    return pa.RecordBatch.from_pandas(result, preserve_index=False)
+
+# Function to attach narrow per-encumbrance results to the parcels in a single pass
+def assemble_encumbrance_results(parcels, batches: list):
+    """
+    Aligns every result batch to the parcel key once and adds all metric columns together,
+    instead of chaining outer merges of full frames.
+    Parcels without a row in a batch get nulls for that batch's columns.
+    """
+    parcel_keys = parcels[PARCEL_ID_COLUMN].to_numpy()
+    columns = {}
+
+    for batch in batches:
+        batch_keys = batch.column(PARCEL_ID_COLUMN).to_numpy(zero_copy_only=False)
+        metrics = batch.drop_columns([PARCEL_ID_COLUMN]).to_pandas()
+
+        # Workers keep the parent's row order, so the common case needs no reindexing
+        # Otherwise look up each parcel's row in the batch (-1 reindexes to a null row)
+        if not (len(batch_keys) == len(parcel_keys) and np.array_equal(batch_keys, parcel_keys)):
+            positions = pd.Index(batch_keys).get_indexer(parcel_keys)
+            metrics = metrics.reindex(positions)
+
+        # .array keeps categorical label / attribute columns dictionary-encoded
+        for col in metrics.columns:
+            columns[col] = metrics[col].array
+
+    metrics_frame = pd.DataFrame(columns, index=parcels.index)
+    return pd.concat([parcels, metrics_frame], axis=1)
 
 # Function to run multiple encumbrances in parallel for the same county
-def run_parallel_processing(fips_code: str, encumbrances: list):
-    """Run encumbrance processing in parallel and merge results"""
+@traced(attrs=('fips_code', 'method', 'local_crs'))
+def run_parallel_processing(fips_code: str, encumbrances: list, method: str = 'buffer', local_crs: bool = False):
+    """
+    Run encumbrance processing in parallel and merge results.
+    When local_crs is True, the county's UTM zone is picked once here and every worker
+    projects its parcels and layer into it (instead of bouncing through EPSG:3857).
+    """
     print(f"Running full workflow for {fips_code}...")
 
-    # Prepare the worker function with fips
-    with concurrent.futures.ProcessPoolExecutor() as executor:
-        futures = []
-        for enc in encumbrances:
-            futures.append(
-                executor.submit(process_encumbrance, fips_code, enc)
-            )
-
-        # Collect results
-        results = [future.result() for future in concurrent.futures.as_completed(futures)]
+    # Load parcels once in the parent and share them with all workers
+    parcels = load_parcel_data(fips_code)
+    metric_crs = local_metric_crs(parcels) if local_crs else None
+    if metric_crs:
+        print(f"Measuring in local metric CRS {metric_crs}")
+    shm, parcels_handle = share_parcels(parcels)
 
-    # Merge all results on spatial_parcel_point_id_pp
+    # Prepare the worker function with fips
+    try:
+        with concurrent.futures.ProcessPoolExecutor() as executor:
+            futures = []
+            for enc in encumbrances:
+                futures.append(
+                    executor.submit(process_encumbrance, fips_code, enc, method, parcels_handle, True, metric_crs)
+                )
+
+            # Collect results
+            results = [future.result() for future in concurrent.futures.as_completed(futures)]
+    finally:
+        release_parcels(shm)
+
+    # Attach every layer's metric columns to the parent's parcels in one key-aligned pass
     print("Merging results...")
-    final_merged = results[0]
-
-    # Drop base parcel fields from subsequent results to avoid merge conflict
-    for df in results[1:]:
-        df_clean = df.drop(columns=[col for col in BASE_PARCEL_COLUMNS if col in df.columns], errors='ignore')
-        final_merged = final_merged.merge(
-            df_clean,
-            on='spatial_parcel_point_id_pp',
-            how='outer'
-        )
+    with span('assemble_encumbrance_results', rows_in=len(parcels)) as merge_span:
+        final_merged = assemble_encumbrance_results(parcels, results)
+        merge_span.rows_out = len(final_merged)
 
     print(f"All encumbrance data merged. Final shape: {final_merged.shape}")
     return final_merged
@@ -116,10 +212,28 @@ if __name__ == '__main__':
         default=['wetlands', 'protected_lands'],  # or whatever defaults you want
         help='List of encumbrances to run (space-separated)'
     )
+    parser.add_argument(
+        '--method',
+        choices=['buffer', 'nearest'],
+        default='buffer',
+        help='Proximity scoring method: one sjoin per buffer tier, or a single nearest neighbour query'
+    )
+    parser.add_argument(
+        '--local-crs',
+        action='store_true',
+        help="Project parcels and layers once into the county's UTM zone instead of measuring in EPSG:3857"
+    )
+    parser.add_argument(
+        '--trace-dir',
+        default=None,
+        help='Folder to record stage timings in (JSON lines per process, plus a Chrome trace at the end)'
+    )
     args = parser.parse_args()
+    if args.trace_dir:
+        configure_tracing(args.trace_dir)
 
     # Run the parallel processing
-    merged_parcels = run_parallel_processing(args.fips, args.encumbrances)
+    merged_parcels = run_parallel_processing(args.fips, args.encumbrances, method=args.method, local_crs=args.local_crs)
 
     # Create a filename that reflects the encumbrances
     enc_str = '_'.join(enc[:4] for enc in args.encumbrances)
@@ -128,4 +242,8 @@ if __name__ == '__main__':
 
     print(f"Saved output to {output_filename}")
     end_time = time.time()
-    print(f"Processing completed in {end_time - start_time:.2f} seconds.")
\ No newline at end of file
+    print(f"Processing completed in {end_time - start_time:.2f} seconds.")
+
+    if args.trace_dir:
+        print(summarize_spans(args.trace_dir, by=['encumbrance', 'name']))
+        print(f"Chrome trace saved to {export_chrome_trace(args.trace_dir)}")
\ No newline at end of file
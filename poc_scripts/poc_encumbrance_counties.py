@@ -1,27 +1,65 @@
 # Import libraries
 import argparse
-import pandas as pd
-from poc_county_encumbrances import run_parallel_processing 
+from poc_task_scheduler import run_scheduled_tasks, combine_task_outputs, discover_counties
 
-def run_encumbrance_across_counties(encumbrance: str, fips_list: list):
-    all_results = []
+# Per-task outputs and the manifest used to resume interrupted runs
+TASK_OUTPUT_FOLDER = "encumbrance_task_outputs"
 
-    for fips in fips_list:
-        print(f"Processing {encumbrance} for FIPS: {fips}")
-        df = run_parallel_processing(fips_code=fips, encumbrances=[encumbrance])
-        df['fips_code'] = fips  # Make sure each row carries its FIPS for traceability
-        all_results.append(df)
+def run_encumbrance_across_counties(
+        encumbrance: str,
+        fips_list: list,
+        output_folder: str = TASK_OUTPUT_FOLDER,
+        max_workers: int = None,
+        memory_budget_gb: float = None,
+        method: str = 'buffer',
+        combine: bool = True):
+    """
+    Runs one encumbrance for every county in fips_list through the task scheduler.
+    When combine is True, all county results are written to merged_all_{enc}.parquet with the
+    same schema as before: every parcel column (geometry included) plus the layer's metric columns
+    and fips_code. The per-task files in output_folder hold only the parcel key and the metrics.
+    """
+    # Each county is its own task: finished counties are written to disk right away
+    # and skipped when the run is restarted
+    counts = run_scheduled_tasks(
+        fips_list=fips_list,
+        encumbrances=[encumbrance],
+        output_folder=output_folder,
+        max_workers=max_workers,
+        memory_budget_bytes=int(memory_budget_gb * 1024**3) if memory_budget_gb else None,
+        method=method
+    )
+    if counts['failed']:
+        print(f"{counts['failed']} counties failed for {encumbrance}. Rerun to retry them.")
+    if not combine:
+        return
 
-    # Concatenating all results into a single DataFrame
-    combined_df = pd.concat(all_results, ignore_index=True)
+    # Concatenating all completed county results, joined back to their parcels, into a single DataFrame
+    combined_df = combine_task_outputs(output_folder, encumbrance, fips_list, with_parcels=True)
     filename = f"merged_all_{encumbrance[:4]}.parquet"
     combined_df.to_parquet(filename)
     print(f"\n Saved combined results to: {filename}")
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument("encumbrance", help="Encumbrance type to run (e.g., wetlands)")
-    parser.add_argument("--fips", nargs="+", required=True, help="List of FIPS codes")
+    parser.add_argument("encumbrances", nargs="+", help="Encumbrance types to run (e.g., wetlands)")
+    parser.add_argument("--fips", nargs="+", help="List of FIPS codes (default: every county with a local parcel file)")
+    parser.add_argument("--output-folder", default=TASK_OUTPUT_FOLDER, help="Folder for per-task outputs and the manifest")
+    parser.add_argument("--workers", type=int, default=None, help="Maximum number of worker processes")
+    parser.add_argument("--memory-budget-gb", type=float, default=None, help="Estimated memory budget across running tasks")
+    parser.add_argument("--method", choices=['buffer', 'nearest'], default='buffer', help="Proximity scoring method")
+    parser.add_argument("--no-combine", dest="combine", action="store_false", help="Skip writing the combined merged_all parquet per encumbrance")
 
     args = parser.parse_args()
-    run_encumbrance_across_counties(args.encumbrance, args.fips)
+    fips_list = args.fips or discover_counties()
+
+    for encumbrance in args.encumbrances:
+        run_encumbrance_across_counties(
+            encumbrance,
+            fips_list,
+            output_folder=args.output_folder,
+            max_workers=args.workers,
+            memory_budget_gb=args.memory_budget_gb,
+            method=args.method,
+            combine=args.combine
+        )
@@ -0,0 +1,133 @@
+# Cache for projected / buffered encumbrance geometries
+# Reprojected layers are keyed by (layer, fips, CRS, source file fingerprint) and buffered layers by
+# (layer, fips, CRS, buffer distance, fingerprint of the frame that was buffered)
+# and kept in two tiers: an in-memory LRU per process and GeoParquet files on disk.
+# The disk tier is shared by all ProcessPoolExecutor workers and survives reruns.
+
+# Importing required libraries
+import os
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+logger = logging.getLogger(__name__)
+
+# Number of layers kept in memory per process before the least recently used one is evicted
+DEFAULT_MAX_MEMORY_ENTRIES = 16
+
+
+# Function to fingerprint a source file without reading it
+def source_fingerprint(path: str) -> str:
+    '''
+    Fingerprint a source file using its path, size and modification time.
+    Any rewrite of the file changes the fingerprint and invalidates cached geometries built from it.
+    '''
+    stat = os.stat(path)
+    raw = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+
+# Function to fingerprint a layer from its contents
+def frame_fingerprint(gdf: gpd.GeoDataFrame) -> str:
+    '''
+    Fingerprint a GeoDataFrame using its CRS, row count, bounds, geometry WKB and attribute values.
+    Filtered, clipped or otherwise modified copies of a layer get a different fingerprint than the
+    layer file they were read from, so their buffers are never served under the file's key.
+    '''
+    digest = hashlib.sha1()
+    digest.update(f"{gdf.crs}|{len(gdf)}|{tuple(gdf.total_bounds.round(6))}".encode('utf-8'))
+    digest.update(b''.join(shapely.to_wkb(gdf.geometry.values, output_dimension=2)))
+    attributes = gdf.drop(columns=gdf.geometry.name)
+    digest.update(','.join(map(str, attributes.columns)).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(attributes, index=True).to_numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+class GeometryCache:
+    """
+    Two-tier cache of projected and buffered encumbrance layers.
+
+    Memory tier: LRU of GeoDataFrames, local to the process.
+    Disk tier: one GeoParquet file per key under cache_folder (optional).
+    """
+    def __init__(self, cache_folder: Optional[str] = None, max_memory_entries: int = DEFAULT_MAX_MEMORY_ENTRIES):
+        self.cache_folder = cache_folder
+        self.max_memory_entries = max_memory_entries
+        self._memory = OrderedDict()
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+
+    @staticmethod
+    def make_key(layer: str, fips_code: str, crs, buffer_distance, fingerprint: str) -> tuple:
+        """Builds the cache key. A buffer distance of None means the unbuffered (reprojected) layer."""
+        return (layer, str(fips_code), str(crs), buffer_distance, fingerprint)
+
+    def _disk_path(self, key: tuple) -> str:
+        layer, fips_code, crs, buffer_distance, fingerprint = key
+        crs_tag = crs.replace(':', '').lower()
+        buffer_tag = 'raw' if buffer_distance is None else f"buf{buffer_distance}"
+        filename = f"{fips_code}_{layer}_{crs_tag}_{buffer_tag}_{fingerprint}.parquet"
+        return os.path.join(self.cache_folder, filename)
+
+    def _remember(self, key: tuple, gdf: gpd.GeoDataFrame):
+        self._memory[key] = gdf
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: tuple) -> Optional[gpd.GeoDataFrame]:
+        """
+        Returns a cached layer (memory first, then disk), or None on a miss.
+        Cached layers are shared between callers and must be treated as read-only.
+        """
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.stats['memory_hits'] += 1
+            return self._memory[key]
+
+        if self.cache_folder:
+            path = self._disk_path(key)
+            if os.path.isfile(path):
+                gdf = gpd.read_parquet(path)
+                self._remember(key, gdf)
+                self.stats['disk_hits'] += 1
+                return gdf
+
+        self.stats['misses'] += 1
+        return None
+
+    def put(self, key: tuple, gdf: gpd.GeoDataFrame):
+        """Stores a layer in memory and, if configured, on disk."""
+        self._remember(key, gdf)
+        if self.cache_folder:
+            os.makedirs(self.cache_folder, exist_ok=True)
+            path = self._disk_path(key)
+            # Write to a temp file first so concurrent workers never read a partial file
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            gdf.to_parquet(temp_path)
+            os.replace(temp_path, path)
+
+    def get_or_build(self, key: tuple, builder: Callable[[], gpd.GeoDataFrame]) -> gpd.GeoDataFrame:
+        """Returns the cached layer for key, building and storing it on a miss."""
+        gdf = self.get(key)
+        if gdf is None:
+            gdf = builder()
+            self.put(key, gdf)
+        return gdf
+
+    def clear_memory(self):
+        """Drops the memory tier. The disk tier is left untouched."""
+        self._memory.clear()
+
+    def log_stats(self):
+        lookups = sum(self.stats.values())
+        hits = self.stats['memory_hits'] + self.stats['disk_hits']
+        hit_rate = hits / lookups if lookups else 0.0
+        logger.info(
+            f"Geometry cache: {self.stats['memory_hits']} memory hits, {self.stats['disk_hits']} disk hits, "
+            f"{self.stats['misses']} misses ({hit_rate:.0%} hit rate)"
+        )
@@ -0,0 +1,163 @@
+# Multi-resolution geometry store for large polygon layers (wetlands, protected lands)
+# A handful of features with tens of thousands of vertices dominate the cost of every exact
+# predicate and intersection against these layers. Each feature is kept at up to four levels:
+#   bbox  - bounds of the exact geometry
+#   hull  - simplified outer shell that contains the exact geometry
+#   core  - simplified inner shell contained in the exact geometry (may be empty)
+#   exact - the geometry itself
+# Parcel / feature pairs cascade through the levels: outside the bbox or hull is a definite reject,
+# touching the core is a definite accept, and only parcels straddling the boundary reach the exact shape.
+# All geometries must be in a metric CRS.
+
+# Importing required libraries
+import numpy as np
+import shapely
+
+# Features with fewer vertices than this skip the hull / core levels (the exact test is already cheap)
+LEVEL_MIN_VERTICES = 1000
+
+# Simplification tolerance of the hull and core, in metres
+# The simplified shell is offset by twice the tolerance, so the hull always covers the exact boundary
+# and the core always stays inside it
+LEVEL_TOLERANCE = 10.0
+
+# Pair states returned by GeometryLevels.classify
+REJECT, AMBIGUOUS, ACCEPT = -1, 0, 1
+
+
+class GeometryLevels:
+    """
+    Bbox, hull, core and exact levels of an array of features in a metric CRS.
+    Pairs are given as parcel geometries plus the position of their feature in the store.
+    """
+    def __init__(self, geometries, tolerance: float = LEVEL_TOLERANCE, min_vertices: int = LEVEL_MIN_VERTICES):
+        self.exact = np.asarray(geometries, dtype=object)
+        self.bounds = shapely.bounds(self.exact)
+        self.tolerance = tolerance
+
+        # Only large features get a hull and a core; the others are tested against the exact shape
+        self.leveled = shapely.get_num_coordinates(self.exact) >= min_vertices
+        self.hull = np.full(len(self.exact), None, dtype=object)
+        self.core = np.full(len(self.exact), None, dtype=object)
+        if self.leveled.any():
+            simplified = shapely.simplify(self.exact[self.leveled], tolerance)
+            self.hull[self.leveled] = shapely.buffer(simplified, 2 * tolerance, quad_segs=2)
+            self.core[self.leveled] = shapely.buffer(simplified, -2 * tolerance, quad_segs=2)
+        shapely.prepare(self.exact)
+        shapely.prepare(self.hull)
+        shapely.prepare(self.core)
+
+    def __len__(self):
+        return len(self.exact)
+
+    def classify(self, parcels, feature_idx, distance: float = 0.0):
+        """
+        Returns REJECT, ACCEPT or AMBIGUOUS per pair for 'parcel within distance of the feature'
+        (distance 0 is intersects), using only the bbox, hull and core levels.
+        """
+        parcels = np.asarray(parcels, dtype=object)
+        feature_idx = np.asarray(feature_idx)
+        states = np.full(len(parcels), AMBIGUOUS, dtype='int8')
+
+        # Bbox: parcel bounds grown by the distance must overlap the feature bounds
+        parcel_bounds = shapely.bounds(parcels)
+        feature_bounds = self.bounds[feature_idx]
+        overlaps = (
+            (parcel_bounds[:, 0] - distance <= feature_bounds[:, 2])
+            & (parcel_bounds[:, 2] + distance >= feature_bounds[:, 0])
+            & (parcel_bounds[:, 1] - distance <= feature_bounds[:, 3])
+            & (parcel_bounds[:, 3] + distance >= feature_bounds[:, 1])
+        )
+        states[~overlaps] = REJECT
+
+        # Hull rejects, core accepts (anything touching the core is within any distance of the feature)
+        pending = np.flatnonzero(overlaps & self.leveled[feature_idx])
+        if len(pending):
+            hulls = self.hull[feature_idx[pending]]
+            near_hull = shapely.dwithin(hulls, parcels[pending], distance) if distance > 0 else shapely.intersects(hulls, parcels[pending])
+            states[pending[~near_hull]] = REJECT
+
+            pending = pending[near_hull]
+            in_core = shapely.intersects(self.core[feature_idx[pending]], parcels[pending])
+            states[pending[in_core]] = ACCEPT
+        return states
+
+    def dwithin(self, parcels, feature_idx, distance: float = 0.0):
+        """Exact 'parcel within distance of the feature' per pair (intersects for distance 0)."""
+        parcels = np.asarray(parcels, dtype=object)
+        feature_idx = np.asarray(feature_idx)
+        states = self.classify(parcels, feature_idx, distance)
+
+        result = states == ACCEPT
+        ambiguous = np.flatnonzero(states == AMBIGUOUS)
+        features = self.exact[feature_idx[ambiguous]]
+        result[ambiguous] = (
+            shapely.dwithin(features, parcels[ambiguous], distance) if distance > 0
+            else shapely.intersects(features, parcels[ambiguous])
+        )
+        return result
+
+    def distance(self, geometries, feature_idx):
+        """Distance of each geometry to its feature; geometries inside the core of a large feature are at 0."""
+        geometries = np.asarray(geometries, dtype=object)
+        feature_idx = np.asarray(feature_idx)
+        distances = np.zeros(len(geometries), dtype='float64')
+
+        done = np.zeros(len(geometries), dtype=bool)
+        leveled = self.leveled[feature_idx]
+        if leveled.any():
+            done[leveled] = shapely.intersects(self.core[feature_idx[leveled]], geometries[leveled])
+
+        # Outside the core, the exact shape is clipped to a box around the geometry whose reach comes from
+        # the hull distance. A distance found within the box's reach is exact; otherwise the unclipped shape is used
+        near = np.flatnonzero(~done & leveled)
+        if len(near):
+            features = self.exact[feature_idx[near]]
+            reach = shapely.distance(geometries[near], self.hull[feature_idx[near]]) + 4 * self.tolerance
+            bounds = shapely.bounds(geometries[near]) + np.c_[-reach, -reach, reach, reach]
+            clipped = np.array(
+                [shapely.clip_by_rect(feature, *rect) for feature, rect in zip(features, bounds)],
+                dtype=object
+            )
+            near_distances = shapely.distance(geometries[near], clipped)
+            found = near_distances <= reach
+            distances[near[found]] = near_distances[found]
+            done[near[found]] = True
+
+        rest = np.flatnonzero(~done)
+        distances[rest] = shapely.distance(geometries[rest], self.exact[feature_idx[rest]])
+        return distances
+
+    def intersection_measure(self, parcels, feature_idx, measure=shapely.area):
+        """
+        Area (or another measure, e.g. shapely.length) of the intersection of each parcel with its feature.
+
+        Parcels covered by the core of a large feature (or lying strictly inside a small one) take their
+        own measure, parcels off the hull take 0. The rest clip the exact feature to the parcel's bounding
+        box first, so the intersection only sees the few vertices near the parcel.
+        """
+        parcels = np.asarray(parcels, dtype=object)
+        feature_idx = np.asarray(feature_idx)
+        measures = np.zeros(len(parcels), dtype='float64')
+
+        leveled = self.leveled[feature_idx]
+        inside = np.zeros(len(parcels), dtype=bool)
+        outside = np.zeros(len(parcels), dtype=bool)
+        if leveled.any():
+            inside[leveled] = shapely.covers(self.core[feature_idx[leveled]], parcels[leveled])
+            outside[leveled] = ~shapely.intersects(self.hull[feature_idx[leveled]], parcels[leveled])
+        inside[~leveled] = shapely.contains_properly(self.exact[feature_idx[~leveled]], parcels[~leveled])
+        measures[inside] = measure(parcels[inside])
+
+        partial = np.flatnonzero(~inside & ~outside)
+        features = self.exact[feature_idx[partial]]
+        clipped = np.array(
+            [shapely.clip_by_rect(feature, *rect) for feature, rect in zip(features, shapely.bounds(parcels[partial]))],
+            dtype=object
+        )
+        try:
+            measures[partial] = measure(shapely.intersection(parcels[partial], clipped))
+        except shapely.errors.GEOSException:
+            # Rectangle clipping can leave degenerate rings; fall back to the unclipped features
+            measures[partial] = measure(shapely.intersection(parcels[partial], features))
+        return measures
@@ -0,0 +1,325 @@
+# On-demand proximity lookups for new or edited parcels and arbitrary points
+# Each layer is read from GeoParquet once at startup, projected into the metric CRS and kept in memory
+# with its STRtree. A lookup then answers a single geometry or a whole batch with one vectorized
+# nearest-neighbour query per layer (capped at the largest tier, as the 'nearest' scoring method) and
+# measures intersection metrics only for the geometries within the smallest tier, so a parcel costs
+# milliseconds instead of a county run.
+#
+# Per layer, the result has the same fields as the 'nearest' method of the batch pipeline:
+#   proximity_score_{layer}, shortest_distance_{layer}, encumbrance_id_{layer}, n_{layer}_intersections,
+#   line_len_{layer} (lines) or intersec_area / area_ratio / parcel_dist_to /
+#   intersection_score / intersection_label_{layer} (polygons), plus the nearest feature's attributes.
+#
+# Served as a library (ProximityLookup) or a small local HTTP service:
+#   python poc_lookup_service.py --layer wetlands=wetlands.parquet --layer roadways=roadways.parquet
+#   GET  /lookup?lon=-87.63&lat=41.88
+#   POST /lookup  {"geometries": ["POLYGON ((...))", {"type": "Polygon", ...}], "crs": "EPSG:4326"}
+#   GET  /health
+
+# Importing required libraries
+import json
+import time
+import logging
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from pyproj import Transformer
+
+from poc_tested_modules import (
+    buffer_scores_and_labels,
+    assign_proximity_labels,
+    calculate_intersection_metrics,
+    score_intersection_arrays,
+    intersection_labels,
+    ENCUMBRANCE_ID_COLUMNS,
+    DICTIONARY_COLUMNS,
+    geo_crs,
+    projected_crs,
+)
+from nation_wide.geoparquet_io import read_geoparquet
+from nation_wide.instrumentation import span, traced
+
+logger = logging.getLogger(__name__)
+
+LINE_ENCUMBRANCES = ['roadways', 'railways', 'transmission_lines']
+
+# Largest batch accepted by one HTTP request
+MAX_GEOMETRIES_PER_REQUEST = 10000
+
+
+class LayerIndex:
+    """
+    One encumbrance layer held in memory in the metric CRS, with its STRtree built once.
+    Nearest features are searched up to max_distance (the largest tier by default); a larger
+    max_distance keeps shortest distances past the tiers, e.g. for the raw metrics store.
+    """
+    def __init__(self, encumbrance: str, gdf_encumbrance: gpd.GeoDataFrame, metric_crs: str = projected_crs, max_distance: float = None):
+        self.encumbrance = encumbrance
+        self.buffer_distances, self.score_labels = buffer_scores_and_labels(encumbrance)
+        self.max_distance = max_distance or max(self.buffer_distances)
+        self.features = gdf_encumbrance.to_crs(metric_crs).reset_index(drop=True)
+        self.geometries = np.asarray(self.features.geometry.values)
+        self.tree = shapely.STRtree(self.geometries)
+
+        # Nearest encumbrance id, falling back to the row position when the layer has no id column
+        id_col = ENCUMBRANCE_ID_COLUMNS.get(encumbrance)
+        if id_col in self.features.columns:
+            self.ids = self.features[id_col].astype(str).to_numpy()
+        else:
+            self.ids = np.arange(len(self.features)).astype(str)
+        self.attribute_columns = list(self.features.columns.difference(['geometry']))
+
+    @classmethod
+    def from_parquet(cls, encumbrance: str, path: str, metric_crs: str = projected_crs) -> 'LayerIndex':
+        gdf_encumbrance = read_geoparquet(path, dictionary_columns=DICTIONARY_COLUMNS.get(encumbrance))
+        return cls(encumbrance, gdf_encumbrance, metric_crs)
+
+    def __len__(self):
+        return len(self.features)
+
+    def metric_columns(self) -> list:
+        '''Metric columns every lookup returns for this layer, whether or not anything intersects.'''
+        enc = self.encumbrance
+        columns = [f'n_{enc}_intersections']
+        if enc in LINE_ENCUMBRANCES:
+            columns.append(f'line_len_{enc}')
+        else:
+            columns += [f'intersec_area_{enc}', f'area_ratio_{enc}', f'parcel_dist_to_{enc}']
+        return columns
+
+    def score(self, geometries: np.ndarray, centroids: np.ndarray, decimals: int = 2) -> dict:
+        '''
+        Scores geometries (metric CRS) against the layer. centroids are their centroids as WKT in geo_crs.
+        Shortest distances are rounded to decimals, as the batch pipeline (None keeps them exact).
+        Returns the layer's columns as a dict of arrays aligned with geometries.
+        '''
+        enc = self.encumbrance
+
+        # One nearest query for the whole batch, capped at max_distance
+        (query_positions, feature_positions), distances = self.tree.query_nearest(
+            geometries, max_distance=self.max_distance, return_distance=True
+        )
+        # Equidistant features return several rows; keep the first one per geometry
+        query_positions, first = np.unique(query_positions, return_index=True)
+        nearest = np.full(len(geometries), -1)
+        nearest[query_positions] = feature_positions[first]
+        shortest_distance = np.full(len(geometries), np.nan)
+        shortest_distance[query_positions] = distances[first]
+
+        # Columns are collected in a dict and framed once by the caller; inserting them one at a time
+        # into a DataFrame costs more than the spatial queries for a single parcel
+        result = {}
+        result[f'proximity_score_{enc}'] = assign_proximity_labels(shortest_distance, self.buffer_distances, self.score_labels)
+        result[f'shortest_distance_{enc}'] = shortest_distance if decimals is None else np.round(shortest_distance, decimals)
+        result[f'encumbrance_id_{enc}'] = np.where(nearest >= 0, self.ids[nearest], None)
+
+        # Attributes of the nearest feature; -1 reindexes to a null row and categoricals keep their codes
+        attributes = self.features[self.attribute_columns].reindex(nearest)
+        for col in self.attribute_columns:
+            result[f"{col.lower()}_{enc}"] = attributes[col].array
+
+        # Intersection metrics need every feature within the smallest tier, not just the nearest one
+        metrics = {}
+        intersecting = np.flatnonzero(np.asarray(result[f'proximity_score_{enc}']) == self.score_labels[0])
+        if len(intersecting) > 0:
+            pair_query, pair_feature = self.tree.query(
+                geometries[intersecting], predicate='dwithin', distance=self.buffer_distances[0]
+            )
+            candidates = np.unique(pair_feature)
+            buffer_gdf = gpd.GeoDataFrame(
+                geometry=shapely.buffer(self.geometries[candidates], self.buffer_distances[0]),
+                index=candidates,
+                crs=self.features.crs
+            )
+            # Only the geometries within the smallest tier are framed for calculate_intersection_metrics
+            within = gpd.GeoDataFrame(
+                {'centroid': centroids[intersecting]}, geometry=geometries[intersecting], crs=self.features.crs
+            )
+            matched = within.iloc[pair_query].copy()
+            matched['index_right'] = pair_feature
+            within = calculate_intersection_metrics(
+                encumbrance=enc,
+                all_parcels=within,
+                matched_parcels=matched,
+                buffered_encumbrance=buffer_gdf,
+                encumbrance_lines=gpd.GeoSeries(self.geometries[candidates], index=candidates, crs=self.features.crs)
+            )
+            metrics = {col: within[col].to_numpy() for col in within.columns}
+        for col in self.metric_columns():
+            values = np.full(len(geometries), np.nan)
+            if col in metrics:
+                values[intersecting] = metrics[col]
+            result[col] = values
+
+        # Intersection strength score of the polygon layers, as calculate_intersection_score
+        if enc not in LINE_ENCUMBRANCES:
+            scores = score_intersection_arrays(
+                result[f'area_ratio_{enc}'], result[f'parcel_dist_to_{enc}'], result[f'n_{enc}_intersections']
+            )
+            result[f'intersection_score_{enc}'] = scores['intersection_score'][0]
+            result[f'intersection_label_{enc}'] = intersection_labels(scores['intersection_label'][0])
+        return result
+
+
+class ProximityLookup:
+    """
+    In-memory proximity lookups over several layers.
+
+    layers maps encumbrance names to GeoParquet paths (or GeoDataFrames). All layers are loaded and
+    indexed when the lookup is created; lookups are read-only and safe to run from several threads.
+    metric_crs is the CRS distances and areas are measured in (EPSG:3857, as the batch pipeline).
+    """
+    def __init__(self, layers: dict, metric_crs: str = projected_crs):
+        self.metric_crs = metric_crs
+        self._transformers = {}
+        self.layers = {}
+        for encumbrance, source in layers.items():
+            start = time.time()
+            if isinstance(source, gpd.GeoDataFrame):
+                self.layers[encumbrance] = LayerIndex(encumbrance, source, metric_crs)
+            else:
+                self.layers[encumbrance] = LayerIndex.from_parquet(encumbrance, source, metric_crs)
+            logger.info(f"Indexed {len(self.layers[encumbrance]):,} {encumbrance} features in {time.time() - start:.2f}s")
+
+    @traced(name='proximity_lookup', rows_in='geometries')
+    def lookup(self, geometries, crs: str = geo_crs, encumbrances: list = None) -> pd.DataFrame:
+        '''
+        Scores a batch of geometries (GeoSeries, GeoDataFrame or array of shapely geometries in crs)
+        against every layer, or only the layers in encumbrances.
+
+        Returns:
+        DataFrame with one row per geometry (in input order) and every layer's columns.
+        '''
+        if isinstance(geometries, gpd.GeoDataFrame):
+            geometries = geometries.geometry
+        if isinstance(geometries, gpd.GeoSeries):
+            crs = geometries.crs or crs
+            geometries = geometries.values
+        geometries = self._transform(np.asarray(geometries, dtype=object), crs, self.metric_crs)
+        # Centroids are passed to the intersection metrics as WKT in geo_crs, like the parcel files
+        centroids = shapely.to_wkt(self._transform(shapely.centroid(geometries), self.metric_crs, geo_crs))
+
+        columns = {}
+        for encumbrance in encumbrances or list(self.layers):
+            with span('lookup_layer', rows_in=len(geometries), encumbrance=encumbrance):
+                columns.update(self.layers[encumbrance].score(geometries, centroids))
+        return pd.DataFrame(columns, index=pd.RangeIndex(len(geometries)))
+
+    def _transform(self, geometries: np.ndarray, from_crs: str, to_crs: str) -> np.ndarray:
+        '''Reprojects a geometry array with a transformer built once per CRS pair.'''
+        key = (str(from_crs), str(to_crs))
+        if key not in self._transformers:
+            self._transformers[key] = Transformer.from_crs(from_crs, to_crs, always_xy=True)
+        transformer = self._transformers[key]
+        return shapely.transform(geometries, lambda xy: np.column_stack(transformer.transform(xy[:, 0], xy[:, 1])))
+
+    def lookup_points(self, lon, lat, encumbrances: list = None) -> pd.DataFrame:
+        '''Scores lon / lat points (EPSG:4326), one row per point.'''
+        return self.lookup(shapely.points(np.atleast_1d(lon), np.atleast_1d(lat)), crs=geo_crs, encumbrances=encumbrances)
+
+
+# --- HTTP service ---
+def parse_geometry(value):
+    '''Shapely geometry from WKT or a GeoJSON geometry dict.'''
+    if isinstance(value, dict):
+        return shapely.geometry.shape(value)
+    return shapely.from_wkt(value)
+
+
+def records(df: pd.DataFrame) -> list:
+    '''JSON-ready rows of a lookup result (NaN and missing categories become null).'''
+    values = df.astype(object).where(df.notna(), None)
+    return values.to_dict(orient='records')
+
+
+def make_handler(lookup: ProximityLookup):
+    class LookupHandler(BaseHTTPRequestHandler):
+        def _send(self, status, payload):
+            body = json.dumps(payload, default=str).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == '/health':
+                return self._send(200, {'layers': {name: len(layer) for name, layer in lookup.layers.items()}})
+            if url.path != '/lookup':
+                return self._send(404, {'error': f"Unknown path {url.path}"})
+            params = parse_qs(url.query)
+            try:
+                lon, lat = float(params['lon'][0]), float(params['lat'][0])
+            except (KeyError, ValueError):
+                return self._send(400, {'error': "GET /lookup needs numeric 'lon' and 'lat' parameters"})
+            encumbrances = params['layers'][0].split(',') if 'layers' in params else None
+            self._respond(lambda: lookup.lookup_points(lon, lat, encumbrances))
+
+        def do_POST(self):
+            if urlparse(self.path).path != '/lookup':
+                return self._send(404, {'error': f"Unknown path {self.path}"})
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                geometries = [parse_geometry(value) for value in request['geometries']]
+            except Exception as e:
+                return self._send(400, {'error': f"Expected a JSON body with a 'geometries' list of WKT or GeoJSON: {e}"})
+            if len(geometries) > MAX_GEOMETRIES_PER_REQUEST:
+                return self._send(413, {'error': f"At most {MAX_GEOMETRIES_PER_REQUEST} geometries per request"})
+            crs = request.get('crs', geo_crs)
+            self._respond(lambda: lookup.lookup(geometries, crs=crs, encumbrances=request.get('layers')))
+
+        def _respond(self, run):
+            start = time.time()
+            try:
+                result = run()
+            except KeyError as e:
+                return self._send(400, {'error': f"Unknown layer {e}"})
+            except Exception as e:
+                logger.exception("Lookup failed")
+                return self._send(500, {'error': str(e)})
+            self._send(200, {'results': records(result), 'elapsed_ms': round((time.time() - start) * 1000, 2)})
+
+        def log_message(self, format, *args):
+            logger.info(format % args)
+
+    return LookupHandler
+
+
+def serve(lookup: ProximityLookup, host: str = '127.0.0.1', port: int = 8080):
+    server = ThreadingHTTPServer((host, port), make_handler(lookup))
+    print(f"Serving proximity lookups for {list(lookup.layers)} on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+# Running the service with argparse to pass the layer files
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve proximity lookups over in-memory layer indexes.')
+    parser.add_argument(
+        '--layer',
+        action='append',
+        required=True,
+        metavar='ENCUMBRANCE=PATH',
+        help='Layer GeoParquet file, e.g. wetlands=wetlands.parquet (repeat for every layer)'
+    )
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on')
+    parser.add_argument(
+        '--metric-crs',
+        default=projected_crs,
+        help='CRS distances and areas are measured in (EPSG:3857 matches the batch pipeline)'
+    )
+    args = parser.parse_args()
+
+    layers = dict(layer.split('=', 1) for layer in args.layer)
+    serve(ProximityLookup(layers, metric_crs=args.metric_crs), host=args.host, port=args.port)
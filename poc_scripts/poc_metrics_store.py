@@ -0,0 +1,322 @@
+# Raw proximity metrics store with fast re-tiering
+# Labels depend on the tier table (the Python tiers in buffer_scores_and_labels, the product tiers of the
+# BigQuery procedures and README, or a customer-specific cut), but the geometry work behind them does not.
+# The geometry stage measures every parcel against every layer once and persists the raw metrics,
+# keyed by parcel id, in one small parquet file per layer and county:
+#   {store}/{encumbrance}/{fips}.parquet
+#     spatial_parcel_point_id_pp, shortest_distance, encumbrance_id, n_intersections,
+#     line_length (lines) or intersected_area / area_ratio / centroid_distance (polygons)
+# Shortest distances are kept up to the layer's halo (the largest tier of either tier table), so any
+# tier table within it is a relabel: a searchsorted over the stored distances, with no geometry work.
+# Intersection metrics are measured within the smallest Python tier (the 'intersects' buffer), as in
+# the batch pipeline, and the intersection score is recomputed from them with any weights / thresholds.
+# The product tiers are geodesic metres (BigQuery GEOGRAPHY), so they need a store built with --local-crs:
+# EPSG:3857 distances are about 1/cos(latitude) too long (1.3x at 40°N) and would label parcels too far.
+
+# Importing required libraries
+import os
+import json
+import time
+import logging
+import argparse
+import concurrent.futures
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from poc_tested_modules import (
+    load_encumbrance_data,
+    load_parcel_data,
+    buffer_scores_and_labels,
+    assign_proximity_labels,
+    score_intersection_arrays,
+    intersection_labels,
+    metric_crs_for,
+    local_metric_crs,
+    projected_crs,
+)
+from poc_lookup_service import LayerIndex, LINE_ENCUMBRANCES
+from poc_tiling import halo_distance
+from poc_county_encumbrances import PARCEL_ID_COLUMN
+from nation_wide.geoparquet_io import expand_bbox
+from nation_wide.instrumentation import traced
+from nation_wide_bq.local_engine import LINE_BUFFER_TIERS, POLYGON_BUFFER_TIERS
+
+logger = logging.getLogger(__name__)
+
+# Raw metric columns of the store and the pipeline column ({name}_{encumbrance} style) each comes from
+RAW_METRIC_COLUMNS = {
+    'shortest_distance': 'shortest_distance_{encumbrance}',
+    'encumbrance_id': 'encumbrance_id_{encumbrance}',
+    'n_intersections': 'n_{encumbrance}_intersections',
+    'line_length': 'line_len_{encumbrance}',
+    'intersected_area': 'intersec_area_{encumbrance}',
+    'area_ratio': 'area_ratio_{encumbrance}',
+    'centroid_distance': 'parcel_dist_to_{encumbrance}',
+}
+LINE_METRICS = ['shortest_distance', 'encumbrance_id', 'n_intersections', 'line_length']
+POLYGON_METRICS = ['shortest_distance', 'encumbrance_id', 'n_intersections', 'intersected_area', 'area_ratio', 'centroid_distance']
+
+# Store types: distances, lengths and areas fit float32, counts fit int16, ids repeat and are dictionary-encoded
+RAW_METRIC_TYPES = {
+    'shortest_distance': pa.float32(),
+    'encumbrance_id': pa.dictionary(pa.int32(), pa.string()),
+    'n_intersections': pa.int16(),
+    'line_length': pa.float32(),
+    'intersected_area': pa.float32(),
+    'area_ratio': pa.float32(),
+    'centroid_distance': pa.float32(),
+}
+
+# Parquet key-value metadata recording how the metrics were measured
+STORE_METADATA_KEY = b'raw_proximity_metrics'
+
+
+# --- Tier tables ---
+def tier_table(encumbrance: str, source: str = 'python') -> list:
+    '''
+    (distance, label) tiers of a layer, from the most to the least severe.
+    source 'python' is buffer_scores_and_labels; 'product' is the tiers of the BigQuery procedures
+    (proximity_score_lines.sql / proximity_score_polygons.sql, as listed in the README), in geodesic metres.
+    '''
+    if source == 'python':
+        return list(zip(*buffer_scores_and_labels(encumbrance)))
+    elif source == 'product':
+        return list(LINE_BUFFER_TIERS if encumbrance in LINE_ENCUMBRANCES else POLYGON_BUFFER_TIERS)
+    raise ValueError(f"Unknown tier table: {source}. Valid options are: 'python', 'product'.")
+
+
+# --- Geometry stage ---
+def _metric_names(encumbrance: str) -> list:
+    return LINE_METRICS if encumbrance in LINE_ENCUMBRANCES else POLYGON_METRICS
+
+
+@traced(attrs=('encumbrance',), rows_in='gdf_parcel')
+def compute_raw_metrics(
+        encumbrance: str,
+        gdf_parcel,
+        gdf_encumbrance,
+        max_distance: float = None,
+        metric_crs: str = None) -> pa.Table:
+    '''
+    Measures parcels against one layer and returns the raw metrics table of the store.
+    gdf_parcel needs the parcel id and a WKT 'centroid' column in geo_crs, as the parcel files.
+    Shortest distances are kept up to max_distance (halo_distance of the layer by default);
+    parcels further away have a null distance.
+    '''
+    max_distance = max_distance or halo_distance(encumbrance)
+    metric_crs = metric_crs or metric_crs_for(gdf_parcel.crs)
+    layer = LayerIndex(encumbrance, gdf_encumbrance, metric_crs, max_distance=max_distance)
+    scored = layer.score(
+        np.asarray(gdf_parcel.geometry.to_crs(metric_crs).values),
+        gdf_parcel['centroid'].to_numpy(),
+        # Exact distances, so a relabel lands every parcel in the same tier as a full run would
+        decimals=None
+    )
+
+    columns = {PARCEL_ID_COLUMN: pa.array(gdf_parcel[PARCEL_ID_COLUMN].astype(str).to_numpy(), pa.string())}
+    for name in _metric_names(encumbrance):
+        values = scored[RAW_METRIC_COLUMNS[name].format(encumbrance=encumbrance)]
+        if name == 'encumbrance_id':
+            columns[name] = pa.array(values, pa.string()).dictionary_encode()
+        else:
+            values = np.asarray(values, dtype='float64')
+            columns[name] = pa.array(values, RAW_METRIC_TYPES[name], from_pandas=True)
+
+    metadata = {
+        'encumbrance': encumbrance,
+        'max_distance': float(max_distance),
+        'intersection_distance': float(layer.buffer_distances[0]),
+        'metric_crs': metric_crs,
+    }
+    return pa.table(columns).replace_schema_metadata({STORE_METADATA_KEY: json.dumps(metadata).encode('utf-8')})
+
+
+def store_path(store_folder: str, encumbrance: str, fips_code: str) -> str:
+    return os.path.join(store_folder, encumbrance, f"{fips_code}.parquet")
+
+
+def write_raw_metrics(table: pa.Table, store_folder: str, encumbrance: str, fips_code: str) -> str:
+    '''Writes one county's raw metrics of a layer, replacing any previous run of it.'''
+    path = store_path(store_folder, encumbrance, fips_code)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Written next to the target and renamed, so readers never see a partial file
+    pq.write_table(table, path + '.tmp')
+    os.replace(path + '.tmp', path)
+    return path
+
+
+# Worker entry point for one county and one layer
+@traced(attrs=('fips_code', 'encumbrance'))
+def persist_county_metrics(fips_code: str, encumbrance: str, store_folder: str, local_crs: bool = False) -> str:
+    '''
+    Loads a county's parcels and the layer features within the layer's halo of them,
+    and persists the raw metrics. Returns the written path.
+    '''
+    parcels = load_parcel_data(fips_code)
+    max_distance = halo_distance(encumbrance)
+    gdf_encumbrance = load_encumbrance_data(
+        fips_code, encumbrance=encumbrance, bbox=expand_bbox(parcels.total_bounds, max_distance)
+    )
+    metric_crs = local_metric_crs(parcels) if local_crs else None
+    table = compute_raw_metrics(encumbrance, parcels, gdf_encumbrance, max_distance=max_distance, metric_crs=metric_crs)
+    path = write_raw_metrics(table, store_folder, encumbrance, fips_code)
+    print(f"Stored {table.num_rows:,} {encumbrance} metrics for {fips_code} in {path}")
+    return path
+
+
+def build_metrics_store(fips_list: list, encumbrances: list, store_folder: str, max_workers: int = None, local_crs: bool = False) -> dict:
+    '''
+    Runs the geometry stage for every county and layer in parallel.
+
+    Returns:
+    dict of (fips_code, encumbrance) -> exception for the pairs that failed.
+    '''
+    failed = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(persist_county_metrics, fips_code, encumbrance, store_folder, local_crs): (fips_code, encumbrance)
+            for fips_code in fips_list
+            for encumbrance in encumbrances
+        }
+        for future in concurrent.futures.as_completed(futures):
+            error = future.exception()
+            if error is not None:
+                logger.error(f"Failed to store {futures[future][1]} metrics for {futures[future][0]}: {error}")
+                failed[futures[future]] = error
+    return failed
+
+
+# --- Labeling stage ---
+def read_raw_metrics(store_folder: str, encumbrance: str, fips_list: list = None) -> tuple:
+    '''
+    Reads the stored metrics of a layer (all counties, or those in fips_list).
+
+    Returns:
+    (DataFrame indexed by parcel id, store metadata). Ids stay dictionary-encoded as categoricals.
+    '''
+    folder = os.path.join(store_folder, encumbrance)
+    if fips_list is None:
+        paths = sorted(os.path.join(folder, name) for name in os.listdir(folder) if name.endswith('.parquet'))
+    else:
+        paths = [store_path(store_folder, encumbrance, fips_code) for fips_code in fips_list]
+    if not paths:
+        raise FileNotFoundError(f"No stored {encumbrance} metrics in {folder}")
+
+    tables = [pq.read_table(path) for path in paths]
+    metadata = json.loads(tables[0].schema.metadata[STORE_METADATA_KEY])
+    # Counties measured with different settings would label inconsistently
+    for table in tables[1:]:
+        other = json.loads(table.schema.metadata[STORE_METADATA_KEY])
+        metadata['max_distance'] = min(metadata['max_distance'], other['max_distance'])
+        if other['intersection_distance'] != metadata['intersection_distance']:
+            raise ValueError(f"Stored {encumbrance} metrics mix intersection distances; rebuild the store")
+        if (other['metric_crs'] == projected_crs) != (metadata['metric_crs'] == projected_crs):
+            raise ValueError(f"Stored {encumbrance} metrics mix {projected_crs} and local CRS distances; rebuild the store")
+    table = pa.concat_tables([table.replace_schema_metadata(None) for table in tables], promote_options='permissive')
+    # Counties share parcels along their borders only when their files overlap; keep one row per parcel
+    raw = table.to_pandas().drop_duplicates(subset=[PARCEL_ID_COLUMN]).set_index(PARCEL_ID_COLUMN)
+    return raw, metadata
+
+
+def label_metrics(
+        raw: pd.DataFrame,
+        encumbrance: str,
+        tiers: list,
+        metadata: dict = None,
+        score_config: dict = None,
+        geodesic: bool = False) -> pd.DataFrame:
+    '''
+    Turns raw metrics into the pipeline's label columns for a tier table ((distance, label) pairs,
+    see tier_table) and, for polygon layers, an intersection score config (keys of
+    DEFAULT_INTERSECTION_SCORE_CONFIG). No geometry is touched.
+    geodesic marks tiers in geodesic metres (the product tiers); they are rejected for metrics
+    measured in EPSG:3857.
+
+    Returns:
+    DataFrame aligned with raw: proximity_score_{layer}, plus intersection_score_{layer} and
+    intersection_label_{layer} for polygon layers.
+    '''
+    distances, labels = [list(values) for values in zip(*tiers)]
+    if metadata is not None:
+        if geodesic and metadata['metric_crs'] == projected_crs:
+            raise ValueError(
+                f"{encumbrance} tiers are geodesic metres but the metrics were measured in {projected_crs}, "
+                f"whose distances are about 1/cos(latitude) too long; rebuild the store with --local-crs"
+            )
+        if max(distances) > metadata['max_distance']:
+            raise ValueError(
+                f"Tier {max(distances)} m is beyond the {metadata['max_distance']} m the {encumbrance} metrics "
+                f"were stored with; rebuild the store with a larger max_distance"
+            )
+        if distances[0] != metadata['intersection_distance']:
+            logger.warning(
+                f"'{labels[0]}' tier is {distances[0]} m but {encumbrance} intersection metrics were measured "
+                f"within {metadata['intersection_distance']} m; only the labels follow the new tier"
+            )
+
+    result = pd.DataFrame(index=raw.index)
+    result[f'proximity_score_{encumbrance}'] = assign_proximity_labels(raw['shortest_distance'].to_numpy(dtype='float64'), distances, labels)
+    if encumbrance not in LINE_ENCUMBRANCES:
+        scores = score_intersection_arrays(
+            raw['area_ratio'], raw['centroid_distance'], raw['n_intersections'], configs=[score_config or {}]
+        )
+        result[f'intersection_score_{encumbrance}'] = scores['intersection_score'][0]
+        result[f'intersection_label_{encumbrance}'] = intersection_labels(scores['intersection_label'][0])
+    return result
+
+
+def relabel_store(store_folder: str, encumbrances: list, tiers='python', score_config: dict = None, fips_list: list = None) -> pd.DataFrame:
+    '''
+    Labels every stored parcel for each layer in encumbrances. tiers is a tier table source
+    ('python' / 'product') or a dict of encumbrance -> (distance, label) pairs for custom cuts.
+
+    Returns:
+    DataFrame indexed by parcel id with every layer's label columns (parcels missing from a layer's
+    store get null labels for it).
+    '''
+    layers = []
+    for encumbrance in encumbrances:
+        start = time.time()
+        raw, metadata = read_raw_metrics(store_folder, encumbrance, fips_list)
+        layer_tiers = tier_table(encumbrance, tiers) if isinstance(tiers, str) else tiers[encumbrance]
+        layers.append(label_metrics(raw, encumbrance, layer_tiers, metadata, score_config, geodesic=tiers == 'product'))
+        logger.info(f"Labeled {len(raw):,} parcels for {encumbrance} in {time.time() - start:.2f}s")
+    return pd.concat(layers, axis=1)
+
+
+# Running either stage with argparse
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Persist raw proximity metrics once, then relabel them with any tier table.')
+    subparsers = parser.add_subparsers(dest='stage', required=True)
+
+    build = subparsers.add_parser('build', help='Measure parcels against layers and persist the raw metrics')
+    build.add_argument('store', help='Store folder')
+    build.add_argument('fips', nargs='+', help='FIPS codes of the counties')
+    build.add_argument('--encumbrances', nargs='+', default=['roadways', 'railways', 'transmission_lines', 'wetlands', 'protected_lands'])
+    build.add_argument('--max-workers', type=int, default=None)
+    build.add_argument('--local-crs', action='store_true', help="Measure each county in its UTM zone instead of EPSG:3857 (needed to label with the product tiers)")
+
+    label = subparsers.add_parser('label', help='Label the stored metrics with a tier table')
+    label.add_argument('store', help='Store folder')
+    label.add_argument('output', help='Parquet file to write the labels to')
+    label.add_argument('--encumbrances', nargs='+', default=['roadways', 'railways', 'transmission_lines', 'wetlands', 'protected_lands'])
+    label.add_argument('--tiers', default='python', help="Tier table: 'python', 'product', or a JSON file of {encumbrance: [[distance, label], ...]}")
+    label.add_argument('--fips', nargs='+', default=None, help='Only these counties')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    if args.stage == 'build':
+        failed = build_metrics_store(args.fips, args.encumbrances, args.store, args.max_workers, args.local_crs)
+        print(f"Stored metrics for {len(args.fips) * len(args.encumbrances) - len(failed)} county layers, {len(failed)} failed.")
+    else:
+        tiers = args.tiers
+        if tiers not in ('python', 'product'):
+            with open(tiers) as f:
+                tiers = {encumbrance: [tuple(tier) for tier in table] for encumbrance, table in json.load(f).items()}
+        labels = relabel_store(args.store, args.encumbrances, tiers, fips_list=args.fips)
+        labels.reset_index().to_parquet(args.output)
+        print(f"Saved {len(labels):,} labeled parcels to {args.output}")
+    print(f"Completed in {time.time() - start_time:.2f} seconds.")
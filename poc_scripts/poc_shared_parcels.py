@@ -0,0 +1,187 @@
+# Share one county's parcels across ProcessPoolExecutor workers without reloading them
+# The parent loads and reprojects the parcels once and writes them as an Arrow IPC stream
+# (geometry as GeoArrow coordinate and offset buffers, all other columns as Arrow columns) into a
+# single shared memory block. Workers attach read-only: Arrow reads the stream zero-copy, only the
+# requested columns get decoded, and geometries are built straight from the shared coordinate buffers
+# (no per-parcel WKB bytes objects are created in the workers).
+
+# Importing required libraries
+import logging
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pyarrow as pa
+import shapely
+
+from nation_wide.instrumentation import span
+
+logger = logging.getLogger(__name__)
+
+# Blocks attached by this (worker) process. Columns materialized by attach_parcels() may still
+# point into shared memory (e.g. Arrow-backed strings), so blocks stay mapped until the process exits.
+_ATTACHED_BLOCKS = {}
+
+# GeoArrow has no native type for Polygon / MultiPolygon mixes. Single-part parcels are shared in the
+# geometry column and multi-part ones in this column (each null where the other is set), so both are
+# decoded with their own types
+MULTI_PART_COLUMN = '__multi_part_geometry'
+
+# Shapely type ids of single-part geometries and their multi-part counterparts
+_MULTI_PART_TYPES = {0: 4, 1: 5, 3: 6}  # Point / LineString / Polygon
+
+
+@dataclass(frozen=True)
+class SharedParcelsHandle:
+    """Picklable description of a shared parcel block, passed to workers instead of the data itself."""
+    shm_name: str
+    nbytes: int
+    n_rows: int
+    crs: str
+    geometry_col: str = 'geometry'
+
+
+def _attach_untracked(name: str) -> shared_memory.SharedMemory:
+    '''
+    Attaches to an existing shared memory block without taking ownership of it.
+    Only the parent that created the block is responsible for unlinking it.
+    Before Python 3.13 attaching re-registers the block with the resource tracker the workers
+    share with the parent, which is a no-op since the parent registered it already.
+    '''
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+# Function to encode parcel geometries as Arrow columns
+def _geometry_table(geometry: gpd.GeoSeries) -> pa.Table:
+    '''
+    Encodes geometries with GeoArrow's native (coordinate buffer) encoding. Mixes of a single-part
+    type and its multi-part type are split over the geometry column and MULTI_PART_COLUMN.
+    Other mixes have no native encoding and fall back to WKB.
+    '''
+    name = geometry.name or 'geometry'
+    geometries = np.asarray(geometry.array, dtype=object)
+    type_ids = shapely.get_type_id(geometries)
+    present = set(np.unique(type_ids[type_ids >= 0]).tolist())
+
+    columns = {name: geometries}
+    if len(present) == 2 and any(present == {single, multi} for single, multi in _MULTI_PART_TYPES.items()):
+        multi_part = type_ids == max(present)
+        columns = {name: np.where(multi_part, None, geometries), MULTI_PART_COLUMN: np.where(multi_part, geometries, None)}
+    frame = gpd.GeoDataFrame(
+        {col: gpd.GeoSeries(values, crs=geometry.crs) for col, values in columns.items()},
+        geometry=name, crs=geometry.crs
+    )
+    if len(present) > 1 and len(columns) == 1:
+        logger.warning(f"Parcel geometry types {sorted(present)} have no native GeoArrow encoding; sharing them as WKB")
+        return pa.table(frame.to_arrow(index=False, geometry_encoding='WKB'))
+    return pa.table(frame.to_arrow(index=False, geometry_encoding='geoarrow'))
+
+
+# Function to decode one shared geometry column
+def _decode_geometry_column(table: pa.Table, col: str) -> tuple:
+    '''
+    Builds geometries for the non-null rows of a GeoArrow column only (decoding null rows would
+    still create an empty geometry for each of them).
+
+    Returns:
+    (object array of geometries with None for null rows, boolean array of non-null rows)
+    '''
+    column = table.column(col).combine_chunks()
+    valid = np.asarray(column.is_valid())
+    geometries = np.full(len(column), None, dtype=object)
+    if valid.any():
+        compact = column.filter(pa.array(valid)) if column.null_count else column
+        decoded = gpd.GeoDataFrame.from_arrow(pa.Table.from_arrays([compact], schema=pa.schema([table.schema.field(col)])))
+        geometries[valid] = np.asarray(decoded.geometry.array, dtype=object)
+    return geometries, valid
+
+
+# Function to write parcels into shared memory (parent side)
+def share_parcels(gdf_parcel: gpd.GeoDataFrame):
+    '''
+    Serializes parcels into one shared memory block as an Arrow IPC stream.
+
+    Returns:
+    (SharedMemory, SharedParcelsHandle). The caller owns the SharedMemory and must
+    call release_parcels() on it once all workers are done.
+    '''
+    geometry_col = gdf_parcel.geometry.name
+    table = pa.Table.from_pandas(
+        pd.DataFrame(gdf_parcel.drop(columns=[geometry_col])),
+        preserve_index=False
+    )
+    geometry_table = _geometry_table(gdf_parcel.geometry)
+    for field, column in zip(geometry_table.schema, geometry_table.columns):
+        table = table.append_column(field, column)
+
+    # Measure the stream first so the block is allocated exactly once
+    sink = pa.MockOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    nbytes = sink.size()
+
+    shm = shared_memory.SharedMemory(create=True, size=nbytes)
+    stream = pa.FixedSizeBufferWriter(pa.py_buffer(shm.buf))
+    with pa.ipc.new_stream(stream, table.schema) as writer:
+        writer.write_table(table)
+    stream.close()
+
+    handle = SharedParcelsHandle(
+        shm_name=shm.name,
+        nbytes=nbytes,
+        n_rows=len(gdf_parcel),
+        crs=gdf_parcel.crs.to_string() if gdf_parcel.crs else None,
+        geometry_col=geometry_col,
+    )
+    logger.info(f"Shared {handle.n_rows:,} parcels in {nbytes / 1e6:.1f} MB of shared memory ({shm.name})")
+    return shm, handle
+
+
+# Function to rebuild parcels from shared memory (worker side)
+def attach_parcels(handle: SharedParcelsHandle, columns: list = None, positions=None) -> gpd.GeoDataFrame:
+    '''
+    Rebuilds a GeoDataFrame from a shared parcel block.
+    Only the requested columns (plus geometry) are materialized; everything else stays in shared memory.
+    When positions (row positions into the shared frame, e.g. one tile's parcels) are given, only those
+    rows are copied out and decoded, in that order.
+    The returned frame must be treated as read-only.
+    '''
+    if handle.shm_name not in _ATTACHED_BLOCKS:
+        _ATTACHED_BLOCKS[handle.shm_name] = _attach_untracked(handle.shm_name)
+    shm = _ATTACHED_BLOCKS[handle.shm_name]
+
+    with span('attach_parcels', rows_in=handle.n_rows) as attach_span:
+        table = pa.ipc.open_stream(pa.py_buffer(shm.buf)[:handle.nbytes]).read_all()
+        geometry_columns = [col for col in (handle.geometry_col, MULTI_PART_COLUMN) if col in table.column_names]
+        if columns is not None:
+            table = table.select([col for col in columns if col not in geometry_columns] + geometry_columns)
+        if positions is not None:
+            table = table.take(pa.array(positions, type=pa.int64()))
+
+        # Geometries are built from the shared coordinate and offset buffers, without WKB round trips
+        geometry, _ = _decode_geometry_column(table, handle.geometry_col)
+        if MULTI_PART_COLUMN in geometry_columns:
+            multi_part, is_multi_part = _decode_geometry_column(table, MULTI_PART_COLUMN)
+            geometry[is_multi_part] = multi_part[is_multi_part]
+
+        df = table.drop_columns(geometry_columns).to_pandas()
+        gdf_parcel = gpd.GeoDataFrame(df, geometry=gpd.GeoSeries(geometry, crs=handle.crs).values, crs=handle.crs)
+        if handle.geometry_col != 'geometry':
+            gdf_parcel = gdf_parcel.rename_geometry(handle.geometry_col)
+        attach_span.rows_out = len(gdf_parcel)
+    return gdf_parcel
+
+
+# Function to free the shared block (parent side)
+def release_parcels(shm: shared_memory.SharedMemory):
+    '''
+    Closes and unlinks a shared parcel block created by share_parcels().
+    Workers that are still attached keep their mapping until they exit.
+    '''
+    shm.close()
+    shm.unlink()
@@ -0,0 +1,272 @@
+# Scheduler for running (county, encumbrance) tasks nationwide
+# Every (fips, encumbrance) pair is an independent task. Tasks are ordered largest-first by input size,
+# run on a bounded process pool that also respects a memory budget, and each one writes its own
+# output file as soon as it finishes. A JSON lines manifest records finished tasks so a rerun
+# after a crash or OOM only picks up what is left.
+
+# Importing required libraries
+import os
+import re
+import json
+import time
+import logging
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from poc_tested_modules import PARQUET_FOLDER, load_parcel_data
+from poc_county_encumbrances import process_encumbrance, assemble_encumbrance_results
+
+logger = logging.getLogger(__name__)
+
+# Rough ratio between on-disk parquet size and peak in-memory footprint of a task
+# (decoded geometries, buffered copies, sjoin results). Used only for admission control.
+MEMORY_PER_INPUT_BYTE = 8
+
+MANIFEST_FILENAME = 'manifest.jsonl'
+
+
+@dataclass(frozen=True)
+class EncumbranceTask:
+    fips_code: str
+    encumbrance: str
+    cost: int = 0
+    memory_bytes: int = 0
+
+    @property
+    def task_id(self) -> str:
+        return f"{self.fips_code}_{self.encumbrance}"
+
+
+# Function to list every county that has a parcel file locally
+def discover_counties(parquet_folder: str = PARQUET_FOLDER) -> list:
+    '''
+    Returns FIPS codes of all {fips}_parcels.parquet files in the parquet folder.
+    '''
+    pattern = re.compile(r'^(\d{5})_parcels\.parquet$')
+    matches = (pattern.match(filename) for filename in os.listdir(parquet_folder))
+    return sorted(match.group(1) for match in matches if match)
+
+
+# Function to size a task from parquet footers without reading any data
+def estimate_task(fips_code: str, encumbrance: str, parquet_folder: str = PARQUET_FOLDER) -> EncumbranceTask:
+    '''
+    Builds a task with its cost (parcel rows + encumbrance rows) and estimated peak memory.
+    Missing input files give a zero-cost task, which then fails fast with the loader's own error.
+    '''
+    cost = 0
+    input_bytes = 0
+    for filename in (f"{fips_code}_parcels.parquet", f"{fips_code}_{encumbrance}.parquet"):
+        path = os.path.join(parquet_folder, filename)
+        if os.path.isfile(path):
+            cost += pq.ParquetFile(path).metadata.num_rows
+            input_bytes += os.path.getsize(path)
+    return EncumbranceTask(fips_code, encumbrance, cost, input_bytes * MEMORY_PER_INPUT_BYTE)
+
+
+# Function to read which tasks have already been completed
+def read_manifest(output_folder: str) -> dict:
+    '''
+    Returns the last manifest record per task id.
+    '''
+    manifest_path = os.path.join(output_folder, MANIFEST_FILENAME)
+    records = {}
+    if not os.path.isfile(manifest_path):
+        return records
+    with open(manifest_path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave a partial last line; treat that task as not done
+                continue
+            records[record['task_id']] = record
+    return records
+
+
+def _append_manifest(output_folder: str, record: dict):
+    manifest_path = os.path.join(output_folder, MANIFEST_FILENAME)
+    with open(manifest_path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def task_output_path(output_folder: str, task: EncumbranceTask) -> str:
+    return os.path.join(output_folder, f"{task.task_id}.parquet")
+
+
+# Worker entry point: run one task and write its output file
+def run_task(task: EncumbranceTask, output_folder: str, method: str = 'buffer', metric_crs: str = None) -> dict:
+    '''
+    Runs one (fips, encumbrance) task in a worker process and writes its narrow result
+    (parcel key + layer metrics + fips_code) to its own parquet file.
+    Only a small summary travels back to the parent.
+    '''
+    start_time = time.time()
+    batch = process_encumbrance(task.fips_code, task.encumbrance, method=method, narrow=True, metric_crs=metric_crs)
+    table = pa.Table.from_batches([batch])
+    table = table.append_column('fips_code', pa.array([task.fips_code] * table.num_rows, type=pa.string()))
+
+    # Write to a temp file first so a killed worker never leaves a file that looks complete
+    output_path = task_output_path(output_folder, task)
+    temp_path = f"{output_path}.tmp"
+    pq.write_table(table, temp_path)
+    os.replace(temp_path, output_path)
+
+    return {
+        'rows': table.num_rows,
+        'seconds': round(time.time() - start_time, 2),
+        'output': output_path,
+    }
+
+
+# Main scheduler
+def run_scheduled_tasks(
+        fips_list: list,
+        encumbrances: list,
+        output_folder: str,
+        max_workers: int = None,
+        memory_budget_bytes: int = None,
+        method: str = 'buffer',
+        metric_crs: str = None) -> dict:
+    '''
+    Runs every (fips, encumbrance) pair that is not already complete in the manifest.
+
+    Tasks start largest-first. A task is only started while the estimated memory of all
+    running tasks stays within memory_budget_bytes (one task may always run on its own).
+    Each worker process handles a single task so its memory is returned to the OS afterwards.
+    A crashed worker (e.g. OOM kill) marks its in-flight tasks as failed and the pool is rebuilt.
+    metric_crs is passed to process_encumbrance (LOCAL_METRIC_CRS measures each county in its own UTM zone).
+
+    Returns:
+    dict with counts of 'done', 'failed' and 'skipped' tasks.
+    '''
+    os.makedirs(output_folder, exist_ok=True)
+    max_workers = max_workers or os.cpu_count() or 1
+
+    # Skip tasks already recorded as done whose output is still on disk
+    manifest = read_manifest(output_folder)
+    tasks = []
+    skipped = 0
+    for fips_code in fips_list:
+        for encumbrance in encumbrances:
+            task = estimate_task(fips_code, encumbrance)
+            record = manifest.get(task.task_id)
+            if record and record.get('status') == 'done' and os.path.isfile(task_output_path(output_folder, task)):
+                skipped += 1
+                continue
+            tasks.append(task)
+
+    # Largest tasks first so the long ones don't end up running alone at the end
+    tasks.sort(key=lambda task: task.cost, reverse=True)
+    logger.info(f"Scheduling {len(tasks)} tasks ({skipped} already complete) on {max_workers} workers")
+
+    counts = {'done': 0, 'failed': 0, 'skipped': skipped}
+    pending = list(tasks)
+    running = {}
+
+    def fits_budget(task):
+        if memory_budget_bytes is None or not running:
+            return True
+        in_use = sum(running_task.memory_bytes for running_task in running.values())
+        return in_use + task.memory_bytes <= memory_budget_bytes
+
+    def record(task, status, **details):
+        counts[status] += 1
+        _append_manifest(output_folder, {
+            'task_id': task.task_id,
+            'fips_code': task.fips_code,
+            'encumbrance': task.encumbrance,
+            'status': status,
+            **details,
+        })
+
+    def new_executor():
+        return concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, max_tasks_per_child=1)
+
+    executor = new_executor()
+    try:
+        while pending or running:
+            # Admit the largest pending tasks that fit the worker and memory limits
+            for task in list(pending):
+                if len(running) >= max_workers:
+                    break
+                if fits_budget(task):
+                    pending.remove(task)
+                    future = executor.submit(run_task, task, output_folder, method, metric_crs)
+                    running[future] = task
+
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            pool_broken = False
+            for future in done:
+                task = running.pop(future)
+                try:
+                    summary = future.result()
+                    record(task, 'done', **summary)
+                    logger.info(f"Finished {task.task_id}: {summary['rows']:,} rows in {summary['seconds']}s")
+                except BrokenProcessPool as e:
+                    pool_broken = True
+                    record(task, 'failed', error=f"worker crashed: {e}")
+                    logger.error(f"Worker crashed while running {task.task_id}")
+                except Exception as e:
+                    record(task, 'failed', error=str(e))
+                    logger.error(f"Task {task.task_id} failed: {e}")
+
+            # A dead worker breaks the whole pool: fail what was in flight and start a fresh pool
+            if pool_broken:
+                for future, task in list(running.items()):
+                    record(task, 'failed', error='worker pool crashed')
+                running.clear()
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = new_executor()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    logger.info(f"Scheduler finished: {counts['done']} done, {counts['failed']} failed, {counts['skipped']} skipped")
+    return counts
+
+
+# Function to combine per-task outputs for one encumbrance
+def combine_task_outputs(
+        output_folder: str,
+        encumbrance: str,
+        fips_list: list = None,
+        with_parcels: bool = False) -> pd.DataFrame:
+    '''
+    Reads the completed per-task files of one encumbrance back into a single DataFrame.
+    Task files are narrow (parcel key + layer metrics + fips_code). When with_parcels is True,
+    each county's parcels are reloaded and the metrics attached to them, which gives the full
+    parcel GeoDataFrame (geometry and base parcel columns, in geo_crs) that
+    run_parallel_processing returns.
+    '''
+    manifest = read_manifest(output_folder)
+    records = sorted(
+        (
+            record for record in manifest.values()
+            if record.get('status') == 'done'
+            and record['encumbrance'] == encumbrance
+            and (fips_list is None or record['fips_code'] in fips_list)
+        ),
+        key=lambda record: record['output']
+    )
+    if not records:
+        return pd.DataFrame()
+    if not with_parcels:
+        return pd.concat((pd.read_parquet(record['output']) for record in records), ignore_index=True)
+
+    frames = []
+    for record in records:
+        metrics = pq.read_table(record['output']).drop_columns(['fips_code']).combine_chunks()
+        parcels = load_parcel_data(record['fips_code'])
+        county = assemble_encumbrance_results(parcels, metrics.to_batches())
+        county['fips_code'] = record['fips_code']
+        frames.append(county)
+    return pd.concat(frames, ignore_index=True)
@@ -1,6 +1,7 @@
 # Importing libraries
 # Importing required libraries
 import os
+import hashlib
 import subprocess
 import time
 import logging
@@ -10,15 +11,21 @@ from collections import defaultdict
 import pandas as pd
 import numpy as np
 import geopandas as gpd
+import shapely
 from shapely.geometry import Polygon
-from shapely import wkt
+from pyproj import Transformer
 import fiona
 import matplotlib.pyplot as plt
 import seaborn as sns
 import nation_wide.utils as utils
+from nation_wide.instrumentation import span, traced
+from nation_wide.geoparquet_io import read_geoparquet, expand_bbox
+from poc_geometry_cache import GeometryCache, source_fingerprint, frame_fingerprint
+from poc_geometry_levels import GeometryLevels
 
 # Setup logging
-# TODO: Setup location to save logs and time functions
+# TODO: Setup location to save logs
+# Stage timings are recorded with nation_wide.instrumentation (set PROXIMITY_TRACE_DIR to enable)
 logging.basicConfig(
     level=logging.INFO,  # or DEBUG
     format='%(asctime)s - %(levelname)s - %(message)s',
@@ -62,33 +69,156 @@ EncumbranceType = Literal[
 # Files are saved as {fips_encumbrance.parquet} or {fips_parcels.parquet} 
 PARQUET_FOLDER = r"C:\Users\eprashar\OneDrive - CoreLogic Solutions, LLC\github\feb_25_encumbered_parcels\encumbered-parcels\ingestion_parquets"
 
+# Reprojected and buffered encumbrance layers are cached here as GeoParquet
+# Shared across workers and reruns; safe to delete at any time
+# Set PROXIMITY_GEOMETRY_CACHE_DIR to move it, or to an empty string to keep the cache in memory only
+GEOMETRY_CACHE_DIR_ENV = 'PROXIMITY_GEOMETRY_CACHE_DIR'
+GEOMETRY_CACHE_FOLDER = os.environ.get(GEOMETRY_CACHE_DIR_ENV, os.path.join(PARQUET_FOLDER, "geometry_cache")) or None
+geometry_cache = GeometryCache(GEOMETRY_CACHE_FOLDER)
+
+# National or state layer files (GeoParquet with a bbox covering column, see nation_wide.geoparquet_io)
+# Counties without their own {fips_encumbrance.parquet} read their part of these, e.g.
+# {'roadways': os.path.join(PARQUET_FOLDER, 'roadways.parquet')}
+SHARED_LAYER_FILES = {}
+
+# Low-cardinality attribute columns of each layer, kept as categoricals: dictionary-encoded in memory
+# (one small int code per feature) and in parquet outputs. Wetland attributes repeat a few hundred
+# distinct strings over millions of features. Columns missing from a layer file are ignored.
+DICTIONARY_COLUMNS = {
+    'wetlands': [
+        'state', 'fips', 'county', 'county_full_name', 'ATTRIBUTE', 'WETLAND_TYPE', 'SUBSYSTEM_NAME',
+        'CLASS_NAME', 'SUBCLASS_NAME', 'SPLIT_CLASS_NAME', 'WATER_REGIME_NAME', 'WATER_REGIME_SUBGROUP'
+    ],
+    'protected_lands': [
+        'FeatClass', 'Category', 'Own_Type', 'Own_Name', 'Mang_Type', 'Mang_Name', 'Des_Tp',
+        'GAP_Sts', 'IUCN_Cat', 'Pub_Access', 'State_Nm'
+    ],
+    'transmission_lines': ['TYPE', 'STATUS', 'OWNER', 'VOLT_CLASS'],
+}
+
+def categorize_columns(df: pd.DataFrame, columns: list) -> pd.DataFrame:
+    '''Converts the columns of df listed in columns to categoricals in place (missing columns are skipped).'''
+    for col in columns:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    return df
+
+# Local metric CRS for project-once runs
+# EPSG:3857 stretches lengths by 1/cos(latitude) (about 1.5x in King County, WA and 2x in Alaska),
+# so tier distances and areas measured in it are off at northern latitudes. The UTM zone of a county
+# or tile keeps scale error under 0.1%, so parcels and layers can be projected into it once
+# and every buffer, distance and area is measured there.
+def local_metric_crs(gdf: gpd.GeoDataFrame) -> str:
+    """
+    Returns the UTM zone CRS covering a county or tile (e.g. 'EPSG:32610'), as a string
+    so it can be passed to worker processes.
+    """
+    return gdf.estimate_utm_crs().to_string()
+
+# CRS that buffers, distances and areas are measured in for geometries in crs
+def metric_crs_for(crs) -> str:
+    """
+    Geometries already in a projected CRS (project-once runs) stay in it.
+    Geographic geometries are measured in projected_crs, as before.
+    """
+    if crs is not None and crs.is_projected:
+        return crs.to_string()
+    return projected_crs
+
 # Define function to get encumbrance parquet for the county
+@traced(attrs=('fips_code', 'encumbrance', 'crs'))
 def load_encumbrance_data(
         fips_code:str,
-        encumbrance:str):
+        encumbrance:str,
+        use_cache: bool = True,
+        crs: str = geo_crs,
+        bbox: tuple = None):
     """
+    Load the encumbrance layer for a county in crs (EPSG:4326 by default, or a local metric CRS
+    to project the layer once for the whole run).
+    The reprojected layer is served from the geometry cache when use_cache is True.
+    County files are read whole. A county without one reads its part of the layer's file in
+    SHARED_LAYER_FILES instead, which needs bbox (geographic, see layer_bbox): only the row groups
+    intersecting it are decoded.
     """
     # Load encumbrance data saved in local
     # CHECK PATH FOR PARQUET FOLDER 
     # Construct path to parquet file
     parquet_path = os.path.join(PARQUET_FOLDER, f"{fips_code}_{encumbrance}.parquet")
+    read_bbox = None
+    if not os.path.isfile(parquet_path) and encumbrance in SHARED_LAYER_FILES:
+        if bbox is None:
+            raise ValueError(f"No {encumbrance} file for county {fips_code}; a bbox is needed to read its part of {SHARED_LAYER_FILES[encumbrance]}")
+        parquet_path, read_bbox = SHARED_LAYER_FILES[encumbrance], tuple(bbox)
 
     # Check if file exists before reading
     if not os.path.isfile(parquet_path):
         raise FileNotFoundError(f"Parquet file not found at: {parquet_path}. Please check the path!")
 
-    # Proceed to load the file
-    gdf_encumbrance = gpd.read_parquet(parquet_path)
-
-    # Convert to EPSG:4326
-    gdf_encumbrance = gdf_encumbrance.to_crs(geo_crs)
+    # Proceed to load the file and convert to crs
+    def _read_and_reproject():
+        return read_geoparquet(
+            parquet_path, bbox=read_bbox, dictionary_columns=DICTIONARY_COLUMNS.get(encumbrance)
+        ).to_crs(crs)
+
+    if not use_cache:
+        return _read_and_reproject()
+
+    fingerprint = source_fingerprint(parquet_path)
+    if read_bbox is not None:
+        # Only this bbox's part of the shared file is cached
+        fingerprint += '_' + hashlib.sha1(repr(tuple(round(v, 6) for v in read_bbox)).encode('utf-8')).hexdigest()[:8]
+    key = GeometryCache.make_key(encumbrance, fips_code, crs, None, fingerprint)
+    gdf_encumbrance = geometry_cache.get_or_build(key, _read_and_reproject)
     # print(f'CRS of the {encumbrance} dataframe is {gdf_encumbrance.crs}')
     return gdf_encumbrance
 
+# Buffer an encumbrance layer in projected CRS and return it in geographic CRS
+def buffer_encumbrance(
+        gdf_encumbrance: gpd.GeoDataFrame,
+        distance: float,
+        encumbrance: str = None,
+        fips_code: str = None,
+        fingerprint: str = None) -> gpd.GeoDataFrame:
+    '''
+    Buffer every encumbrance geometry by distance (metres, in projected CRS) and reproject back to geo_crs.
+    Layers already in a projected CRS (project-once runs) are buffered in place and stay in that CRS.
+    When encumbrance and fips_code are given, the result is cached against the contents of gdf_encumbrance
+    (see frame_fingerprint) so each buffer distance is only built once per layer across encumbrances,
+    workers and reruns. Callers buffering the same frame at several distances can pass its fingerprint
+    to hash it only once.
+    '''
+    output_crs = gdf_encumbrance.crs.to_string() if gdf_encumbrance.crs.is_projected else geo_crs
+
+    def _build():
+        if gdf_encumbrance.crs.is_projected:
+            return gdf_encumbrance.set_geometry(gdf_encumbrance.geometry.buffer(distance))
+
+        # Project to a projected CRS for buffering
+        buffer_gdf = gdf_encumbrance.to_crs(projected_crs)
+
+        # Replace geometry with its buffered version
+        buffer_gdf = buffer_gdf.set_geometry(buffer_gdf.geometry.buffer(distance))
+
+        # Reproject back to geo_crs
+        return buffer_gdf.to_crs(geo_crs)
+
+    if encumbrance is None or fips_code is None:
+        return _build()
+
+    if fingerprint is None:
+        fingerprint = frame_fingerprint(gdf_encumbrance)
+    key = GeometryCache.make_key(encumbrance, fips_code, output_crs, distance, fingerprint)
+    return geometry_cache.get_or_build(key, _build)
+
 # Define function to get parcel data for the defined county
-def load_parcel_data(fips_code: str) -> gpd.GeoDataFrame:
+@traced(attrs=('fips_code', 'crs'))
+def load_parcel_data(fips_code: str, crs: str = geo_crs, bbox: tuple = None) -> gpd.GeoDataFrame:
     """
     Load parcel data from BigQuery and filter by FIPS code.
+    Parcels are returned in crs (EPSG:4326 by default, or a local metric CRS for project-once runs).
+    When bbox (geographic) is given, only parcels whose bounding box intersects it are read,
+    e.g. one tile of a large county.
     """
     # Load parcel parquet file saved in local
     # CHECK PATH FOR PARQUET FOLDER
@@ -100,13 +230,22 @@ def load_parcel_data(fips_code: str) -> gpd.GeoDataFrame:
         raise FileNotFoundError(f"Parquet file not found at: {parquet_path}. Please check the path!")
 
     # Proceed to load the file
-    gdf_parcel = gpd.read_parquet(parquet_path)
+    gdf_parcel = read_geoparquet(parquet_path, bbox=bbox)
     
-    # Convert to EPSG:4326
-    gdf_parcel = gdf_parcel.to_crs(geo_crs)
+    # Convert to crs
+    gdf_parcel = gdf_parcel.to_crs(crs)
     # print(f'CRS of the parcel dataframe is {gdf_parcel.crs}')
     return gdf_parcel
 
+# Proximity tiers of every layer from most to least severe. Label columns are ordered categoricals on
+# this shared code table (one byte per parcel instead of a Python string), so they sort by severity
+PROXIMITY_LABELS = ['intersects', 'very high', 'high', 'medium', 'low', 'no_encumbrance']
+PROXIMITY_LABEL_DTYPE = pd.CategoricalDtype(PROXIMITY_LABELS, ordered=True)
+
+# All-missing categorical column with the given code table
+def _empty_categorical(dtype: pd.CategoricalDtype, index) -> pd.Series:
+    return pd.Series(pd.Categorical.from_codes(np.full(len(index), -1), dtype=dtype), index=index)
+
 # Define buffer distances and scores based on polygon or line geometry
 def buffer_scores_and_labels(
         encumbrance: EncumbranceType):
@@ -127,106 +266,213 @@ def buffer_scores_and_labels(
 
     return buffer_distances, score_labels
 
+# Geographic extent of the layer features that can reach a set of parcels
+def layer_bbox(gdf_parcel: gpd.GeoDataFrame, encumbrance: EncumbranceType) -> tuple:
+    '''
+    Bounds of gdf_parcel in geo_crs grown by the largest tier distance of the encumbrance,
+    used to read a county's or tile's part of a shared layer file.
+    '''
+    bounds = gdf_parcel.total_bounds
+    if gdf_parcel.crs is not None and not gdf_parcel.crs.equals(geo_crs):
+        bounds = Transformer.from_crs(gdf_parcel.crs, geo_crs, always_xy=True).transform_bounds(*bounds)
+    buffer_distances, _ = buffer_scores_and_labels(encumbrance)
+    return expand_bbox(bounds, max(buffer_distances))
+
+# Column holding the unique feature id for each encumbrance layer
+# Mirrors the id columns passed to the BigQuery procedures in run_procedures.txt
+ENCUMBRANCE_ID_COLUMNS = {
+    'roadways': 'ID',
+    'railways': 'FRAARCID',
+    'transmission_lines': 'ID',
+    'protected_lands': 'ID',
+    'wetlands': 'NWI_ID',
+}
+
+# Vectorized lookup of proximity labels from distances
+def assign_proximity_labels(
+        distances,
+        buffer_distances: list,
+        score_labels: list,
+        no_match_label: str = 'no_encumbrance'):
+    '''
+    Bin distances (in metres) into proximity labels.
+    A distance falls in the first tier whose buffer distance is greater than or equal to it,
+    which is the same tier the buffer + sjoin loop assigns. Missing distances or distances
+    beyond the largest tier get the no_match_label.
+    Returns an ordered Categorical on PROXIMITY_LABEL_DTYPE.
+    '''
+    distances = np.asarray(distances, dtype='float64')
+    lookup = PROXIMITY_LABEL_DTYPE.categories.get_indexer(list(score_labels) + [no_match_label])
+    if (lookup < 0).any():
+        raise ValueError(f"Proximity labels must be in PROXIMITY_LABELS: {PROXIMITY_LABELS}")
+
+    # NaN sorts to the end, so unmatched parcels land on the no_match_label slot
+    tier_index = np.searchsorted(np.asarray(buffer_distances, dtype='float64'), distances, side='left')
+    return pd.Categorical.from_codes(lookup[tier_index], dtype=PROXIMITY_LABEL_DTYPE)
+
+# Copies layer attributes of the features matched at index onto the parcels as {col}_{encumbrance} columns
+# Categorical layer columns keep the layer's code table, so they stay dictionary-encoded on the parcels
+def _assign_encumbrance_attributes(parcels_mod, index, attributes: pd.DataFrame, encumbrance: str):
+    for col in attributes.columns:
+        target = f"{col.lower()}_{encumbrance}"
+        if target not in parcels_mod.columns and isinstance(attributes[col].dtype, pd.CategoricalDtype):
+            parcels_mod[target] = _empty_categorical(attributes[col].dtype, parcels_mod.index)
+        parcels_mod.loc[index, target] = attributes[col].values
+
+# Number of (parcel, feature) pairs measured at once in calculate_intersection_metrics
+INTERSECTION_CHUNK_SIZE = 100000
+
+# Area (polygons) or perimeter (lines) of each parcel / buffered feature intersection
+def _pair_intersection_measures(parcel_geoms, feature_levels, pair_parcel, pair_feature, measure, chunk_size):
+    """
+    Pairs cascade through the feature levels (see poc_geometry_levels): parcels inside the core of a
+    large feature, or strictly inside a small one, take the parcel's own area / perimeter, and only
+    parcels on the boundary are intersected with the exact shape clipped to their bounding box.
+    """
+    measures = np.empty(len(pair_parcel), dtype='float64')
+    for start in range(0, len(pair_parcel), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        measures[chunk] = feature_levels.intersection_measure(parcel_geoms[pair_parcel[chunk]], pair_feature[chunk], measure)
+    return measures
+
+# Length of each line clipped to its parcel
+def _pair_clipped_lengths(parcel_geoms, line_geoms, pair_parcel, pair_feature, chunk_size):
+    """
+    Intersects the raw (unbuffered) line of every pair with the parcel polygon and measures the
+    length inside it. A line-polygon clip is much cheaper than overlaying two polygons and,
+    unlike half the perimeter of a buffer overlay, is not biased by the buffer width or the ends.
+    """
+    lengths = np.empty(len(pair_parcel), dtype='float64')
+    for start in range(0, len(pair_parcel), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        lengths[chunk] = shapely.length(shapely.intersection(parcel_geoms[pair_parcel[chunk]], line_geoms[pair_feature[chunk]]))
+    return lengths
+
+def intersection_metric_columns(encumbrance: EncumbranceType) -> list:
+    '''Columns calculate_intersection_metrics adds to the parcels for encumbrance.'''
+    if encumbrance in ['railways', 'roadways', 'transmission_lines']:
+        columns = [f'line_len_{encumbrance}', f'approx_line_len_{encumbrance}']
+    else:
+        columns = [f'intersec_area_{encumbrance}', f'area_ratio_{encumbrance}', f'parcel_dist_to_{encumbrance}']
+    return columns + [f'n_{encumbrance}_intersections']
+
+def _add_intersection_metric_columns(all_parcels, encumbrance):
+    '''Adds the layer's intersection metric columns as NaN where they are missing.'''
+    for column in intersection_metric_columns(encumbrance):
+        if column not in all_parcels.columns:
+            all_parcels[column] = np.nan
+    return all_parcels
+
+# Write one value per matched parcel into a (float) column of all_parcels
+def _set_parcel_metric(all_parcels, positions, column, values):
+    if column in all_parcels.columns:
+        full = all_parcels[column].to_numpy(dtype='float64', copy=True)
+    else:
+        full = np.full(len(all_parcels), np.nan)
+    full[positions] = values
+    all_parcels[column] = full
+
 # Function to calculate intersection metrics
+@traced(attrs=('encumbrance',), rows_in='matched_parcels')
 def calculate_intersection_metrics(
         encumbrance:EncumbranceType,
         all_parcels,
         matched_parcels,
-        buffered_encumbrance
+        buffered_encumbrance,
+        encumbrance_lines: gpd.GeoSeries = None,
+        chunk_size: int = INTERSECTION_CHUNK_SIZE
         ):
     '''
-
+    Adds intersection metrics of the smallest tier matches to all_parcels.
+
+    matched_parcels is the sjoin of parcels with buffered_encumbrance (parcel index, 'index_right'
+    pointing at the buffered feature, 'centroid' as WKT). Each (parcel, feature) pair is measured
+    on geometry arrays in the metric CRS and reduced per parcel:
+    - lines: line_len, the largest length of a raw line clipped to the parcel. encumbrance_lines holds
+      the unbuffered line geometries, indexed like buffered_encumbrance; the buffer only decides
+      which pairs intersect. approx_line_len, its former name, is kept as a deprecated copy for one release
+    - polygons: intersec_area, area_ratio and parcel_dist_to (centroid to feature) of the pair
+      with the largest area ratio
+    - all: n_{encumbrance}_intersections, the number of pairs
+    Parcels, centroids and features are projected once each rather than once per pair, and pairs
+    are measured chunk_size at a time so memory stays flat for millions of pairs.
+    The columns are added even when nothing matched (all NaN), so every run has the same columns.
     '''
-    # Reset index to make sure merge works properly
-    buffer_gdf = buffered_encumbrance.reset_index().rename(columns={'index': 'buffer_index'})
-
-    # Merge buffer geometries into matched results using index_right from sjoin
-    matched_with_geom = matched_parcels.reset_index().merge(
-        buffer_gdf[['buffer_index', 'geometry']],
-        left_on='index_right',
-        right_on='buffer_index',
-        how='left',
-        suffixes=('', '_buffer')
-    )
-    # Ensure both geometries are in a projected CRS (3857) for accurate area
-    # Setting projection for parcel geometry
-    matched_with_geom = matched_with_geom.set_geometry('geometry')
-    matched_with_geom = matched_with_geom.to_crs(projected_crs)
-    
-    # Setting projection for buffered value of encumbrance geometry 
-    matched_with_geom = matched_with_geom.set_geometry('geometry_buffer', drop=False)
-    matched_with_geom[f'geometry_buffer_{encumbrance}'] = matched_with_geom['geometry_buffer'].to_crs(projected_crs)
+    all_parcels = _add_intersection_metric_columns(all_parcels, encumbrance)
+    if len(matched_parcels) == 0:
+        return all_parcels
 
-    # Calculate intersection geometry 
-    matched_with_geom[f'intersection_geom_{encumbrance}'] = matched_with_geom['geometry'].intersection(matched_with_geom[f'geometry_buffer_{encumbrance}'])
+    # Ensure both geometries are in a projected CRS (3857, or the local metric CRS of a project-once run) for accurate area
+    metric_crs = metric_crs_for(matched_parcels.crs)
 
-    # Group by parcel index -- this will help later to pick parcel row in case of multiple intersections
-    matched_with_geom['orig_index'] = matched_with_geom['index']  # preserve original index for reassigning
+    # Pair -> row position of the parcel in all_parcels and of the feature in buffered_encumbrance
+    parcel_positions = all_parcels.index.get_indexer(matched_parcels.index)
+    feature_positions = buffered_encumbrance.index.get_indexer(matched_parcels['index_right'])
+
+    # Pair -> position among the matched parcels / features, which are projected once each
+    parcel_ids, parcel_first, pair_parcel = np.unique(parcel_positions, return_index=True, return_inverse=True)
+    feature_ids, pair_feature = np.unique(feature_positions, return_inverse=True)
+    parcel_geoms = np.asarray(matched_parcels.geometry.values[parcel_first].to_crs(metric_crs))
 
     # Calculate intersection metrics for lines
     if encumbrance in ['railways', 'roadways', 'transmission_lines']:
-        
-        # Calculate intersection perimeter
-        matched_with_geom[f'intersec_perim_{encumbrance}'] = matched_with_geom[f'intersection_geom_{encumbrance}'].length
+        if encumbrance_lines is None:
+            raise ValueError(f"Line length of {encumbrance} needs the unbuffered line geometries (encumbrance_lines)")
 
-        # Approximate true line length (perimeter / 2)
-        matched_with_geom[f'approx_line_len_{encumbrance}'] = round(
-            matched_with_geom[f'intersec_perim_{encumbrance}'] / 2, 2
-        )
+        # Length of the raw line inside the parcel
+        line_geoms = np.asarray(encumbrance_lines.loc[buffered_encumbrance.index[feature_ids]].to_crs(metric_crs).values)
+        line_lengths = np.round(_pair_clipped_lengths(parcel_geoms, line_geoms, pair_parcel, pair_feature, chunk_size), 2)
 
-        # Retain row with max approximate line length
-        max_length_idx = matched_with_geom.groupby('orig_index')[f'approx_line_len_{encumbrance}'].idxmax()
-        matched_max_area = matched_with_geom.loc[max_length_idx]
-
-        # Store this back into parcels dataframe
-        all_parcels.loc[matched_max_area['orig_index'], f'approx_line_len_{encumbrance}'] = matched_max_area[f'approx_line_len_{encumbrance}'].values
+        # Retain the max line length per parcel
+        max_lengths = np.full(len(parcel_ids), -np.inf)
+        np.maximum.at(max_lengths, pair_parcel, line_lengths)
+        _set_parcel_metric(all_parcels, parcel_ids, f'line_len_{encumbrance}', max_lengths)
+        # Deprecated: the column's name before it measured the raw line; kept for one release
+        all_parcels[f'approx_line_len_{encumbrance}'] = all_parcels[f'line_len_{encumbrance}']
 
     elif encumbrance in ['wetlands', 'protected_lands']:
+        feature_geoms = np.asarray(buffered_encumbrance.geometry.values[feature_ids].to_crs(metric_crs))
+        # Bbox / hull / core levels of the large features, so most pairs skip the exact intersection
+        feature_levels = GeometryLevels(feature_geoms)
 
         # Calculate parcel intersection ratio
-        matched_with_geom[f'intersec_area_{encumbrance}'] = round(matched_with_geom[f'intersection_geom_{encumbrance}'].area,2)
-        matched_with_geom['parcel_area'] = matched_with_geom['geometry'].area
-        matched_with_geom[f'area_ratio_{encumbrance}'] = round((
-            matched_with_geom[f'intersec_area_{encumbrance}'] / matched_with_geom['parcel_area']
-        ),2)
-        
-        # Calculate parcel centroid to wetland distance
-        # Convert parcel centroid column to GeoSeries
-        # Convert WKT strings to actual shapely geometries
-        matched_with_geom['centroid'] = matched_with_geom['centroid'].apply(wkt.loads)
-        matched_with_geom['centroid'] = gpd.GeoSeries(matched_with_geom['centroid'], crs=geo_crs)
-        
-        # Reproject centroid to projected CRS (e.g. 3857)
-        matched_with_geom['centroid'] = matched_with_geom['centroid'].to_crs(projected_crs)
+        intersec_areas = np.round(
+            _pair_intersection_measures(parcel_geoms, feature_levels, pair_parcel, pair_feature, shapely.area, chunk_size), 2
+        )
+        with np.errstate(divide='ignore', invalid='ignore'):
+            area_ratios = np.round(intersec_areas / shapely.area(parcel_geoms)[pair_parcel], 2)
+
+        # Pair with the max area ratio per parcel (first pair on ties, as idxmax)
+        order = np.lexsort((np.arange(len(pair_parcel)), -np.nan_to_num(area_ratios, nan=-np.inf), pair_parcel))
+        group_starts = np.flatnonzero(np.r_[True, np.diff(pair_parcel[order]) != 0])
+        best_pairs = order[group_starts]
+
+        # Parcel centroid to encumbered geometry distance, only for the retained pairs
+        # Centroids are stored as WKT in geographic CRS; parse each matched parcel's once
+        centroids = np.asarray(
+            gpd.GeoSeries.from_wkt(matched_parcels['centroid'].values[parcel_first], crs=geo_crs).values.to_crs(metric_crs)
+        )
+        distances = np.round(feature_levels.distance(centroids, pair_feature[best_pairs]), 2)
 
-        # parcel centroid to encumbered geometry distance
-        matched_with_geom[f'parcel_dist_to_{encumbrance}'] = round(matched_with_geom['centroid'].distance(
-            matched_with_geom[f'geometry_buffer_{encumbrance}']
-            ),2)
-        
-        # Chunk to retain row with the max area ratio
-        max_area_idx = matched_with_geom.groupby('orig_index')[f'area_ratio_{encumbrance}'].idxmax()
-        matched_max_area = matched_with_geom.loc[max_area_idx]
+        # Store metrics back in all_parcels for max intersection pair
+        _set_parcel_metric(all_parcels, parcel_ids, f'intersec_area_{encumbrance}', intersec_areas[best_pairs])
+        _set_parcel_metric(all_parcels, parcel_ids, f'area_ratio_{encumbrance}', area_ratios[best_pairs])
+        _set_parcel_metric(all_parcels, parcel_ids, f'parcel_dist_to_{encumbrance}', distances)
 
-        # Store metrics back in parcels_mod for max intersection row
-        for col in ['intersec_area', 'area_ratio', 'parcel_dist_to']:
-            all_parcels.loc[matched_max_area['orig_index'], f'{col}_{encumbrance}'] = matched_max_area[f'{col}_{encumbrance}'].values
+    # Number of intersecting encumbrances per parcel (for all encumbrance types)
+    _set_parcel_metric(all_parcels, parcel_ids, f'n_{encumbrance}_intersections', np.bincount(pair_parcel, minlength=len(parcel_ids)))
 
-    # Calculate number of intersecting encumbrances per parcel (for all encumbrance types)
-    intersection_counts = matched_with_geom.groupby('orig_index').size()
-    
-    # Store the number of intersections as a separate metric
-    all_parcels.loc[intersection_counts.index, f'n_{encumbrance}_intersections'] = intersection_counts.values
-    
     logger.info(f"Finished calculating intersection metrics for encumbrance {encumbrance}!")
     return all_parcels
 
 # Calculate proximity score and intersection metrics based on encumbrance type
-# @log_time
+@traced(attrs=('encumbrance', 'fips_code', 'method'), rows_in='gdf_parcel')
 def get_proximity_score_and_intersection_metrics(
         encumbrance: EncumbranceType,
         gdf_parcel: gpd.GeoDataFrame, 
         gdf_encumbrance: gpd.GeoDataFrame, 
+        method: Literal['buffer', 'nearest'] = 'buffer',
+        fips_code: str = None,
         ) -> gpd.GeoDataFrame:
     """
     Assign proximity scores to parcels based on their distance to encumbrance features.
@@ -234,10 +480,23 @@ def get_proximity_score_and_intersection_metrics(
     Parameters:
     parcels (GeoDataFrame): The parcels to be scored.
     encumbrance (GeoDataFrame): The encumbrance features to score against.
+    method (str): 'buffer' runs one buffer + sjoin per tier.
+                  'nearest' runs a single indexed nearest-neighbour query capped at the
+                  largest tier and also returns the shortest distance and nearest encumbrance id.
+    fips_code (str): County of the encumbrance layer. When given, buffered layers are cached per county.
     
     Returns:
     GeoDataFrame: Parcels with assigned proximity scores.
     """
+    if method == 'nearest':
+        return get_nearest_proximity_score_and_intersection_metrics(
+            encumbrance=encumbrance,
+            gdf_parcel=gdf_parcel,
+            gdf_encumbrance=gdf_encumbrance
+        )
+    elif method != 'buffer':
+        raise ValueError(f"Unknown proximity scoring method: {method}. Valid options are: 'buffer', 'nearest'.")
+
     # Start logging process
     logger.info("Starting proximity scoring...")
 
@@ -253,8 +512,11 @@ def get_proximity_score_and_intersection_metrics(
     parcels_mod = gdf_parcel.copy()
 
     # Initialize a new column for proximity score
-    # Explicitly defining dtype object to avoid SettingWithCopyWarning
-    parcels_mod[f'proximity_score_{encumbrance}'] = pd.Series([None]*len(parcels_mod), dtype='object')
+    # Categorical on the shared label table, all missing until a tier matches
+    parcels_mod[f'proximity_score_{encumbrance}'] = _empty_categorical(PROXIMITY_LABEL_DTYPE, parcels_mod.index)
+
+    # Buffers are cached against the layer's contents, hashed once for all tiers
+    layer_fingerprint = frame_fingerprint(gdf_encumbrance) if fips_code is not None else None
 
     # Calculate proximity scores based on distance to encumbrance features
     # Initialize i 
@@ -262,27 +524,26 @@ def get_proximity_score_and_intersection_metrics(
     for distance, label in zip(buffer_distances, score_labels):
         
         # Buffer individual geometries by specified distance
-        # Project to a projected CRS for buffering
-        buffer_gdf = gdf_encumbrance.to_crs(projected_crs)
-
-        # Create buffered geometries and assign to a new column
-        buffer_gdf['buffered_geometry'] = buffer_gdf.geometry.buffer(distance) # This geometry holds the buffered version
-
-        # Drop the original geometry column
-        buffer_gdf = buffer_gdf.drop(columns=['geometry'])
-
-        # Rename the buffered geometry column to 'geometry'
-        buffer_gdf = buffer_gdf.rename(columns={'buffered_geometry': 'geometry'})
-
-        # Set CRS and reproject back to geo_crs
-        buffer_gdf = buffer_gdf.set_geometry('geometry').to_crs(geo_crs)
+        # Served from the geometry cache when the county is known
+        with span('buffer', rows_in=len(gdf_encumbrance), distance=distance) as buffer_span:
+            buffer_gdf = buffer_encumbrance(
+                gdf_encumbrance,
+                distance,
+                encumbrance=encumbrance,
+                fips_code=fips_code,
+                fingerprint=layer_fingerprint
+            )
+            buffer_span.rows_out = len(buffer_gdf)
         logger.info(f'Created buffered geometry with distance {distance} meters and CRS {buffer_gdf.crs}')
         
         # Use spatial join to find parcels within the buffer distance
-        matched = gpd.sjoin(parcels_mod[parcels_mod[f'proximity_score_{encumbrance}'].isna()],
-                             buffer_gdf,
-                             predicate='intersects',
-                             how='inner')
+        unmatched = parcels_mod[parcels_mod[f'proximity_score_{encumbrance}'].isna()]
+        with span('sjoin', rows_in=len(unmatched), distance=distance) as sjoin_span:
+            matched = gpd.sjoin(unmatched,
+                                 buffer_gdf,
+                                 predicate='intersects',
+                                 how='inner')
+            sjoin_span.rows_out = len(matched)
 
         # Assign proximity scores
         parcels_mod.loc[matched.index, f'proximity_score_{encumbrance}'] = label
@@ -290,8 +551,7 @@ def get_proximity_score_and_intersection_metrics(
         # Add encumbrance column values to main dataframe
         # TODO: Find more elegant solution
         cols_to_add = buffer_gdf.columns.difference(['geometry'])
-        for col in cols_to_add:
-            parcels_mod.loc[matched.index, f"{col.lower()}_{encumbrance}"] = matched[col].values
+        _assign_encumbrance_attributes(parcels_mod, matched.index, matched[cols_to_add], encumbrance)
         logger.info(f"Assigned proximity score {label} to {len(matched)} parcels...")
 
         # Add intersecton metrics when buffer is smallest
@@ -301,7 +561,8 @@ def get_proximity_score_and_intersection_metrics(
                 encumbrance=encumbrance,
                 all_parcels=parcels_mod,
                 matched_parcels=matched,
-                buffered_encumbrance=buffer_gdf
+                buffered_encumbrance=buffer_gdf,
+                encumbrance_lines=gdf_encumbrance.geometry
             )
         # Increment i
         i += 1 
@@ -309,9 +570,9 @@ def get_proximity_score_and_intersection_metrics(
     # Fill remaining as no encumbrance and change to geographic CRS
     parcels_mod.fillna({f'proximity_score_{encumbrance}':'no_encumbrance'}, inplace=True)
     
-    # Re-project everything to geographic CRS
+    # Re-project everything to the CRS the parcels came in (geographic, unless this is a project-once run)
     for column in parcels_mod.select_dtypes(include=['geometry']).columns:
-        parcels_mod[column] = parcels_mod[column].to_crs(geo_crs)
+        parcels_mod[column] = parcels_mod[column].to_crs(gdf_parcel.crs)
     # print(f'CRS of output dataframe is {parcels_mod.crs}')
     print('Proximity scoring complete! Counts of proximity scores are...')
 
@@ -319,7 +580,211 @@ def get_proximity_score_and_intersection_metrics(
     print(parcels_mod[f'proximity_score_{encumbrance}'].value_counts())
     return parcels_mod
 
+# Single pass proximity scoring using a nearest neighbour query instead of one sjoin per tier
+@traced(attrs=('encumbrance',), rows_in='gdf_parcel')
+def get_nearest_proximity_score_and_intersection_metrics(
+        encumbrance: EncumbranceType,
+        gdf_parcel: gpd.GeoDataFrame,
+        gdf_encumbrance: gpd.GeoDataFrame,
+        ) -> gpd.GeoDataFrame:
+    """
+    Assign proximity scores to parcels using one indexed nearest neighbour query per parcel.
+
+    The query is capped at the largest tier distance, so parcels further away never get a match.
+    Distances are binned into the same labels as the buffer loop, and the exact shortest distance
+    and nearest encumbrance id are kept alongside (as the BigQuery procedures do).
+    Intersection metrics are calculated only for encumbrance features within the smallest tier.
+
+    Parameters:
+    parcels (GeoDataFrame): The parcels to be scored.
+    encumbrance (GeoDataFrame): The encumbrance features to score against.
+
+    Returns:
+    GeoDataFrame: Parcels with assigned proximity scores, shortest distance and nearest encumbrance id.
+    """
+    logger.info("Starting nearest neighbour proximity scoring...")
+
+    buffer_distances, score_labels = buffer_scores_and_labels(encumbrance)
+    logger.info(f"Buffer distances: {buffer_distances}")
+    logger.info(f"Score labels: {score_labels}")
+
+    # Ensure the CRS of both GeoDataFrames match
+    gdf_encumbrance = gdf_encumbrance.to_crs(gdf_parcel.crs)
+    parcels_mod = gdf_parcel.copy()
+
+    # Distances are measured in the same projected CRS used for buffering
+    metric_crs = metric_crs_for(parcels_mod.crs)
+    parcels_projected = parcels_mod[['geometry']].to_crs(metric_crs)
+    encumbrance_projected = gdf_encumbrance.to_crs(metric_crs)
+
+    # One indexed query per parcel, capped at the largest tier distance
+    with span('sjoin_nearest', rows_in=len(parcels_projected)) as nearest_span:
+        nearest = gpd.sjoin_nearest(
+            parcels_projected,
+            encumbrance_projected[['geometry']],
+            how='inner',
+            max_distance=max(buffer_distances),
+            distance_col='shortest_distance'
+        )
+        nearest_span.rows_out = len(nearest)
+    # Equidistant features return several rows; keep the first one per parcel
+    nearest = nearest[~nearest.index.duplicated(keep='first')]
+    logger.info(f"Found nearest {encumbrance} feature for {len(nearest)} parcels...")
+
+    # Vectorized label lookup
+    shortest_distance = pd.Series(np.nan, index=parcels_mod.index)
+    shortest_distance.loc[nearest.index] = nearest['shortest_distance'].values
+    parcels_mod[f'proximity_score_{encumbrance}'] = assign_proximity_labels(
+        shortest_distance.values, buffer_distances, score_labels
+    )
+    parcels_mod[f'shortest_distance_{encumbrance}'] = shortest_distance.round(2)
+
+    # Nearest encumbrance id, falling back to the row index when the layer has no id column
+    id_col = ENCUMBRANCE_ID_COLUMNS.get(encumbrance)
+    if id_col in gdf_encumbrance.columns:
+        nearest_ids = gdf_encumbrance.loc[nearest['index_right'], id_col].astype(str).values
+    else:
+        nearest_ids = nearest['index_right'].astype(str).values
+    parcels_mod[f'encumbrance_id_{encumbrance}'] = pd.Series(None, index=parcels_mod.index, dtype='object')
+    parcels_mod.loc[nearest.index, f'encumbrance_id_{encumbrance}'] = nearest_ids
+
+    # Add encumbrance column values of the nearest feature to main dataframe
+    cols_to_add = gdf_encumbrance.columns.difference(['geometry'])
+    nearest_attributes = gdf_encumbrance.loc[nearest['index_right'], cols_to_add]
+    _assign_encumbrance_attributes(parcels_mod, nearest.index, nearest_attributes, encumbrance)
+
+    # Intersection metrics need every feature within the smallest tier, not just the nearest one
+    # Only the features that are actually within range get buffered
+    intersecting_index = parcels_mod.index[parcels_mod[f'proximity_score_{encumbrance}'] == score_labels[0]]
+    if len(intersecting_index) > 0:
+        logger.info('Now adding intersection metrics...')
+        candidates = gpd.sjoin(
+            parcels_projected.loc[intersecting_index],
+            encumbrance_projected[['geometry']],
+            predicate='dwithin',
+            distance=buffer_distances[0],
+            how='inner'
+        )
+        buffer_gdf = encumbrance_projected.loc[candidates['index_right'].unique()]
+        buffer_gdf = buffer_gdf.set_geometry(buffer_gdf.geometry.buffer(buffer_distances[0])).to_crs(parcels_mod.crs)
+        matched = parcels_mod.loc[candidates.index]
+        matched['index_right'] = candidates['index_right'].values
+        parcels_mod = calculate_intersection_metrics(
+            encumbrance=encumbrance,
+            all_parcels=parcels_mod,
+            matched_parcels=matched,
+            buffered_encumbrance=buffer_gdf,
+            encumbrance_lines=encumbrance_projected.geometry
+        )
+    else:
+        parcels_mod = _add_intersection_metric_columns(parcels_mod, encumbrance)
+
+    print('Proximity scoring complete! Counts of proximity scores are...')
+    print(parcels_mod[f'proximity_score_{encumbrance}'].value_counts())
+    return parcels_mod
+
+# Default weights and thresholds for the intersection strength score
+# Same values as the DECLAREs in intersection_score_polygons.sql
+DEFAULT_INTERSECTION_SCORE_CONFIG = {
+    'area_ratio_weight': 0.5,
+    'dist_weight': 0.3,
+    'n_intersections_weight': 0.2,
+    'area_ratio_thresholds': (0.4, 0.9),
+    'dist_thresholds': (100, 50, 10, 0),
+    'n_intersections_thresholds': (2, 3),
+    'score_thresholds': (0.35, 0.7),
+}
+
+# Intersection labels are small int codes into this ordered code table (-1 = no label)
+INTERSECTION_LABEL_DTYPE = pd.CategoricalDtype(['low', 'medium', 'high'], ordered=True)
+
+# Categorical intersection labels from the codes returned by score_intersection_arrays
+def intersection_labels(codes) -> pd.Categorical:
+    return pd.Categorical.from_codes(codes, dtype=INTERSECTION_LABEL_DTYPE)
+
+# Vectorized intersection scoring engine
+def score_intersection_arrays(
+        area_ratio,
+        parcel_dist,
+        n_intersections,
+        configs: list = None) -> dict:
+    '''
+    Scores area ratio, centroid distance and number of intersections for one or more
+    weight/threshold configurations in a single pass.
+
+    Inputs are 1D arrays with one value per parcel. Each config is a dict with any of the keys in
+    DEFAULT_INTERSECTION_SCORE_CONFIG (missing keys fall back to the defaults).
+    Thresholds of every config are stacked into column vectors and broadcast against the parcel
+    values, so all configurations are evaluated together.
+
+    Returns:
+    dict of arrays shaped (n_configs, n_parcels) with keys
+    'score_ar', 'score_dist', 'score_nint', 'intersection_score' and 'intersection_label'
+    (int8 codes into INTERSECTION_LABEL_DTYPE, -1 for no label; see intersection_labels).
+    '''
+    configs = [{**DEFAULT_INTERSECTION_SCORE_CONFIG, **config} for config in (configs or [{}])]
+
+    # One column vector per threshold / weight, shaped (n_configs, 1)
+    def stacked(key, position=None):
+        values = [config[key] if position is None else config[key][position] for config in configs]
+        return np.asarray(values, dtype='float64')[:, None]
+
+    ar_low, ar_high = stacked('area_ratio_thresholds', 0), stacked('area_ratio_thresholds', 1)
+    dist_low, dist_med = stacked('dist_thresholds', 0), stacked('dist_thresholds', 1)
+    dist_high, dist_overwrite = stacked('dist_thresholds', 2), stacked('dist_thresholds', 3)
+    nint_med, nint_high = stacked('n_intersections_thresholds', 0), stacked('n_intersections_thresholds', 1)
+    low_thres, high_thres = stacked('score_thresholds', 0), stacked('score_thresholds', 1)
+
+    # Parcel values as row vectors, shaped (1, n_parcels). NaN compares False everywhere and scores 0.
+    ar = np.asarray(area_ratio, dtype='float64')[None, :]
+    dist = np.asarray(parcel_dist, dtype='float64')[None, :]
+    nint = np.asarray(n_intersections, dtype='float64')[None, :]
+
+    # Score area_ratio
+    score_ar = np.select([ar >= ar_high, ar >= ar_low, ar > 0], [1.0, 0.5, 0.25], default=0.0)
+
+    # Score parcel_dist_to
+    score_dist = np.select(
+        [dist <= dist_high, dist <= dist_med, dist <= dist_low, dist > 0],
+        [1.0, 0.5, 0.25, 0.15],
+        default=0.0
+    )
+
+    # Score number of intersections
+    score_nint = np.select([nint >= nint_high, nint == nint_med, nint > 0], [1.0, 0.5, 0.25], default=0.0)
+
+    # Final weighted score
+    score = (
+        score_ar * stacked('area_ratio_weight') +
+        score_dist * stacked('dist_weight') +
+        score_nint * stacked('n_intersections_weight')
+    )
+
+    # Labeling with override for high-impact flags
+    label_codes = np.select(
+        [score == 0, (ar >= ar_high) | (dist == dist_overwrite), score < low_thres, score < high_thres],
+        [-1, 2, 0, 1],
+        default=2
+    ).astype('int8')
+
+    return {
+        'score_ar': score_ar,
+        'score_dist': score_dist,
+        'score_nint': score_nint,
+        'intersection_score': score,
+        'intersection_label': label_codes,
+    }
+
+# Check score is only asked for polygon encumbrances
+def _check_polygon_encumbrance(encumbrance: str):
+    if encumbrance not in ['wetlands', 'protected_lands']:
+        raise ValueError(
+            f"Intersection scoring is only applicable for polygon encumbrances. "
+            f"Valid options are: 'wetlands', 'protected_lands'."
+        )
+
 # Function to calculate intersection strength score
+@traced(attrs=('encumbrance',), rows_in='gdf_parcel')
 def calculate_intersection_score(
         encumbrance:EncumbranceType,
         gdf_parcel: gpd.GeoDataFrame,
@@ -343,72 +808,68 @@ def calculate_intersection_score(
     Returns:
     GeoDataFrame with a new 'intersection_score_{encumbrance}' column.
     '''
-    # Check score is only asked for polygon encumbrances
-    if encumbrance not in ['wetlands', 'protected_lands']:
-        raise ValueError(
-            f"Intersection scoring is only applicable for polygon encumbrances. "
-            f"Valid options are: 'wetlands', 'protected_lands'."
-        )
+    _check_polygon_encumbrance(encumbrance)
 
     # Create dataframe copy to avoid modifying the original
     parcels_mod = gdf_parcel.copy()
 
-    # Unpack thresholds
-    ar_low, ar_high = area_ratio_thresholds
-    dist_low, dist_med, dist_high, dist_overwrite = dist_thresholds
-    nint_med, nint_high = n_intersections_thresholds
-
-    # Score area_ratio
-    ar_col = f'area_ratio_{encumbrance}'
-    parcels_mod[f'score_ar_{encumbrance}'] = parcels_mod[ar_col].apply(
-        lambda x: 1 if x >= ar_high else (0.5 if x >= ar_low else 0.25 if x > 0 else 0)
+    config = {
+        'area_ratio_weight': area_ratio_weight,
+        'dist_weight': dist_weight,
+        'n_intersections_weight': n_intersections_weight,
+        'area_ratio_thresholds': area_ratio_thresholds,
+        'dist_thresholds': dist_thresholds,
+        'n_intersections_thresholds': n_intersections_thresholds,
+        'score_thresholds': score_thresholds,
+    }
+    scores = score_intersection_arrays(
+        parcels_mod[f'area_ratio_{encumbrance}'],
+        parcels_mod[f'parcel_dist_to_{encumbrance}'],
+        parcels_mod[f'n_{encumbrance}_intersections'],
+        configs=[config]
     )
 
-    # Score parcel_dist_to
-    dist_col = f'parcel_dist_to_{encumbrance}'
-    parcels_mod[f'score_dist_{encumbrance}'] = parcels_mod[dist_col].apply(
-        lambda x: 1 if x <= dist_high else (0.5 if x <= dist_med else 0.25 if x <= dist_low else 0.15 if x > 0 else 0)
-    )
+    # TODO: Once testing is over, drop intermediate columns
+    parcels_mod[f'score_ar_{encumbrance}'] = scores['score_ar'][0]
+    parcels_mod[f'score_dist_{encumbrance}'] = scores['score_dist'][0]
+    parcels_mod[f'score_nint_{encumbrance}'] = scores['score_nint'][0]
+    parcels_mod[f'intersection_score_{encumbrance}'] = scores['intersection_score'][0]
+    parcels_mod[f'intersection_label_{encumbrance}'] = intersection_labels(scores['intersection_label'][0])
 
-    # Score number of intersections
-    nint_col = f'n_{encumbrance}_intersections'
-    parcels_mod[f'score_nint_{encumbrance}'] = parcels_mod[nint_col].apply(
-        lambda x: 1 if x >= nint_high else (0.5 if x == nint_med else 0.25 if x > 0 else 0)
-    )
+    print(f'Intersection scoring completed for {encumbrance}!')
+    return parcels_mod
 
-    # Final weighted score
-    score_col = f'intersection_score_{encumbrance}'
-    parcels_mod[score_col] = (
-        parcels_mod[f'score_ar_{encumbrance}'] * area_ratio_weight +
-        parcels_mod[f'score_dist_{encumbrance}'] * dist_weight +
-        parcels_mod[f'score_nint_{encumbrance}'] * n_intersections_weight
-    )
+# Function to evaluate several weight/threshold configurations in one pass
+def calculate_intersection_score_sweep(
+        encumbrance: EncumbranceType,
+        gdf_parcel: gpd.GeoDataFrame,
+        configs: dict,
+    ) -> pd.DataFrame:
+    '''
+    Scores every configuration in configs (name -> dict of calculate_intersection_score kwargs)
+    in a single vectorized pass, for sensitivity sweeps.
 
-    # TODO: Once testing is over, drop intermediate columns
-    # parcels_mod = parcels_mod.drop(columns=[
-    # f'parcel_dist_to_{encumbrance}',
-    # f'area_ratio_{encumbrance}',
-    # f'n_{encumbrance}_intersections'])
+    Returns:
+    DataFrame aligned with gdf_parcel with one set of score_* / intersection_score_* /
+    intersection_label_* columns per configuration, suffixed with the configuration name.
+    '''
+    _check_polygon_encumbrance(encumbrance)
+
+    names = list(configs.keys())
+    scores = score_intersection_arrays(
+        gdf_parcel[f'area_ratio_{encumbrance}'],
+        gdf_parcel[f'parcel_dist_to_{encumbrance}'],
+        gdf_parcel[f'n_{encumbrance}_intersections'],
+        configs=[configs[name] for name in names]
+    )
 
-    # Add low, medium, high labels
-    # Labeling with override for high-impact flags
-    # TODO: Make this more efficient
-    low_thres, high_thres = score_thresholds
-    label_col = f'intersection_label_{encumbrance}'
-
-    parcels_mod[label_col] = parcels_mod.apply(
-    lambda row: None if row[score_col] == 0 else (
-        'high' if (
-            row[ar_col] >= ar_high 
-            or row[dist_col] == dist_overwrite
-        ) else (
-            'low' if row[score_col] < low_thres else
-            'medium' if row[score_col] < high_thres else
-            'high'
-        )
-    ),
-    axis=1
-)
+    columns = {}
+    for i, name in enumerate(names):
+        columns[f'score_ar_{encumbrance}_{name}'] = scores['score_ar'][i]
+        columns[f'score_dist_{encumbrance}_{name}'] = scores['score_dist'][i]
+        columns[f'score_nint_{encumbrance}_{name}'] = scores['score_nint'][i]
+        columns[f'intersection_score_{encumbrance}_{name}'] = scores['intersection_score'][i]
+        columns[f'intersection_label_{encumbrance}_{name}'] = intersection_labels(scores['intersection_label'][i])
 
-    print(f'Intersection scoring completed for {encumbrance}!')
-    return parcels_mod
\ No newline at end of file
+    print(f'Intersection scoring completed for {encumbrance} across {len(names)} configurations!')
+    return pd.DataFrame(columns, index=gdf_parcel.index)
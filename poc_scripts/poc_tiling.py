@@ -0,0 +1,354 @@
+# Balanced spatial tiling for parcel scoring
+# Instead of one task per county FIPS, parcels from any set of counties are split into tiles of
+# roughly equal estimated cost by recursive weighted-median bisection. A parcel's cost grows with the
+# vertices of the layer features around it, so dense wetland areas end up in smaller tiles than
+# rural ones. Each tile pulls in every encumbrance feature within its bounds plus a halo equal to
+# the largest tier distance, so parcels near a county line still see encumbrances that sit across
+# the boundary. Parcels and layers are put in shared memory once (see poc_shared_parcels) and each
+# tile task attaches only its own rows.
+
+# Importing required libraries
+import os
+import logging
+import concurrent.futures
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pyarrow as pa
+import shapely
+from shapely.geometry import box
+
+from poc_tested_modules import (
+    load_encumbrance_data,
+    load_parcel_data,
+    buffer_scores_and_labels,
+    get_proximity_score_and_intersection_metrics,
+    calculate_intersection_score,
+    ENCUMBRANCE_ID_COLUMNS,
+    DICTIONARY_COLUMNS,
+    categorize_columns,
+    local_metric_crs,
+    layer_bbox,
+    projected_crs,
+)
+from poc_county_encumbrances import encumbrance_result_batch, assemble_encumbrance_results
+from poc_shared_parcels import share_parcels, attach_parcels, release_parcels
+
+logger = logging.getLogger(__name__)
+
+# Largest tier distance per geometry type, as in the BigQuery procedures (metres)
+HALO_DISTANCES = {
+    'lines': 1000,
+    'polygons': 150,
+}
+LINE_ENCUMBRANCES = ['roadways', 'railways', 'transmission_lines']
+
+# Target number of parcels per tile
+DEFAULT_MAX_PARCELS_PER_TILE = 50000
+
+# Tile tasks submitted per worker before the parent waits for results
+TASKS_IN_FLIGHT_PER_WORKER = 2
+
+
+@dataclass(frozen=True)
+class Tile:
+    tile_id: int
+    bounds: tuple  # (minx, miny, maxx, maxy) in projected_crs
+    parcel_positions: np.ndarray  # row positions into the parcel frame the tiles were built from
+
+    @property
+    def n_parcels(self) -> int:
+        return len(self.parcel_positions)
+
+
+# Function to get the halo distance for a layer
+def halo_distance(encumbrance: str) -> float:
+    '''
+    Halo (metres) to pull in around a tile: the largest tier distance of the layer,
+    taking whichever is larger of the SQL tiers and the Python tiers.
+    '''
+    geometry_type = 'lines' if encumbrance in LINE_ENCUMBRANCES else 'polygons'
+    buffer_distances, _ = buffer_scores_and_labels(encumbrance)
+    return max(HALO_DISTANCES[geometry_type], max(buffer_distances))
+
+
+# Function to estimate how expensive each parcel is to score
+def estimate_parcel_costs(parcels_projected: gpd.GeoSeries, layers_projected: dict) -> np.ndarray:
+    '''
+    Per-parcel cost: 1 plus the vertex count of every layer feature whose bounding box comes within
+    the layer's halo of the parcel's bounding box. Intersections, distances and buffers all scale with
+    the vertices of the candidate features, so this tracks the scoring work far better than a parcel count.
+    Only bounding boxes are compared (one STRtree query per layer), so the estimate is cheap.
+
+    layers_projected maps encumbrance -> layer geometry in projected_crs, like parcels_projected.
+    '''
+    parcel_bounds = parcels_projected.bounds.to_numpy()
+    costs = np.ones(len(parcels_projected), dtype='float64')
+    for encumbrance, encumbrance_projected in layers_projected.items():
+        halo = halo_distance(encumbrance)
+        windows = shapely.box(
+            parcel_bounds[:, 0] - halo, parcel_bounds[:, 1] - halo,
+            parcel_bounds[:, 2] + halo, parcel_bounds[:, 3] + halo
+        )
+        parcel_idx, feature_idx = encumbrance_projected.sindex.query(windows)
+        feature_vertices = shapely.get_num_coordinates(encumbrance_projected.values)
+        costs += np.bincount(parcel_idx, weights=feature_vertices[feature_idx], minlength=len(costs))
+    return costs
+
+
+# Function to split parcels into equal-cost tiles
+def build_tiles(
+        gdf_parcel: gpd.GeoDataFrame,
+        max_parcels_per_tile: int = DEFAULT_MAX_PARCELS_PER_TILE,
+        costs: np.ndarray = None) -> list:
+    '''
+    Recursively splits parcels along the longer axis of their centroids until every tile has at most
+    max_parcels_per_tile parcels. With per-parcel costs (see estimate_parcel_costs), tiles are split at
+    the cost-weighted median and also until every tile costs at most the average cost of
+    max_parcels_per_tile parcels, so expensive areas get proportionally fewer parcels per tile.
+    Without costs every parcel counts the same, which splits at the median parcel.
+    gdf_parcel may be a GeoDataFrame or GeoSeries; it is projected to projected_crs unless already in it.
+
+    Returns:
+    List of Tile objects. Tile bounds cover the full extent of their parcels (not just centroids).
+    '''
+    projected = gdf_parcel.geometry
+    if projected.crs is None or not projected.crs.equals(projected_crs):
+        projected = projected.to_crs(projected_crs)
+    centroids = projected.centroid
+    xs, ys = centroids.x.to_numpy(), centroids.y.to_numpy()
+    parcel_bounds = projected.bounds.to_numpy()
+
+    costs = np.ones(len(projected)) if costs is None else np.asarray(costs, dtype='float64')
+    max_cost_per_tile = costs.sum() * max_parcels_per_tile / max(len(costs), 1)
+
+    tiles = []
+    stack = [np.arange(len(projected))]
+    while stack:
+        positions = stack.pop()
+        if len(positions) <= 1 or (
+                len(positions) <= max_parcels_per_tile and costs[positions].sum() <= max_cost_per_tile):
+            if len(positions) > 0:
+                minx, miny = parcel_bounds[positions, 0].min(), parcel_bounds[positions, 1].min()
+                maxx, maxy = parcel_bounds[positions, 2].max(), parcel_bounds[positions, 3].max()
+                tiles.append(Tile(len(tiles), (minx, miny, maxx, maxy), positions))
+            continue
+
+        # Split along the longer side where the cumulative cost reaches half, so both halves cost the same
+        x, y = xs[positions], ys[positions]
+        axis_values = x if (x.max() - x.min()) >= (y.max() - y.min()) else y
+        order = np.argsort(axis_values, kind='stable')
+        cumulative = np.cumsum(costs[positions][order])
+        half = int(np.searchsorted(cumulative, cumulative[-1] / 2))
+        half = min(max(half, 1), len(positions) - 1)
+        stack.append(positions[order[:half]])
+        stack.append(positions[order[half:]])
+
+    tile_costs = [costs[tile.parcel_positions].sum() for tile in tiles]
+    logger.info(
+        f"Built {len(tiles)} tiles from {len(projected):,} parcels (max {max_parcels_per_tile:,} per tile, "
+        f"estimated cost per tile {min(tile_costs, default=0):,.0f} - {max(tile_costs, default=0):,.0f})"
+    )
+    return tiles
+
+
+# Function to load one layer for several counties without duplicate features
+def load_layer_for_counties(encumbrance: str, fips_list: list, bbox: tuple = None) -> gpd.GeoDataFrame:
+    '''
+    Concatenates the county files of one layer. Features crossing county lines are present
+    in every county they touch, so duplicates are dropped on the layer's id column.
+    Counties without a file for the layer read the bbox part of the shared layer file, if there is one,
+    and are skipped otherwise.
+    '''
+    layers = []
+    for fips_code in fips_list:
+        try:
+            layers.append(load_encumbrance_data(fips_code, encumbrance, bbox=bbox))
+        except FileNotFoundError:
+            logger.warning(f"No {encumbrance} file for {fips_code}, skipping")
+    if not layers:
+        raise FileNotFoundError(f"No {encumbrance} files found for counties: {fips_list}")
+
+    # Counties have different category sets, which concat falls back to strings for; encode them again
+    gdf_encumbrance = categorize_columns(pd.concat(layers, ignore_index=True), DICTIONARY_COLUMNS.get(encumbrance, []))
+    id_col = ENCUMBRANCE_ID_COLUMNS.get(encumbrance)
+    if id_col in gdf_encumbrance.columns:
+        gdf_encumbrance = gdf_encumbrance.drop_duplicates(subset=[id_col]).reset_index(drop=True)
+    return gdf_encumbrance
+
+
+# Function to convert a true distance to EPSG:3857 units at a tile's latitude
+def mercator_halo(tile: Tile, halo: float) -> float:
+    '''
+    EPSG:3857 stretches lengths by 1/cos(latitude). Tiles measured in a local metric CRS need
+    their halo (true metres) widened by that factor at the tile edge furthest from the equator
+    before selecting features with the tile bounds, which are in projected_crs.
+    '''
+    _, miny, _, maxy = tile.bounds
+    max_abs_y = max(abs(miny), abs(maxy))
+    latitude = np.arctan(np.sinh(max_abs_y / 6378137.0))
+    return halo / np.cos(latitude)
+
+
+# Function to select the features a tile needs
+def features_for_tile(
+        tile: Tile,
+        encumbrance_projected: gpd.GeoSeries,
+        halo: float) -> np.ndarray:
+    '''
+    Returns the sorted row positions of every encumbrance feature intersecting the tile bounds grown by the halo.
+    encumbrance_projected is the layer geometry in projected_crs (with its spatial index built once).
+    '''
+    minx, miny, maxx, maxy = tile.bounds
+    window = box(minx - halo, miny - halo, maxx + halo, maxy + halo)
+    positions = encumbrance_projected.sindex.query(window, predicate='intersects')
+    return np.sort(positions)
+
+
+# Scoring of one tile against one layer
+def process_tile(
+        tile_id: int,
+        encumbrance: str,
+        parcels_tile: gpd.GeoDataFrame,
+        encumbrance_tile: gpd.GeoDataFrame,
+        method: str = 'buffer',
+        metric_crs: str = None) -> pa.RecordBatch:
+    '''
+    Scores the parcels of one tile against the layer features in its halo window
+    and returns the narrow result batch (parcel key + layer metrics).
+    When metric_crs is given, parcels and features are projected into it once before scoring.
+    '''
+    if metric_crs is not None:
+        parcels_tile = parcels_tile.to_crs(metric_crs)
+        encumbrance_tile = encumbrance_tile.to_crs(metric_crs)
+
+    scored = get_proximity_score_and_intersection_metrics(
+        encumbrance=encumbrance,
+        gdf_parcel=parcels_tile,
+        gdf_encumbrance=encumbrance_tile,
+        method=method
+    )
+    if encumbrance in ['wetlands', 'protected_lands']:
+        scored = calculate_intersection_score(encumbrance, gdf_parcel=scored)
+
+    logger.info(f"Finished tile {tile_id} for {encumbrance}: {len(parcels_tile):,} parcels, {len(encumbrance_tile):,} features")
+    return encumbrance_result_batch(scored)
+
+
+# Worker entry point for one tile and every layer
+def process_tile_layers(
+        tile_id: int,
+        parcels_handle,
+        parcel_positions: np.ndarray,
+        layer_handles: dict,
+        feature_positions: dict,
+        method: str = 'buffer',
+        metric_crs: str = None) -> dict:
+    '''
+    Attaches the tile's parcels once and, for each layer, the features in its halo window from
+    shared memory, then scores the tile against every layer in turn.
+    Only handles and row positions are pickled to the worker.
+
+    Returns:
+    dict of encumbrance -> narrow result batch.
+    '''
+    parcels_tile = attach_parcels(parcels_handle, positions=parcel_positions)
+    batches = {}
+    for encumbrance, layer_handle in layer_handles.items():
+        encumbrance_tile = attach_parcels(layer_handle, positions=feature_positions[encumbrance])
+        batches[encumbrance] = process_tile(tile_id, encumbrance, parcels_tile, encumbrance_tile, method, metric_crs)
+    return batches
+
+
+# Function to run all layers over balanced tiles
+def run_tiled_processing(
+        fips_list: list,
+        encumbrances: list,
+        max_parcels_per_tile: int = DEFAULT_MAX_PARCELS_PER_TILE,
+        max_workers: int = None,
+        method: str = 'buffer',
+        local_crs: bool = False) -> gpd.GeoDataFrame:
+    '''
+    Scores the parcels of all counties in fips_list using tiles as the unit of parallelism.
+    Layer features are loaded for the same counties, so include neighbouring counties
+    in fips_list for their features to be seen across county lines.
+    When local_crs is True, each tile is scored in its own UTM zone instead of EPSG:3857.
+
+    Parcels and layers are shared with the workers once. Each task scores one tile against every
+    layer, and at most TASKS_IN_FLIGHT_PER_WORKER tasks per worker are submitted at a time.
+
+    Returns:
+    Parcels with every layer's metric columns, like run_parallel_processing.
+    '''
+    max_workers = max_workers or os.cpu_count() or 1
+    parcels = pd.concat([load_parcel_data(fips_code) for fips_code in fips_list], ignore_index=True)
+    parcels_projected = parcels.geometry.to_crs(projected_crs)
+
+    layers = {
+        encumbrance: load_layer_for_counties(encumbrance, fips_list, bbox=layer_bbox(parcels, encumbrance))
+        for encumbrance in encumbrances
+    }
+    layers_projected = {encumbrance: layer.geometry.to_crs(projected_crs) for encumbrance, layer in layers.items()}
+    tiles = build_tiles(parcels_projected, max_parcels_per_tile, estimate_parcel_costs(parcels_projected, layers_projected))
+
+    # Picked once per tile and shared by every layer
+    tile_crs = {
+        tile.tile_id: local_metric_crs(parcels.iloc[tile.parcel_positions]) if local_crs else None
+        for tile in tiles
+    }
+
+    # Largest tiles first so the long ones don't end up running alone at the end
+    tiles = sorted(tiles, key=lambda tile: tile.n_parcels, reverse=True)
+
+    results = {encumbrance: [] for encumbrance in encumbrances}
+    shared_blocks = []
+    try:
+        parcels_shm, parcels_handle = share_parcels(parcels)
+        shared_blocks.append(parcels_shm)
+        layer_handles = {}
+        for encumbrance, layer in layers.items():
+            layer_shm, layer_handles[encumbrance] = share_parcels(layer)
+            shared_blocks.append(layer_shm)
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+            pending = list(tiles)
+            running = set()
+            while pending or running:
+                while pending and len(running) < max_workers * TASKS_IN_FLIGHT_PER_WORKER:
+                    tile = pending.pop(0)
+                    feature_positions = {
+                        encumbrance: features_for_tile(
+                            tile,
+                            layers_projected[encumbrance],
+                            mercator_halo(tile, halo_distance(encumbrance)) if local_crs else halo_distance(encumbrance)
+                        )
+                        for encumbrance in encumbrances
+                    }
+                    running.add(executor.submit(
+                        process_tile_layers, tile.tile_id, parcels_handle, tile.parcel_positions,
+                        layer_handles, feature_positions, method, tile_crs[tile.tile_id]
+                    ))
+
+                done, running = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    for encumbrance, batch in future.result().items():
+                        results[encumbrance].append(batch)
+    finally:
+        for shm in shared_blocks:
+            release_parcels(shm)
+
+    # Tiles of the same layer can differ in columns (e.g. no intersections at all), so null-fill on concat
+    print("Merging results...")
+    layer_batches = []
+    for encumbrance, batches in results.items():
+        table = pa.concat_tables(
+            [pa.Table.from_batches([batch]) for batch in batches],
+            promote_options='permissive'
+        )
+        layer_batches.extend(table.combine_chunks().to_batches())
+
+    final_merged = assemble_encumbrance_results(parcels, layer_batches)
+    print(f"All tiles merged. Final shape: {final_merged.shape}")
+    return final_merged
@@ -0,0 +1,12 @@
+# Shared test setup
+# The POC scripts and the local engine import their sibling modules by bare name (as when they are run
+# from their own folders), and the scripts import the nation_wide package from the repo root.
+
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+for folder in (REPO_ROOT, os.path.join(REPO_ROOT, 'poc_scripts'), os.path.join(REPO_ROOT, 'nation_wide_bq')):
+    if folder not in sys.path:
+        sys.path.insert(0, folder)
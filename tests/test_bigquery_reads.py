@@ -0,0 +1,137 @@
+# Streaming BigQuery reads (nation_wide/utils.py) against a stub client
+# The stub records the SQL it is sent and returns preset Arrow batches, the way
+# client.query(sql).result(page_size=...).to_arrow_iterable() does.
+
+import json
+
+import pytest
+
+pytest.importorskip('google.cloud.bigquery')
+pytest.importorskip('pandas_gbq')
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+from shapely.geometry import Point, box
+
+from nation_wide import utils, geoparquet_io
+
+
+class StubRows:
+    def __init__(self, batches):
+        self.batches = batches
+
+    def to_arrow_iterable(self, bqstorage_client=None):
+        yield from self.batches
+
+
+class StubJob:
+    def __init__(self, client):
+        self.client = client
+
+    def result(self, page_size=None):
+        self.client.page_sizes.append(page_size)
+        return StubRows(self.client.batches)
+
+
+class StubClient:
+    def __init__(self, batches):
+        self.batches = batches
+        self.queries = []
+        self.page_sizes = []
+
+    def query(self, sql):
+        self.queries.append(sql)
+        return StubJob(self)
+
+
+def _batch(geometries, first_id: int = 1, with_wkt: bool = False) -> pa.RecordBatch:
+    columns = {
+        'parcel_id': pa.array(range(first_id, first_id + len(geometries)), pa.int64()),
+        'fips': pa.array(['01001'] * len(geometries)),
+    }
+    if with_wkt:
+        columns['geom'] = pa.array(shapely.to_wkt(geometries).tolist())
+    columns['geometry'] = pa.array(shapely.to_wkb(geometries).tolist(), pa.binary())
+    return pa.RecordBatch.from_pydict(columns)
+
+
+@pytest.fixture
+def batches():
+    return [
+        _batch([box(0, 0, 1, 1), box(2, 2, 3, 4)], first_id=1),
+        _batch([Point(5, 5).buffer(1), box(-1, -2, 0, 0), box(1, 1, 2, 2)], first_id=3),
+    ]
+
+
+def test_select_sql_projects_geometry_as_wkb_and_filters():
+    sql = utils.bigquery_select_sql('proj', 'ds', 'parcels', row_filter="fips = '01001'", geometry_col='geom')
+    assert sql == "SELECT * EXCEPT (`geom`), ST_ASBINARY(`geom`) AS geometry FROM `proj.ds.parcels` WHERE fips = '01001'"
+
+    sql = utils.bigquery_select_sql('proj', 'ds', 'parcels', columns=['parcel_id', 'geom'], geometry_col='geom')
+    assert sql == "SELECT `parcel_id`, ST_ASBINARY(`geom`) AS geometry FROM `proj.ds.parcels`"
+
+    sql = utils.bigquery_select_sql(
+        'proj', 'ds', 'parcels', query="SELECT * FROM t", columns=['parcel_id', 'geom'], geometry_col='geom', keep_geometry_col=True
+    )
+    assert sql == "SELECT `parcel_id`, `geom`, ST_ASBINARY(`geom`) AS geometry FROM (SELECT * FROM t)"
+
+
+def test_iter_bigquery_gdf_yields_one_chunk_per_batch(batches):
+    client = StubClient(batches)
+    chunks = list(utils.iter_bigquery_gdf(
+        'proj', 'ds', 'parcels', geometry_col='geom', row_filter="fips = '01001'", batch_size=2, client=client
+    ))
+
+    assert client.queries == [
+        "SELECT * EXCEPT (`geom`), ST_ASBINARY(`geom`) AS geometry FROM `proj.ds.parcels` WHERE fips = '01001'"
+    ]
+    assert client.page_sizes == [2]
+    assert [len(chunk) for chunk in chunks] == [2, 3]
+    assert chunks[1]['parcel_id'].tolist() == [3, 4, 5]
+    assert chunks[0].crs == 'EPSG:4326'
+    assert chunks[0].geometry.iloc[1].equals(box(2, 2, 3, 4))
+
+
+def test_read_bigquery_to_gdf_keeps_geometry_col_as_wkt():
+    geometries = [box(0, 0, 1, 1), box(2, 2, 3, 4)]
+    client = StubClient([_batch(geometries, with_wkt=True)])
+    gdf = utils.read_bigquery_to_gdf('proj', 'ds', 'parcels', output='gdf', geometry_col='geom', client=client)
+
+    assert client.queries == ["SELECT *, ST_ASBINARY(`geom`) AS geometry FROM `proj.ds.parcels`"]
+    assert list(gdf.columns) == ['parcel_id', 'fips', 'geom', 'geometry']
+    assert gdf['geom'].tolist() == shapely.to_wkt(geometries).tolist()
+    assert shapely.equals(gdf.geometry.to_numpy(), shapely.from_wkt(gdf['geom'].to_numpy())).all()
+
+
+def test_bigquery_to_geoparquet_writes_covering_bbox_and_metadata(batches, tmp_path):
+    output_path = str(tmp_path / 'parcels.parquet')
+    client = StubClient(batches)
+    rows = utils.bigquery_to_geoparquet('proj', 'ds', 'parcels', output_path, geometry_col='geom', client=client, row_group_size=2)
+
+    assert rows == 5
+    parquet_file = pq.ParquetFile(output_path)
+    assert parquet_file.metadata.num_rows == 5
+    # Each batch is written separately and split at row_group_size
+    assert [parquet_file.metadata.row_group(i).num_rows for i in range(parquet_file.metadata.num_row_groups)] == [2, 2, 1]
+
+    geo = json.loads(parquet_file.schema_arrow.metadata[b'geo'])
+    assert geo['version'] == '1.1.0'
+    assert geo['primary_column'] == 'geometry'
+    assert geo['columns']['geometry']['encoding'] == 'WKB'
+    assert geo['columns']['geometry']['covering']['bbox']['xmin'] == [geoparquet_io.BBOX_COLUMN, 'xmin']
+
+    assert geoparquet_io.has_bbox_covering(output_path)
+    table = pq.read_table(output_path)
+    bbox = table.column(geoparquet_io.BBOX_COLUMN).to_pylist()
+    assert bbox[1] == {'xmin': 2.0, 'ymin': 2.0, 'xmax': 3.0, 'ymax': 4.0}
+
+    # Bbox filtering works on the written file
+    gdf = geoparquet_io.read_geoparquet(output_path, bbox=(1.5, 1.5, 3.5, 3.5))
+    assert sorted(gdf['parcel_id']) == [2, 5]
+
+
+def test_bigquery_to_geoparquet_writes_no_file_for_empty_result(tmp_path):
+    output_path = tmp_path / 'empty.parquet'
+    rows = utils.bigquery_to_geoparquet('proj', 'ds', 'parcels', str(output_path), geometry_col='geom', client=StubClient([]))
+    assert rows == 0
+    assert not output_path.exists()
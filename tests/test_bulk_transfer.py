@@ -0,0 +1,133 @@
+# Bulk uploads and wildcard load batches (nation_wide/bulk_transfer.py) against LocalObjectStore
+
+import os
+
+import pytest
+
+from nation_wide import bulk_transfer
+from nation_wide.bulk_transfer import LocalObjectStore, upload_folder, wildcard_batches, local_md5
+
+CHUNK_BYTES = 1024
+
+
+def _write(path, size: int, seed: int = 0) -> str:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(bytes((seed + i * 7) % 251 for i in range(size)))
+    return str(path)
+
+
+@pytest.fixture
+def source(tmp_path):
+    folder = tmp_path / 'source'
+    for seed, filename in enumerate(['AK_02013_roads.parquet', 'AK_02016_roads.parquet', 'CA_06001_roads.parquet']):
+        _write(folder / filename, 3000 + 500 * seed, seed)
+    return str(folder)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalObjectStore(str(tmp_path / 'bucket'))
+
+
+def test_rerun_skips_objects_with_matching_md5(source, store):
+    first = upload_folder(store, source, 'county', max_workers=2)
+    assert sorted(first['uploaded']) == [
+        'county/AK_02013_roads.parquet', 'county/AK_02016_roads.parquet', 'county/CA_06001_roads.parquet'
+    ]
+    assert first['skipped'] == [] and first['failed'] == []
+
+    second = upload_folder(store, source, 'county', max_workers=2)
+    assert second['uploaded'] == []
+    assert len(second['skipped']) == 3
+
+    # Only the file that changed goes up again
+    _write(os.path.join(source, 'CA_06001_roads.parquet'), 4200, 9)
+    third = upload_folder(store, source, 'county', max_workers=2)
+    assert third['uploaded'] == ['county/CA_06001_roads.parquet']
+    assert sorted(third['skipped']) == ['county/AK_02013_roads.parquet', 'county/AK_02016_roads.parquet']
+    assert store.list_hashes('county/')['county/CA_06001_roads.parquet'] == local_md5(os.path.join(source, 'CA_06001_roads.parquet'))
+
+
+def test_chunked_upload_resumes_from_partial(tmp_path, store):
+    local_path = _write(tmp_path / 'TX_state.parquet', 10 * CHUNK_BYTES + 123)
+    with open(local_path, 'rb') as f:
+        head = f.read(4 * CHUNK_BYTES)
+    # An interrupted attempt left the first four chunks behind
+    partial = os.path.join(store.root, 'state', 'TX_state.parquet' + LocalObjectStore.PARTIAL_SUFFIX)
+    os.makedirs(os.path.dirname(partial))
+    with open(partial, 'wb') as f:
+        f.write(head)
+    # Partial objects are not listed, so the file is not mistaken for uploaded
+    assert store.list_hashes('state/') == {}
+
+    result = bulk_transfer.upload_files(
+        store, [(local_path, 'state/TX_state.parquet')], 'state/', large_file_bytes=CHUNK_BYTES, chunk_size=CHUNK_BYTES
+    )
+    assert result['uploaded'] == ['state/TX_state.parquet']
+    assert not os.path.exists(partial)
+    assert store.list_hashes('state/') == {'state/TX_state.parquet': local_md5(local_path)}
+
+
+def test_checksum_mismatch_fails_and_discards_partial(tmp_path, store):
+    local_path = _write(tmp_path / 'TX_state.parquet', 10 * CHUNK_BYTES + 123)
+    # A corrupt partial is continued from (the bytes already sent are not re-read), so the MD5 check must catch it
+    partial = os.path.join(store.root, 'state', 'TX_state.parquet' + LocalObjectStore.PARTIAL_SUFFIX)
+    os.makedirs(os.path.dirname(partial))
+    with open(partial, 'wb') as f:
+        f.write(b'\0' * (2 * CHUNK_BYTES))
+
+    result = bulk_transfer.upload_files(
+        store, [(local_path, 'state/TX_state.parquet')], 'state/', large_file_bytes=CHUNK_BYTES, chunk_size=CHUNK_BYTES
+    )
+    assert result['uploaded'] == []
+    [(name, error)] = result['failed']
+    assert name == 'state/TX_state.parquet'
+    assert 'Checksum mismatch' in str(error)
+    assert not os.path.exists(partial)
+    assert store.list_hashes('state/') == {}
+
+    # The retry starts from scratch and succeeds
+    retry = bulk_transfer.upload_files(
+        store, [(local_path, 'state/TX_state.parquet')], 'state/', large_file_bytes=CHUNK_BYTES, chunk_size=CHUNK_BYTES
+    )
+    assert retry['uploaded'] == ['state/TX_state.parquet']
+
+
+def _put(store, tmp_path, name: str, size: int):
+    local_path = _write(tmp_path / 'objects' / name.replace('/', '_'), size)
+    store.upload(local_path, name)
+
+
+def test_wildcard_batches_group_by_state(tmp_path, store):
+    for name in ['county/AK_02013_roads.parquet', 'county/AK_02016_roads.parquet',
+                 'county/CA_06001_roads.parquet', 'county/CA_06003_roads.parquet',
+                 'county/NV_32001_roads.parquet', 'county/NV_32003_roads.csv']:
+        _put(store, tmp_path, name, 100)
+    # TX has objects in two folders, so no single wildcard matches exactly its objects
+    _put(store, tmp_path, 'county/TX_48001_roads.parquet', 100)
+    _put(store, tmp_path, 'county/extra/TX_48003_roads.parquet', 100)
+
+    batches = wildcard_batches(store, 'county/', groups_per_job=2)
+    assert batches == [
+        ('AK-CA', [store.uri('county/AK_*.parquet'), store.uri('county/CA_*.parquet')]),
+        ('NV-TX', [
+            store.uri('county/NV_*.parquet'),
+            store.uri('county/TX_48001_roads.parquet'),
+            store.uri('county/extra/TX_48003_roads.parquet'),
+        ]),
+    ]
+
+
+def test_wildcard_batches_split_on_max_bytes(tmp_path, store):
+    for state, size in [('AK', 400), ('CA', 500), ('NV', 300), ('TX', 900)]:
+        _put(store, tmp_path, f"county/{state}_00001_roads.parquet", size)
+        _put(store, tmp_path, f"county/{state}_00002_roads.parquet", size)
+
+    # Per-state bytes: AK 800, CA 1000, NV 600, TX 1800; a state larger than the limit gets its own job
+    batches = wildcard_batches(store, 'county/', groups_per_job=10, max_bytes_per_job=1800)
+    assert [key for key, _ in batches] == ['AK-CA', 'NV-NV', 'TX-TX']
+    assert batches[0][1] == [store.uri('county/AK_*.parquet'), store.uri('county/CA_*.parquet')]
+
+    # Without a byte limit only groups_per_job splits
+    assert [key for key, _ in wildcard_batches(store, 'county/', groups_per_job=10)] == ['AK-TX']
@@ -0,0 +1,174 @@
+# Incremental refresh of the local engine (run_procedures_incremental.txt, incremental_refresh.sql)
+# A small parcel grid and two roads are written as GeoParquet. One road is moved between runs, and the
+# merged proximity table is checked against a full rebuild of the same inputs.
+
+import pytest
+
+duckdb = pytest.importorskip('duckdb')
+gpd = pytest.importorskip('geopandas')
+import pandas as pd
+from pandas.testing import assert_frame_equal
+from shapely.geometry import box, LineString
+
+import local_engine
+from local_engine import LocalProcedureEngine, LINE_BUFFER_TIERS
+
+# Fixtures are laid out in the engine's metric CRS, so distances below are the ones the engine measures
+ORIGIN_X, ORIGIN_Y = 500000, 1900000
+PARCEL_SPACING = 100
+PARCEL_SIZE = 80
+GRID_COLUMNS, GRID_ROWS = 40, 4
+MAX_TIER_METERS = max(buffer_meters for buffer_meters, _ in LINE_BUFFER_TIERS)
+
+# Road 1 moves 200 m east between runs; road 2 (far east) never changes
+ROAD_1_X_OLD, ROAD_1_X_NEW = 300, 500
+ROAD_2_X = 3800
+
+PROXIMITY_TABLE = 'proximity_intersection_roadways'
+
+
+def _spatial_available() -> bool:
+    try:
+        duckdb.connect().execute("INSTALL spatial; LOAD spatial;")
+        return True
+    except duckdb.Error:
+        return False
+
+
+@pytest.fixture(scope='module', autouse=True)
+def require_spatial():
+    if not _spatial_available():
+        pytest.skip("DuckDB spatial extension is not available")
+
+
+def _parcels() -> gpd.GeoDataFrame:
+    rows = []
+    for i in range(GRID_COLUMNS):
+        for j in range(GRID_ROWS):
+            minx, miny = ORIGIN_X + i * PARCEL_SPACING, ORIGIN_Y + j * PARCEL_SPACING
+            rows.append({
+                'parcelPTID': i * GRID_ROWS + j + 1,
+                'clip': f"clip_{i}_{j}",
+                'sourcedFips': '17001',
+                'geometry': box(minx, miny, minx + PARCEL_SIZE, miny + PARCEL_SIZE),
+            })
+    return gpd.GeoDataFrame(rows, crs=local_engine.DEFAULT_METRIC_CRS)
+
+
+def _road(x: float) -> LineString:
+    return LineString([(ORIGIN_X + x, ORIGIN_Y - 200), (ORIGIN_X + x, ORIGIN_Y + GRID_ROWS * PARCEL_SPACING + 200)])
+
+
+def _roadways(road_1_x: float) -> gpd.GeoDataFrame:
+    return gpd.GeoDataFrame(
+        {'ID': ['road_1', 'road_2'], 'ROADNAME': ['Main St', 'Far Rd']},
+        geometry=[_road(road_1_x), _road(ROAD_2_X)],
+        crs=local_engine.DEFAULT_METRIC_CRS
+    )
+
+
+def _write_inputs(folder, road_1_x: float) -> dict:
+    folder.mkdir(parents=True, exist_ok=True)
+    inputs = {}
+    for name, gdf in (('parcels', _parcels()), ('roadways', _roadways(road_1_x))):
+        path = folder / f"{name}.parquet"
+        gdf.to_crs(local_engine.GEO_CRS).to_parquet(path)
+        inputs[name] = str(path)
+    return inputs
+
+
+def _run_incremental(inputs: dict, database: str):
+    """Runs the roadways part of run_procedures_incremental.txt against database."""
+    with LocalProcedureEngine(inputs, database=database) as engine:
+        engine.detect_feature_changes('parcels', 'parcelPTID')
+        engine.detect_feature_changes('roadways', 'ID')
+        engine.find_affected_parcels('roadways')
+        engine.calculate_proximity_score_lines_batch('roadways', 'ID', 'affected_parcels_roadways')
+        engine.merge_delta(PROXIMITY_TABLE, 'parcelPTID', 'affected_parcels_roadways')
+        engine.commit_feature_hashes('parcels')
+        engine.commit_feature_hashes('roadways')
+
+
+def _run_full(inputs: dict, database: str):
+    """Runs the roadways part of run_procedures.txt against a fresh database."""
+    with LocalProcedureEngine(inputs, database=database) as engine:
+        engine.create_materialized_view('parcels')
+        engine.create_materialized_view('roadways')
+        engine.calculate_proximity_score_lines_batch('roadways', 'ID')
+
+
+def _read(database: str, sql: str) -> pd.DataFrame:
+    with LocalProcedureEngine({}, database=database) as engine:
+        return engine.con.execute(sql).fetchdf()
+
+
+def _read_proximity_table(database: str) -> pd.DataFrame:
+    return _read(
+        database,
+        f"SELECT * REPLACE (ST_AsText(geometry) AS geometry) FROM {PROXIMITY_TABLE} ORDER BY parcelPTID"
+    ).reset_index(drop=True)
+
+
+def _distance_to_road(road_x: float) -> pd.Series:
+    parcels = _parcels()
+    return parcels.geometry.distance(_road(road_x)).set_axis(parcels['parcelPTID'].astype(str))
+
+
+@pytest.fixture
+def moved_road(tmp_path):
+    """Database after a first run with the original roads and a second one with road 1 moved."""
+    database = str(tmp_path / 'incremental.duckdb')
+    _run_incremental(_write_inputs(tmp_path / 'v1', ROAD_1_X_OLD), database)
+    inputs_v2 = _write_inputs(tmp_path / 'v2', ROAD_1_X_NEW)
+    _run_incremental(inputs_v2, database)
+    return database, inputs_v2
+
+
+def test_moved_feature_is_detected_as_modified(moved_road):
+    database, _ = moved_road
+    changes = _read(database, "SELECT feature_id, change_type FROM roadways_changes")
+    assert changes.to_dict('records') == [{'feature_id': 'road_1', 'change_type': 'modified'}]
+    assert _read(database, "SELECT COUNT(*) AS n FROM parcels_changes")['n'].iloc[0] == 0
+
+
+def test_affected_parcels_are_within_max_tier_of_old_or_new_geometry(moved_road):
+    database, _ = moved_road
+    affected = set(_read(database, "SELECT parcel_id FROM affected_parcels_roadways")['parcel_id'])
+    distance = pd.concat([_distance_to_road(ROAD_1_X_OLD), _distance_to_road(ROAD_1_X_NEW)], axis=1).min(axis=1)
+
+    # A few metres of slack for the 1 m simplification in the materialized views
+    inside = set(distance.index[distance < MAX_TIER_METERS - 5])
+    outside = set(distance.index[distance > MAX_TIER_METERS + 5])
+    assert inside and outside
+    assert inside <= affected
+    assert not (outside & affected)
+
+
+def test_merged_table_matches_full_rebuild(moved_road, tmp_path):
+    database, inputs_v2 = moved_road
+    full_database = str(tmp_path / 'full.duckdb')
+    _run_full(inputs_v2, full_database)
+
+    merged = _read_proximity_table(database)
+    rebuilt = _read_proximity_table(full_database)
+    assert_frame_equal(merged[rebuilt.columns], rebuilt)
+
+    # Parcels next to the old position lost their intersection, parcels next to the new one gained it
+    labels = merged.set_index(merged['parcelPTID'].astype(str))['proximity_label']
+    old_neighbours = _distance_to_road(ROAD_1_X_OLD).loc[lambda d: d == 0].index
+    new_neighbours = _distance_to_road(ROAD_1_X_NEW).loc[lambda d: d == 0].index
+    assert (labels.loc[new_neighbours] == 'intersects').all()
+    assert not (labels.loc[old_neighbours] == 'intersects').any()
+
+
+def test_unchanged_run_is_a_no_op(moved_road):
+    database, inputs_v2 = moved_road
+    before = _read_proximity_table(database)
+
+    _run_incremental(inputs_v2, database)
+
+    assert _read(database, "SELECT COUNT(*) AS n FROM roadways_changes")['n'].iloc[0] == 0
+    assert _read(database, "SELECT COUNT(*) AS n FROM parcels_changes")['n'].iloc[0] == 0
+    assert _read(database, "SELECT COUNT(*) AS n FROM affected_parcels_roadways")['n'].iloc[0] == 0
+    assert _read(database, f"SELECT COUNT(*) AS n FROM {PROXIMITY_TABLE}_delta")['n'].iloc[0] == 0
+    assert_frame_equal(_read_proximity_table(database), before)
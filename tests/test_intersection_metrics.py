@@ -0,0 +1,46 @@
+# Intersection metrics and scores of layers with no parcel in the smallest tier (poc_tested_modules.py)
+
+import pytest
+
+pytest.importorskip('google.cloud.bigquery')
+pytest.importorskip('pandas_gbq')
+import geopandas as gpd
+from shapely.geometry import box, LineString
+
+import poc_tested_modules
+from poc_tested_modules import (
+    get_proximity_score_and_intersection_metrics,
+    calculate_intersection_score,
+    intersection_metric_columns,
+)
+
+# Layers are laid out in a metric CRS; the nearest feature is about 400 m from the parcels
+METRIC_CRS = 'EPSG:5070'
+
+
+def _parcels() -> gpd.GeoDataFrame:
+    parcels = gpd.GeoDataFrame({'parcelPTID': [1, 2]}, geometry=[box(0, 0, 80, 80), box(100, 0, 180, 80)], crs=METRIC_CRS)
+    parcels['centroid'] = parcels.geometry.centroid.to_crs(poc_tested_modules.geo_crs).to_wkt()
+    return parcels.to_crs(poc_tested_modules.geo_crs)
+
+
+def _layer(geometry) -> gpd.GeoDataFrame:
+    return gpd.GeoDataFrame({'ID': ['f1']}, geometry=[geometry], crs=METRIC_CRS).to_crs(poc_tested_modules.geo_crs)
+
+
+@pytest.mark.parametrize('method', ['buffer', 'nearest'])
+def test_polygon_layer_without_smallest_tier_match_scores(method):
+    scored = get_proximity_score_and_intersection_metrics('wetlands', _parcels(), _layer(box(580, 0, 700, 80)), method=method)
+    assert set(intersection_metric_columns('wetlands')) <= set(scored.columns)
+    assert scored[intersection_metric_columns('wetlands')].isna().all().all()
+
+    # Scoring used to fail with a KeyError on the missing metric columns
+    final = calculate_intersection_score('wetlands', scored)
+    assert final['intersection_label_wetlands'].isna().all()
+
+
+@pytest.mark.parametrize('method', ['buffer', 'nearest'])
+def test_line_layer_without_smallest_tier_match_has_metric_columns(method):
+    road = _layer(LineString([(600, -50), (600, 200)]))
+    scored = get_proximity_score_and_intersection_metrics('roadways', _parcels(), road, method=method)
+    assert scored[intersection_metric_columns('roadways')].isna().all().all()
@@ -0,0 +1,53 @@
+# Relabeling stored raw metrics with the product tiers (poc_scripts/poc_metrics_store.py)
+
+import json
+
+import pytest
+
+pytest.importorskip('google.cloud.bigquery')
+pytest.importorskip('pandas_gbq')
+import geopandas as gpd
+import pyarrow as pa
+from shapely.geometry import box
+
+import poc_tested_modules
+from poc_county_encumbrances import PARCEL_ID_COLUMN
+from poc_metrics_store import STORE_METADATA_KEY, compute_raw_metrics, label_metrics, tier_table, read_raw_metrics, write_raw_metrics
+
+
+def _inputs():
+    # A parcel about 40°N and a wetland 60 m east of it (in the county's UTM zone)
+    utm = 'EPSG:32616'
+    parcels = gpd.GeoDataFrame({PARCEL_ID_COLUMN: ['p1']}, geometry=[box(400000, 4430000, 400080, 4430080)], crs=utm)
+    parcels['centroid'] = parcels.geometry.centroid.to_crs(poc_tested_modules.geo_crs).to_wkt()
+    wetlands = gpd.GeoDataFrame({'ID': ['w1']}, geometry=[box(400140, 4430000, 400260, 4430080)], crs=utm)
+    return parcels.to_crs(poc_tested_modules.geo_crs), wetlands.to_crs(poc_tested_modules.geo_crs), utm
+
+
+def _metadata(table: pa.Table) -> dict:
+    return json.loads(table.schema.metadata[STORE_METADATA_KEY])
+
+
+def test_product_tiers_are_rejected_for_web_mercator_metrics():
+    parcels, wetlands, _ = _inputs()
+    table = compute_raw_metrics('wetlands', parcels, wetlands)
+    assert _metadata(table)['metric_crs'] == poc_tested_modules.projected_crs
+
+    raw = table.to_pandas().set_index(PARCEL_ID_COLUMN)
+    # EPSG:3857 stretches the 60 m gap by about 1/cos(40°), past the 75 m product tier
+    assert raw['shortest_distance'].iloc[0] > 75
+    with pytest.raises(ValueError, match='geodesic'):
+        label_metrics(raw, 'wetlands', tier_table('wetlands', 'product'), _metadata(table), geodesic=True)
+    # The Python tiers are measured in EPSG:3857 by the pipeline as well
+    label_metrics(raw, 'wetlands', tier_table('wetlands', 'python'), _metadata(table))
+
+
+def test_product_tiers_label_local_crs_metrics(tmp_path):
+    parcels, wetlands, utm = _inputs()
+    table = compute_raw_metrics('wetlands', parcels, wetlands, metric_crs=utm)
+    write_raw_metrics(table, str(tmp_path), 'wetlands', '17001')
+
+    raw, metadata = read_raw_metrics(str(tmp_path), 'wetlands')
+    assert raw['shortest_distance'].iloc[0] == pytest.approx(60, abs=0.1)
+    labels = label_metrics(raw, 'wetlands', tier_table('wetlands', 'product'), metadata, geodesic=True)
+    assert labels['proximity_score_wetlands'].tolist() == ['medium']